@@ -0,0 +1,53 @@
+"""
+Compare the threaded and asyncio delivery engines against the local stand-in SMTP server.
+
+Usage:
+    python benchmarks/bench_engines.py [--messages 2000] [--sessions 1 10 100] [--latency 0.01]
+"""
+# Import required modules
+import argparse
+import os
+import queue
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastmail_core.aiosmtp import AsyncSMTPEngine
+from fastmail_core.message import CampaignMessage
+from fastmail_core.pool import SMTPPool
+from fastmail_core.senders import SenderAccount
+from smtp_server import StandInSMTPServer
+
+SENDER = "sender@example.com"
+
+def run_engine(engine_name, server, sessions, to_list, campaign):
+  """
+  Send the campaign once with the chosen engine and return the elapsed time.
+  """
+  account = SenderAccount(SENDER, "password", "127.0.0.1", sessions, port=server.port, use_starttls=False)
+  start = time.perf_counter()
+  engine_class = SMTPPool if engine_name == "threads" else AsyncSMTPEngine
+  engine = engine_class([account], queue.Queue())
+  engine.run(enumerate(to_list), lambda i, email, account: campaign.render(email))
+  return time.perf_counter() - start
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--messages", type=int, default=2000)
+  parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 100])
+  parser.add_argument("--latency", type=float, default=0.01, help="server reply delay in seconds")
+  args = parser.parse_args()
+
+  campaign = CampaignMessage("Benchmark", "<p>Hello</p>" * 50, SENDER)
+  to_list = [f"user{i}@example.com" for i in range(args.messages)]
+
+  with StandInSMTPServer(latency=args.latency) as server:
+      for sessions in args.sessions:
+          for engine_name in ("threads", "asyncio"):
+              elapsed = run_engine(engine_name, server, sessions, to_list, campaign)
+              print(f"{engine_name:<8} sessions={sessions:<4} "
+                    f"{args.messages / elapsed:8.1f} msg/s  ({elapsed:.2f}s)")
+
+if __name__ == "__main__":
+  main()
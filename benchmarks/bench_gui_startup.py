@@ -0,0 +1,54 @@
+"""
+Measure GUI startup: launch the app several times and report the median time of
+each startup phase (import, widget build, first paint).
+
+The app writes one JSON line per launch to the file named by FASTMAIL_STARTUP_REPORT
+and closes itself once the window is painted when FASTMAIL_STARTUP_EXIT is set.
+Needs a display (on a headless machine run it under xvfb-run).
+
+Usage:
+    python benchmarks/bench_gui_startup.py [--runs 5] [--exe Deployement/dist/fastMail/fastMail]
+"""
+# Import required modules
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PHASES = ["import_ms", "widgets_ms", "first_paint_ms", "total_ms"]
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--runs", type=int, default=5)
+  parser.add_argument("--exe", help="packaged executable to launch instead of fastMail.py")
+  parser.add_argument("--output", help="also append the medians to this file as one JSON line")
+  args = parser.parse_args()
+
+  command = [args.exe] if args.exe else [sys.executable, "fastMail.py"]
+  with tempfile.TemporaryDirectory() as tmp:
+      report_file = os.path.join(tmp, "startup.jsonl")
+      env = dict(os.environ, FASTMAIL_STARTUP_REPORT=report_file, FASTMAIL_STARTUP_EXIT="1")
+      wall_times = []
+      for _ in range(args.runs):
+          start = time.perf_counter()
+          subprocess.run(command, cwd=ROOT, env=env, check=True)
+          wall_times.append((time.perf_counter() - start) * 1000)
+      with open(report_file, encoding="utf-8") as f:
+          reports = [json.loads(line) for line in f]
+
+  medians = {phase: statistics.median(report[phase] for report in reports) for phase in PHASES}
+  medians["process_ms"] = statistics.median(wall_times)
+  for phase, value in medians.items():
+      print(f"{phase:<16} {value:8.1f}")
+  if args.output:
+      with open(args.output, "a", encoding="utf-8") as f:
+          f.write(json.dumps(dict(medians, time=time.strftime("%Y-%m-%dT%H:%M:%S"), runs=args.runs)) + "\n")
+
+if __name__ == "__main__":
+  main()
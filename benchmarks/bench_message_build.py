@@ -0,0 +1,84 @@
+"""
+Benchmark the per-message build cost of a campaign.
+
+Compares the old per-recipient path (new EmailMessage, re-read and re-encode the PDF,
+flatten) with the precompiled CampaignMessage from fastmail_core.message, whose
+attachment is encoded in chunks while the message is streamed.
+
+Usage:
+    python benchmarks/bench_message_build.py [--attachment-mb 5] [--messages 200]
+"""
+# Import required modules
+import argparse
+import os
+import sys
+import tempfile
+import time
+from email import policy
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastmail_core.esmtp import message_chunks
+from fastmail_core.message import CampaignMessage
+
+SENDER = "sender@example.com"
+SUBJECT = "Benchmark campaign"
+BODY = "<b>Hello</b> " + "lorem ipsum dolor sit amet " * 200
+
+def build_legacy(to_email, footer_html, pdf_file):
+  """
+  Build one message the way send_email used to: everything from scratch.
+  """
+  msg = EmailMessage()
+  msg.set_content(BODY + footer_html, subtype='html')
+  msg['Subject'] = SUBJECT
+  msg['To'] = to_email
+  msg['From'] = SENDER
+  with open(pdf_file, 'rb') as f:
+      msg.add_attachment(f.read(), maintype='application', subtype='pdf',
+                         filename=os.path.basename(pdf_file))
+  return msg.as_bytes(policy=policy.SMTP)
+
+def stream(data):
+  """
+  Go through a rendered message's chunks as sending it would.
+  """
+  for chunk in message_chunks(data):
+      pass
+
+def run(label, build, count):
+  """
+  Time `count` builds and print the per-message cost.
+  """
+  start = time.perf_counter()
+  for i in range(count):
+      build(f"user{i}@example.com", f"<br><br>Merci,<br>{SENDER} [{i + 1}]")
+  elapsed = time.perf_counter() - start
+  print(f"{label:<12} {count} messages in {elapsed:.3f}s  ({elapsed / count * 1e3:.3f} ms/message)")
+  return elapsed
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--attachment-mb", type=float, default=5)
+  parser.add_argument("--messages", type=int, default=200)
+  args = parser.parse_args()
+
+  with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+      f.write(os.urandom(int(args.attachment_mb * 1024 * 1024)))
+      pdf_file = f.name
+
+  try:
+      legacy = run("legacy", lambda to, footer: build_legacy(to, footer, pdf_file), args.messages)
+
+      start = time.perf_counter()
+      campaign = CampaignMessage(SUBJECT, BODY, SENDER, [pdf_file])
+      print(f"{'compile':<12} once in {time.perf_counter() - start:.3f}s")
+      compiled = run("precompiled", lambda to, footer: stream(campaign.render(to, footer)), args.messages)
+
+      print(f"speedup      {legacy / compiled:.1f}x")
+  finally:
+      os.remove(pdf_file)
+
+if __name__ == "__main__":
+  main()
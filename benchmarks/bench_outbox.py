@@ -0,0 +1,119 @@
+"""
+Compare sending a campaign from the app's process with sending it through the
+outbox with 1, 2, 4... delivery worker processes, against the local stand-in
+SMTP/STARTTLS server.
+
+Each worker opens --sessions SMTP sessions; the in-process run of the same row
+opens as many sessions as all the workers together, so the difference is what
+the separate processes bring (more CPU than one Python process can use). Rate
+limits are disabled. For the outbox, the time to render the messages into the
+spool and the time the workers take to send them are reported apart.
+
+Usage:
+    python benchmarks/bench_outbox.py [--messages 2000] [--workers 1 2 4] [--sessions 4] [--latency 0.01]
+"""
+# Import required modules
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_suite import ProgressCollector, make_attachment, make_body, make_certificate
+from smtp_server import StandInSMTPServer
+
+SENDER = "sender@example.com"
+
+def campaign_settings(server, sessions, engine, workers):
+  from fastmail_core.senders import DEFAULT_SENDER
+  from fastmail_core.settings import DEFAULT_SETTINGS
+
+  sender = dict(DEFAULT_SENDER, sender_email=SENDER, app_password="password", smtp_server=server,
+                smtp_connections=str(sessions),
+                rate_per_second="", rate_per_minute="", rate_per_hour="", rate_per_day="", rate_jitter="0")
+  return dict(DEFAULT_SETTINGS, senders=[sender], delivery_engine=engine, domain_limits="",
+              delivery_workers=str(workers))
+
+def run_in_process(settings, body, attachments, to_list):
+  """
+  Send with send_bulk_emails and return the elapsed time.
+  """
+  from fastmail_core.campaign import send_bulk_emails
+
+  start = time.perf_counter()
+  send_bulk_emails("Benchmark", body, attachments, to_list, settings, ProgressCollector(), metrics_dir=None,
+                   attachment_cache_dir=None)
+  return time.perf_counter() - start
+
+def run_outbox(settings, body, attachments, to_list, data_dir, workers):
+  """
+  Send through the outbox of `data_dir` and return the render and delivery times.
+  The workers start with the first spooled message, as in send_to_outbox, so
+  the delivery time is what is left once every message is rendered.
+  """
+  from fastmail_core.journal import SendJournal
+  from fastmail_core.outbox import spool_campaign, start_workers, watch_campaign
+  from fastmail_core.settings import save_settings
+
+  progress = ProgressCollector()
+  os.makedirs(data_dir, exist_ok=True)
+  # The workers read the sender passwords from the settings file
+  save_settings(settings, os.path.join(data_dir, "settings.xml"))
+  journal = SendJournal(os.path.join(data_dir, "journal.sqlite3"), "benchmark")
+  marks = []
+
+  def spooling(campaign):
+      marks.append(campaign.progress_mark())
+      start_workers(data_dir, workers)
+
+  start = time.perf_counter()
+  try:
+      campaign, total = spool_campaign("Benchmark", body, attachments, to_list, settings, journal, data_dir,
+                                       attachment_cache_dir=os.path.join(data_dir, "attachment_cache"),
+                                       spooling=spooling)
+  finally:
+      journal.close()
+  spooled = time.perf_counter()
+  watch_campaign(campaign, total, progress, since=marks[0])
+  if progress.sent != total:
+      raise RuntimeError(f"only {progress.sent} of {total} messages were sent")
+  return spooled - start, time.perf_counter() - spooled
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--messages", type=int, default=2000)
+  parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+  parser.add_argument("--sessions", type=int, default=4, help="SMTP sessions per worker")
+  parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads")
+  parser.add_argument("--body-kb", type=int, default=10)
+  parser.add_argument("--attachment-kb", type=int, default=100)
+  parser.add_argument("--latency", type=float, default=0.01, help="server reply delay in seconds")
+  args = parser.parse_args()
+
+  to_list = [f"user{i}@example.com" for i in range(args.messages)]
+  body = make_body(args.body_kb)
+  with tempfile.TemporaryDirectory() as tmp:
+      certfile, keyfile = make_certificate(tmp)
+      # The engines verify the server certificate, here and in the worker processes
+      os.environ["SSL_CERT_FILE"] = certfile
+      attachment = make_attachment(tmp, args.attachment_kb)
+      attachments = [attachment] if attachment else []
+
+      print(f"{os.cpu_count()} CPUs, {args.messages} messages, {args.sessions} sessions per worker")
+      print(f"{'workers':>7} {'in-process msg/s':>17} {'outbox msg/s':>13} {'render s':>9} {'deliver s':>10}")
+      with StandInSMTPServer(latency=args.latency, certfile=certfile, keyfile=keyfile) as server:
+          address = f"127.0.0.1:{server.port}"
+          for workers in args.workers:
+              in_process = run_in_process(campaign_settings(address, args.sessions * workers, args.engine, 1),
+                                          body, attachments, to_list)
+              data_dir = os.path.join(tmp, f"outbox-{workers}")
+              render, deliver = run_outbox(campaign_settings(address, args.sessions, args.engine, workers),
+                                           body, attachments, to_list, data_dir, workers)
+              print(f"{workers:>7} {args.messages / in_process:>17.1f} {args.messages / (render + deliver):>13.1f} "
+                    f"{render:>9.2f} {deliver:>10.2f}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,72 @@
+"""
+Benchmark the progress pipeline: sender threads put events on the progress queue
+as fast as they can while a monitor drains it every tick, like the GUI does.
+
+Reports how many events per second the monitor folds, the slowest tick, and
+checks that the final snapshot matches what was sent.
+
+Usage:
+    python benchmarks/bench_progress.py [--events 200000] [--senders 8] [--tick 0.1]
+"""
+# Import required modules
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastmail_core.progress import ProgressState
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--events", type=int, default=200000)
+  parser.add_argument("--senders", type=int, default=8)
+  parser.add_argument("--tick", type=float, default=0.1, help="seconds between two drains")
+  args = parser.parse_args()
+
+  progress_queue = queue.Queue()
+  lock = threading.Lock()
+  counts = {"sent": 0, "failed": 0}
+
+  def sender(events):
+      # Same shape and locking as DeliveryEngine.record_sent / record_failed
+      for n in range(events):
+          with lock:
+              if n % 50 == 0:
+                  counts["failed"] += 1
+                  progress_queue.put({'emails_failed': counts["failed"], 'failed_email': "x@example.com",
+                                      'reply': (550, b"No such user"), 'in_flight': 1})
+              else:
+                  counts["sent"] += 1
+                  progress_queue.put({'emails_sent': counts["sent"], 'latency': 0.05, 'in_flight': 1})
+
+  state = ProgressState()
+  progress_queue.put({'total_emails': args.events})
+  threads = [threading.Thread(target=sender, args=(args.events // args.senders,)) for _ in range(args.senders)]
+  start = time.perf_counter()
+  for thread in threads:
+      thread.start()
+
+  folded = 0
+  slowest_tick = 0.0
+  while any(thread.is_alive() for thread in threads) or not progress_queue.empty():
+      tick_start = time.perf_counter()
+      folded += state.drain(progress_queue)
+      state.summary()
+      slowest_tick = max(slowest_tick, time.perf_counter() - tick_start)
+      time.sleep(args.tick)
+  elapsed = time.perf_counter() - start
+
+  print(f"events folded:  {folded}")
+  print(f"events/sec:     {folded / elapsed:,.0f} (producers and monitor together)")
+  print(f"slowest tick:   {slowest_tick * 1000:.1f} ms")
+  print(f"final snapshot: sent {state.sent}, refused {state.failed} "
+        f"(expected {counts['sent']}, {counts['failed']})")
+  if (state.sent, state.failed) != (counts["sent"], counts["failed"]):
+      sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,282 @@
+"""
+Benchmark suite: send campaigns through send_bulk_emails to the local stand-in
+SMTP/STARTTLS server and record throughput, latency, memory and CPU.
+
+Every combination of engine, recipient count, body size and attachment size is one
+case. Each case is sent from a fresh child process (so peak RSS and CPU time belong
+to that case alone and not to the server) with the rate limits and jitter disabled.
+Per case it reports messages/sec, p50/p99 send latency, peak RSS and CPU time per
+message, and appends one JSON line per case to --output. --compare prints the change
+against an earlier output file.
+
+The server can be made to misbehave: --latency, --refuse-rate (550), --defer-rate
+(451), --throttle-rate (recipients/sec before 451) and --disconnect-rate.
+STARTTLS uses --certfile/--keyfile, or a self-signed certificate made with openssl.
+
+Usage:
+    python benchmarks/bench_suite.py [--engines threads asyncio] [--messages 500]
+        [--body-kb 2 50] [--attachment-kb 0 500] [--output results.jsonl] [--compare baseline.jsonl]
+"""
+# Import required modules
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SENDER = "sender@example.com"
+
+# Fields that identify a case when comparing two result files
+CASE_KEYS = ("engine", "sessions", "messages", "body_kb", "attachment_kb")
+
+# ------------------------------------------------------------------------
+# Child Process: One Case
+# ------------------------------------------------------------------------
+
+class ProgressCollector:
+  """
+  Progress queue for send_bulk_emails that keeps each send latency and the final counts.
+  """
+
+  def __init__(self):
+      self.latencies = []
+      self.sent = 0
+      self.failed = 0
+
+  def put(self, message):
+      if 'emails_sent' in message:
+          self.sent = max(self.sent, message['emails_sent'])
+          if message.get('latency') is not None:
+              self.latencies.append(message['latency'])
+      if 'emails_failed' in message:
+          self.failed = max(self.failed, message['emails_failed'])
+
+def percentile(values, p):
+  """
+  Nearest-rank percentile of a list of values, or None if empty.
+  """
+  if not values:
+      return None
+  values = sorted(values)
+  return values[max(0, min(len(values) - 1, round(len(values) * p / 100) - 1))]
+
+def peak_rss_mb():
+  """
+  Peak resident set size of this process in MB, or None where unavailable.
+  """
+  try:
+      import resource
+  except ImportError:
+      return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # kilobytes on Linux, bytes on macOS
+  return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def make_body(size_kb):
+  """
+  An HTML body of about size_kb kilobytes.
+  """
+  paragraph = "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor.</p>\n"
+  return paragraph * max(1, size_kb * 1024 // len(paragraph))
+
+def run_case(case):
+  """
+  Send one case and return its measurements. Runs in the child process.
+  """
+  from fastmail_core.campaign import send_bulk_emails
+  from fastmail_core.senders import DEFAULT_SENDER
+  from fastmail_core.settings import DEFAULT_SETTINGS
+
+  sender = dict(DEFAULT_SENDER, sender_email=SENDER, app_password="password", smtp_server=case["server"],
+                smtp_connections=str(case["sessions"]),
+                rate_per_second="", rate_per_minute="", rate_per_hour="", rate_per_day="", rate_jitter="0")
+  settings = dict(DEFAULT_SETTINGS, senders=[sender], delivery_engine=case["engine"])
+  to_list = [f"user{i}@example.com" for i in range(case["messages"])]
+  body = make_body(case["body_kb"])
+  attachments = [case["attachment"]] if case["attachment"] else []
+  progress = ProgressCollector()
+
+  rss_before = peak_rss_mb()
+  error = None
+  cpu_start = time.process_time()
+  start = time.perf_counter()
+  try:
+      send_bulk_emails("Benchmark", body, attachments, to_list, settings, progress, metrics_dir=None)
+  except Exception as e:
+      error = f"{type(e).__name__}: {e}"
+  elapsed = time.perf_counter() - start
+  cpu = time.process_time() - cpu_start
+
+  handled = progress.sent + progress.failed
+  p50, p99 = percentile(progress.latencies, 50), percentile(progress.latencies, 99)
+  return {
+      "sent": progress.sent,
+      "refused": progress.failed,
+      "elapsed_s": round(elapsed, 4),
+      "msg_per_s": round(progress.sent / elapsed, 2) if elapsed else None,
+      "p50_ms": round(p50 * 1000, 3) if p50 is not None else None,
+      "p99_ms": round(p99 * 1000, 3) if p99 is not None else None,
+      "cpu_ms_per_msg": round(cpu * 1000 / handled, 4) if handled else None,
+      "rss_before_mb": round(rss_before, 1) if rss_before is not None else None,
+      "rss_peak_mb": round(peak_rss_mb(), 1) if rss_before is not None else None,
+      "error": error,
+  }
+
+# ------------------------------------------------------------------------
+# Parent Process: Server and Cases
+# ------------------------------------------------------------------------
+
+def make_certificate(directory):
+  """
+  Create a self-signed certificate for 127.0.0.1 with openssl and return (certfile, keyfile).
+  """
+  certfile, keyfile = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+  subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                  "-keyout", keyfile, "-out", certfile, "-subj", "/CN=localhost",
+                  "-addext", "subjectAltName=IP:127.0.0.1,DNS:localhost"],
+                 check=True, capture_output=True)
+  return certfile, keyfile
+
+def make_attachment(directory, size_kb):
+  """
+  A file of size_kb kilobytes of random bytes (base64 does not shrink it), or None for 0.
+  """
+  if not size_kb:
+      return None
+  path = os.path.join(directory, f"attachment_{size_kb}kb.pdf")
+  if not os.path.exists(path):
+      with open(path, "wb") as f:
+          f.write(os.urandom(size_kb * 1024))
+  return path
+
+def spawn_case(case, certfile, timeout):
+  """
+  Run one case in a child process and return its measurements.
+  """
+  # The engines verify the server certificate: trust the self-signed one
+  env = dict(os.environ, SSL_CERT_FILE=certfile)
+  result = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)],
+                          env=env, capture_output=True, text=True, timeout=timeout)
+  if result.returncode != 0:
+      return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "child failed"}
+  return json.loads(result.stdout.strip().splitlines()[-1])
+
+def run_suite(args):
+  from smtp_server import StandInSMTPServer
+
+  run_info = {
+      "type": "run",
+      "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "commit": git_commit(),
+      "server": {key: getattr(args, key) for key in
+                 ("latency", "refuse_rate", "defer_rate", "throttle_rate", "disconnect_rate")},
+  }
+  results = []
+  with tempfile.TemporaryDirectory() as tmp:
+      if args.certfile:
+          certfile, keyfile = args.certfile, args.keyfile
+      else:
+          certfile, keyfile = make_certificate(tmp)
+
+      print(f"{'engine':<8} {'sess':>4} {'msgs':>6} {'body':>6} {'attach':>7} {'msg/s':>9} "
+            f"{'p50 ms':>8} {'p99 ms':>8} {'cpu/msg':>8} {'rss MB':>7}  errors")
+      for engine, sessions, messages, body_kb, attachment_kb in itertools.product(
+              args.engines, args.sessions, args.messages, args.body_kb, args.attachment_kb):
+          with StandInSMTPServer(latency=args.latency, certfile=certfile, keyfile=keyfile,
+                                 refuse_rate=args.refuse_rate, defer_rate=args.defer_rate,
+                                 throttle_rate=args.throttle_rate, disconnect_rate=args.disconnect_rate,
+                                 seed=args.seed) as server:
+              case = {"engine": engine, "sessions": sessions, "messages": messages,
+                      "body_kb": body_kb, "attachment_kb": attachment_kb,
+                      "server": f"127.0.0.1:{server.port}", "attachment": make_attachment(tmp, attachment_kb)}
+              measured = spawn_case(case, certfile, args.timeout)
+              server_stats = {"server_replies": dict(server.replies), "server_disconnects": server.disconnects}
+
+          record = dict({key: case[key] for key in CASE_KEYS}, type="case", **measured, **server_stats)
+          results.append(record)
+          print(f"{engine:<8} {sessions:>4} {messages:>6} {body_kb:>4}KB {attachment_kb:>5}KB "
+                f"{format_value(record.get('msg_per_s')):>9} {format_value(record.get('p50_ms')):>8} "
+                f"{format_value(record.get('p99_ms')):>8} {format_value(record.get('cpu_ms_per_msg')):>8} "
+                f"{format_value(record.get('rss_peak_mb')):>7}  {record.get('error') or ''}", flush=True)
+
+  if args.output:
+      with open(args.output, "a", encoding="utf-8") as f:
+          for record in [run_info] + results:
+              f.write(json.dumps(record) + "\n")
+  if args.compare:
+      compare(args.compare, results)
+  return results
+
+def git_commit():
+  try:
+      return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                            capture_output=True, text=True).stdout.strip() or None
+  except OSError:
+      return None
+
+def format_value(value):
+  return "-" if value is None else f"{value:.2f}" if isinstance(value, float) else str(value)
+
+def compare(baseline_path, results):
+  """
+  Print the change in msg/s and p99 latency of each case against the last
+  matching case of a baseline result file.
+  """
+  baseline = {}
+  with open(baseline_path, encoding="utf-8") as f:
+      for line in f:
+          record = json.loads(line)
+          if record.get("type") == "case":
+              baseline[tuple(record[key] for key in CASE_KEYS)] = record
+
+  print(f"\nCompared with {baseline_path}:")
+  for record in results:
+      old = baseline.get(tuple(record[key] for key in CASE_KEYS))
+      label = " ".join(f"{key}={record[key]}" for key in CASE_KEYS)
+      if old is None:
+          print(f"  {label}: no baseline")
+          continue
+      changes = []
+      for key in ("msg_per_s", "p99_ms", "cpu_ms_per_msg", "rss_peak_mb"):
+          if old.get(key) and record.get(key) is not None:
+              changes.append(f"{key} {(record[key] - old[key]) / old[key] * 100:+.1f}%")
+      print(f"  {label}: {', '.join(changes) or 'not comparable'}")
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--engines", nargs="+", default=["threads", "asyncio"], choices=["threads", "asyncio"])
+  parser.add_argument("--sessions", type=int, nargs="+", default=[4])
+  parser.add_argument("--messages", type=int, nargs="+", default=[500])
+  parser.add_argument("--body-kb", type=int, nargs="+", default=[2, 50])
+  parser.add_argument("--attachment-kb", type=int, nargs="+", default=[0, 500])
+  parser.add_argument("--latency", type=float, default=0.005, help="server reply delay in seconds")
+  parser.add_argument("--refuse-rate", type=float, default=0.0, help="share of recipients refused with 550")
+  parser.add_argument("--defer-rate", type=float, default=0.0, help="share of recipients deferred with 451")
+  parser.add_argument("--throttle-rate", type=int, help="recipients accepted per second before 451")
+  parser.add_argument("--disconnect-rate", type=float, default=0.0,
+                      help="share of messages after which the server drops the connection")
+  parser.add_argument("--seed", type=int, default=1)
+  parser.add_argument("--certfile")
+  parser.add_argument("--keyfile")
+  parser.add_argument("--timeout", type=float, default=600, help="seconds allowed per case")
+  parser.add_argument("--output", help="append the results to this file as JSON lines")
+  parser.add_argument("--compare", help="earlier --output file to compare against")
+  parser.add_argument("--case", help=argparse.SUPPRESS)  # child process: run one JSON case
+  args = parser.parse_args()
+
+  if args.case:
+      print(json.dumps(run_case(json.loads(args.case))))
+  else:
+      run_suite(args)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,105 @@
+"""
+Benchmark the conversion of the email body Text widget to HTML.
+
+Compares the old per-character walk (three Tk calls per character and string
+concatenation) with the single-dump converter from fastmail_core.richtext,
+and checks that both produce the same HTML.
+
+Needs a display (on a headless machine run it under xvfb-run).
+
+Usage:
+    python benchmarks/bench_text_to_html.py [--kb 50] [--runs 3]
+"""
+# Import required modules
+import argparse
+import os
+import random
+import sys
+import time
+import tkinter as tk
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastmail_core.richtext import escape_html, get_html_closing_tag, get_html_opening_tag, text_widget_to_html
+
+TAGS = ["bold", "italic", "underline", "size_12", "size_14", "size_16",
+        "font_Georgia", "font_Comic_Sans_MS", "center"]
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "<tag>", "a&b", "\"quoted\"", "élan", "l'été"]
+
+def legacy_formatted_body(text_widget):
+  """
+  The old converter: walks the widget one character at a time.
+  """
+  html_output = ""
+  index = "1.0"
+  prev_tags = []
+  while True:
+      char = text_widget.get(index)
+      if char == "":
+          break
+      current_tags = text_widget.tag_names(index)
+      closing_tags = [tag for tag in prev_tags if tag not in current_tags]
+      opening_tags = [tag for tag in current_tags if tag not in prev_tags]
+      for tag in reversed(closing_tags):
+          html_output += get_html_closing_tag(tag)
+      for tag in opening_tags:
+          html_output += get_html_opening_tag(tag)
+      if char == "\n":
+          html_output += "<br>"
+      else:
+          html_output += escape_html(char)
+      prev_tags = current_tags
+      index = text_widget.index(f"{index}+1c")
+  for tag in reversed(prev_tags):
+      html_output += get_html_closing_tag(tag)
+  return html_output
+
+def fill_widget(text_widget, size, rng):
+  """
+  Insert about `size` characters of text and tag random overlapping ranges.
+  """
+  words = []
+  length = 0
+  while length < size:
+      word = rng.choice(WORDS)
+      words.append(word + ("\n" if rng.random() < 0.05 else " "))
+      length += len(words[-1])
+  text_widget.insert("1.0", "".join(words))
+  for _ in range(size // 100):
+      start = rng.randrange(length)
+      text_widget.tag_add(rng.choice(TAGS), f"1.0+{start}c", f"1.0+{start + rng.randrange(1, 400)}c")
+
+def timed(function, runs):
+  best = None
+  for _ in range(runs):
+      start = time.perf_counter()
+      result = function()
+      elapsed = time.perf_counter() - start
+      best = elapsed if best is None else min(best, elapsed)
+  return result, best
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--kb", type=int, default=50, help="size of the body in kilobytes")
+  parser.add_argument("--runs", type=int, default=3)
+  args = parser.parse_args()
+
+  root = tk.Tk()
+  root.withdraw()
+  text_widget = tk.Text(root)
+  for tag in TAGS:
+      text_widget.tag_configure(tag)
+  fill_widget(text_widget, args.kb * 1024, random.Random(1))
+
+  legacy_html, legacy_time = timed(lambda: legacy_formatted_body(text_widget), args.runs)
+  dump_html, dump_time = timed(lambda: text_widget_to_html(text_widget), args.runs)
+  root.destroy()
+
+  print(f"per-character: {legacy_time * 1000:9.1f} ms")
+  print(f"single dump:   {dump_time * 1000:9.1f} ms  ({legacy_time / dump_time:.0f}x faster)")
+  print(f"identical output: {legacy_html == dump_html} ({len(dump_html)} characters)")
+  if legacy_html != dump_html:
+      sys.exit(1)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,104 @@
+"""
+Simulate the campaign scheduler of the delivery workers on a virtual clock.
+
+A large newsletter is queued first; a small urgent campaign arrives while it is
+sending, and a third campaign is scheduled to start later within a sending
+window. Delivery capacity is --rate messages per second, one message at a time.
+For each policy it prints how long each campaign took from the time it could
+start (its arrival, the opening of its window): first come first served
+(the order the outbox was sent in before the scheduler) and weighted fair
+queuing with the urgent campaign at weight 1 and at --urgent-weight.
+
+Nothing is sent and no time passes: the scheduler's clock is a VirtualClock
+moved forward by the time each message takes.
+
+Usage:
+    python benchmarks/sim_campaign_scheduling.py [--newsletter 500000] [--urgent 200] [--rate 20]
+"""
+# Import required modules
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastmail_core.progress import format_duration
+from fastmail_core.scheduler import CampaignSchedule, CampaignScheduler, VirtualClock
+
+def campaigns(args, start, urgent_weight):
+  """
+  The campaigns of the simulation: (arrival time, id, messages, schedule).
+  """
+  window_start = time.localtime(start + args.scheduled_after)
+  window = (f"{window_start.tm_hour:02d}:{window_start.tm_min:02d}-"
+            f"{(window_start.tm_hour + 1) % 24:02d}:{window_start.tm_min:02d}")
+  return [
+      (start, "newsletter", args.newsletter, CampaignSchedule()),
+      (start + args.urgent_after, "urgent", args.urgent, CampaignSchedule(weight=urgent_weight)),
+      (start, "scheduled", args.scheduled, CampaignSchedule.from_settings("", window)),
+  ]
+
+def simulate(args, start, policy, urgent_weight=1.0):
+  """
+  Send every campaign at --rate messages per second and return when each one
+  finished, in seconds from the start.
+  """
+  clock = VirtualClock(start)
+  scheduler = CampaignScheduler(clock)
+  pending = sorted(campaigns(args, start, urgent_weight), key=lambda campaign: campaign[0])
+  remaining = {}
+  queued = []  # first come first served: ids in arrival order
+  finished = {}
+  while pending or remaining:
+      while pending and pending[0][0] <= clock():
+          _, campaign_id, messages, schedule = pending.pop(0)
+          remaining[campaign_id] = messages
+          scheduler.add(campaign_id, schedule)
+          queued.append(campaign_id)
+      if policy == "fifo":
+          active = scheduler.active()
+          campaign_id = next((campaign_id for campaign_id in queued if campaign_id in active), None)
+      else:
+          campaign_id = scheduler.next()
+      if campaign_id is None:
+          # Nothing may send: jump to the next arrival or opening window
+          upcoming = [due for due in (pending[0][0] if pending else None, scheduler.next_start()) if due is not None]
+          clock.now = max(clock(), min(upcoming))
+          continue
+      clock.advance(1 / args.rate)
+      remaining[campaign_id] -= 1
+      if not remaining[campaign_id]:
+          del remaining[campaign_id]
+          scheduler.remove(campaign_id)
+          queued.remove(campaign_id)
+          finished[campaign_id] = clock() - start
+  return finished
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--newsletter", type=int, default=500000, help="messages of the newsletter")
+  parser.add_argument("--urgent", type=int, default=200, help="messages of the urgent campaign")
+  parser.add_argument("--urgent-after", type=float, default=3600, help="seconds before the urgent campaign arrives")
+  parser.add_argument("--urgent-weight", type=float, default=10)
+  parser.add_argument("--scheduled", type=int, default=5000, help="messages of the scheduled campaign")
+  parser.add_argument("--scheduled-after", type=float, default=7200,
+                      help="seconds before the scheduled campaign's one-hour sending window opens")
+  parser.add_argument("--rate", type=float, default=20, help="messages per second of delivery capacity")
+  args = parser.parse_args()
+
+  # A fixed start on the hour, so the sending window falls the same way on every run
+  start = time.mktime((2026, 1, 5, 8, 0, 0, 0, 0, -1))
+  print(f"{args.rate:g} msg/s; newsletter {args.newsletter}, urgent {args.urgent} after {args.urgent_after:g}s, "
+        f"scheduled {args.scheduled} in a window opening after {args.scheduled_after:g}s")
+  print(f"{'policy':<24} {'urgent done':>12} {'scheduled done':>15} {'newsletter done':>16}")
+  for label, policy, weight in (("first come first served", "fifo", 1.0),
+                                ("fair, urgent weight 1", "fair", 1.0),
+                                (f"fair, urgent weight {args.urgent_weight:g}", "fair", args.urgent_weight)):
+      finished = simulate(args, start, policy, weight)
+      print(f"{label:<24} {format_duration(finished['urgent'] - args.urgent_after):>12} "
+            f"{format_duration(finished['scheduled'] - args.scheduled_after):>15} "
+            f"{format_duration(finished['newsletter']):>16}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,107 @@
+"""
+Simulate a campaign where one domain throttles, with and without per-domain limits.
+
+The stand-in server answers RCPT for the throttled domain with "451 Try again later"
+once it gets more than --throttle-rate recipients per second. The list starts with a
+block of throttled-domain recipients, like a list sorted by provider.
+
+Without domain limits every recipient is in one group, so each 451 pauses the whole
+campaign. With a limit on the throttled domain its recipients are paced below the
+server's limit and interleaved with the other domains, which finish at full speed.
+
+Usage:
+    python benchmarks/sim_domain_throttling.py [--messages 2000] [--throttled-share 0.3]
+"""
+# Import required modules
+import argparse
+import os
+import queue
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastmail_core import domains
+from fastmail_core.message import CampaignMessage
+from fastmail_core.pool import SMTPPool
+from fastmail_core.senders import SenderAccount
+from smtp_server import StandInSMTPServer
+
+SENDER = "sender@example.com"
+THROTTLED_DOMAIN = "slow.example"
+OTHER_DOMAINS = ["fast1.example", "fast2.example", "fast3.example"]
+
+class ThrottlingSMTPServer(StandInSMTPServer):
+  """
+  Stand-in server that refuses recipients of one domain beyond a rate per second,
+  and records when each message for each domain was accepted.
+  """
+
+  def __init__(self, throttled_domain, rate, **kwargs):
+      super().__init__(**kwargs)
+      self.throttled_domain = throttled_domain
+      self.rate = rate
+      self.window_start = 0.0
+      self.window_count = 0
+      self.throttled = 0
+      self.accepted = {}  # domain -> time of the last accepted message
+
+  def rcpt_reply(self, address):
+      if address.rpartition("@")[2] == self.throttled_domain:
+          now = time.monotonic()
+          if now - self.window_start >= 1:
+              self.window_start, self.window_count = now, 0
+          if self.window_count >= self.rate:
+              self.throttled += 1
+              return "451 4.7.0 Too many messages, try again later"
+          self.window_count += 1
+      return super().rcpt_reply(address)
+
+  def data_reply(self, mail_from, recipients, data):
+      for address in recipients:
+          self.accepted[address.rpartition("@")[2]] = time.monotonic()
+      return super().data_reply(mail_from, recipients, data)
+
+def run(label, args, to_list, campaign, domain_limits):
+  """
+  Send the campaign once and print when the throttled and other domains finished.
+  """
+  with ThrottlingSMTPServer(THROTTLED_DOMAIN, args.throttle_rate, latency=args.latency) as server:
+      account = SenderAccount(SENDER, "password", "127.0.0.1", args.sessions, port=server.port, use_starttls=False)
+      pool = SMTPPool([account], queue.Queue(), domain_limits=domain_limits)
+      start = time.monotonic()
+      pool.run(enumerate(to_list), lambda i, email, account: campaign.render(email))
+      elapsed = time.monotonic() - start
+
+      others_done = max(server.accepted.get(domain, start) for domain in OTHER_DOMAINS) - start
+      throttled_done = server.accepted.get(THROTTLED_DOMAIN, start) - start
+      print(f"{label:<16} other domains done {others_done:6.2f}s  "
+            f"{THROTTLED_DOMAIN} done {throttled_done:6.2f}s  total {elapsed:6.2f}s  "
+            f"451 replies {server.throttled:<5} refused {pool.emails_failed}")
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--messages", type=int, default=2000)
+  parser.add_argument("--throttled-share", type=float, default=0.3)
+  parser.add_argument("--throttle-rate", type=int, default=50, help="recipients per second the server accepts")
+  parser.add_argument("--sessions", type=int, default=4)
+  parser.add_argument("--latency", type=float, default=0.002)
+  parser.add_argument("--cooldown", type=float, default=1.0, help="group pause after a 451 (seconds)")
+  args = parser.parse_args()
+
+  # Short pauses so the simulation runs in seconds rather than minutes
+  domains.THROTTLE_COOLDOWN = args.cooldown
+  domains.THROTTLE_COOLDOWN_MAX = args.cooldown * 8
+
+  throttled = int(args.messages * args.throttled_share)
+  to_list = [f"user{i}@{THROTTLED_DOMAIN}" for i in range(throttled)]
+  to_list += [f"user{i}@{OTHER_DOMAINS[i % len(OTHER_DOMAINS)]}" for i in range(args.messages - throttled)]
+  campaign = CampaignMessage("Simulation", "<p>Hello</p>", SENDER)
+
+  # Pace the throttled domain just under what the server accepts
+  per_minute = int(args.throttle_rate * 60 * 0.9)
+  run("input order", args, to_list, campaign, None)
+  run("per-domain", args, to_list, campaign, {THROTTLED_DOMAIN: (2, per_minute)})
+
+if __name__ == "__main__":
+  main()
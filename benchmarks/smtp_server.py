@@ -0,0 +1,283 @@
+"""
+Local stand-in SMTP server for benchmarks and simulations.
+
+It speaks enough ESMTP for Fast Mail's delivery engines (EHLO, optional STARTTLS,
+AUTH PLAIN/LOGIN, MAIL, RCPT, DATA, RSET, NOOP, QUIT, optional PIPELINING),
+accepts any credentials and throws the messages away.
+
+`latency` simulates one network round trip: replies are held back until the client
+has nothing more buffered, then sent together after the delay. A pipelining client
+therefore pays one round trip per command group instead of one per command.
+
+Misbehaviour can be switched on for benchmarks: a share of recipients refused with
+550 (`refuse_rate`) or deferred with 451 (`defer_rate`), at most `throttle_rate`
+recipients accepted per second (451 beyond that), and a share of messages after
+which the connection is dropped without a reply (`disconnect_rate`).
+
+Usage:
+    server = StandInSMTPServer(latency=0.02)
+    server.start()
+    ... send to 127.0.0.1:server.port without STARTTLS ...
+    server.stop()
+"""
+# Import required modules
+import asyncio
+import random
+import ssl
+import threading
+import time
+
+CRLF = b"\r\n"
+
+class StandInSMTPServer:
+  """
+  An asyncio SMTP server running on its own thread.
+  """
+
+  def __init__(self, host="127.0.0.1", port=0, latency=0.0, pipelining=True,
+               certfile=None, keyfile=None, refuse_rate=0.0, defer_rate=0.0,
+               throttle_rate=None, disconnect_rate=0.0, seed=None):
+      self.host = host
+      self.port = port
+      self.latency = latency
+      self.pipelining = pipelining
+      self.refuse_rate = refuse_rate
+      self.defer_rate = defer_rate
+      self.throttle_rate = throttle_rate
+      self.disconnect_rate = disconnect_rate
+      self.random = random.Random(seed)
+      self.tls_context = None
+      if certfile:
+          self.tls_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+          self.tls_context.load_cert_chain(certfile, keyfile)
+
+      self.messages_received = 0
+      self.bytes_received = 0
+      self.connections = 0
+      self.replies = {}  # reply code sent to RCPT and end of DATA -> count
+      self.disconnects = 0
+      self.rate_window_start = 0.0
+      self.rate_window_count = 0
+
+      self.loop = None
+      self.server = None
+      self.thread = None
+      self.ready = threading.Event()
+
+  # --------------------------------------------------------------------
+  # Lifecycle
+  # --------------------------------------------------------------------
+
+  def start(self):
+      """
+      Start serving on a background thread and wait until the port is bound.
+      """
+      self.thread = threading.Thread(target=self.serve, daemon=True)
+      self.thread.start()
+      self.ready.wait()
+      return self
+
+  def serve(self):
+      self.loop = asyncio.new_event_loop()
+      self.server = self.loop.run_until_complete(
+          asyncio.start_server(self.handle, self.host, self.port))
+      self.port = self.server.sockets[0].getsockname()[1]
+      self.ready.set()
+      self.loop.run_forever()
+      self.server.close()
+      self.loop.run_until_complete(self.server.wait_closed())
+      self.loop.close()
+
+  def stop(self):
+      """
+      Stop the server and wait for its thread.
+      """
+      if self.loop is not None:
+          self.loop.call_soon_threadsafe(self.loop.stop)
+          self.thread.join()
+
+  def __enter__(self):
+      return self.start()
+
+  def __exit__(self, *exc_info):
+      self.stop()
+
+  # --------------------------------------------------------------------
+  # Hooks (override in simulations)
+  # --------------------------------------------------------------------
+
+  def ehlo_lines(self, tls_active):
+      """
+      Extension lines advertised after EHLO.
+      """
+      lines = ["stand-in", "8BITMIME", "SMTPUTF8", "AUTH PLAIN LOGIN"]
+      if self.pipelining:
+          lines.append("PIPELINING")
+      if self.tls_context is not None and not tls_active:
+          lines.append("STARTTLS")
+      return lines
+
+  def rcpt_reply(self, address):
+      """
+      Reply to RCPT TO for one address.
+      """
+      if self.throttle_rate is not None:
+          now = time.monotonic()
+          if now - self.rate_window_start >= 1:
+              self.rate_window_start, self.rate_window_count = now, 0
+          if self.rate_window_count >= self.throttle_rate:
+              return "451 4.7.0 Too many messages, try again later"
+          self.rate_window_count += 1
+      draw = self.random.random()
+      if draw < self.refuse_rate:
+          return "550 5.1.1 No such user"
+      if draw < self.refuse_rate + self.defer_rate:
+          return "451 4.3.0 Temporary failure, try again later"
+      return "250 2.1.5 OK"
+
+  def data_reply(self, mail_from, recipients, data):
+      """
+      Reply once a message has been received.
+      """
+      return "250 2.0.0 Queued"
+
+  def disconnect_now(self):
+      """
+      Whether to drop the connection instead of replying to the message just received.
+      """
+      return self.disconnect_rate > 0 and self.random.random() < self.disconnect_rate
+
+  def count_reply(self, text):
+      code = text[:3]
+      self.replies[code] = self.replies.get(code, 0) + 1
+
+  # --------------------------------------------------------------------
+  # Protocol
+  # --------------------------------------------------------------------
+
+  async def handle(self, reader, writer):
+      self.connections += 1
+      session = Session(self, reader, writer)
+      try:
+          await session.run()
+      except (ConnectionError, asyncio.IncompleteReadError):
+          pass
+      finally:
+          writer.close()
+
+class Session:
+  """
+  One client connection to the stand-in server.
+  """
+
+  def __init__(self, server, reader, writer):
+      self.server = server
+      self.reader = reader
+      self.writer = writer
+      self.pending = []
+      self.tls_active = False
+      self.mail_from = None
+      self.recipients = []
+
+  def reply(self, text):
+      self.pending.append(text.encode("utf-8") + CRLF)
+
+  async def flush(self):
+      """
+      Send every held-back reply after one simulated round trip.
+      """
+      if self.pending:
+          if self.server.latency:
+              await asyncio.sleep(self.server.latency)
+          self.writer.write(b"".join(self.pending))
+          self.pending = []
+          await self.writer.drain()
+
+  async def readline(self):
+      # Only flush once the client stops sending (StreamReader has no public buffer size)
+      if not self.reader._buffer:
+          await self.flush()
+      return await self.reader.readline()
+
+  async def run(self):
+      server = self.server
+      self.reply("220 stand-in ESMTP ready")
+      while True:
+          line = await self.readline()
+          if not line:
+              break
+          verb, _, arg = line.decode("utf-8", "replace").strip().partition(" ")
+          verb = verb.upper()
+
+          if verb in ("EHLO", "HELO"):
+              lines = server.ehlo_lines(self.tls_active)
+              for l in lines[:-1]:
+                  self.reply(f"250-{l}")
+              self.reply(f"250 {lines[-1]}")
+          elif verb == "STARTTLS" and server.tls_context is not None and not self.tls_active:
+              self.reply("220 2.0.0 Ready to start TLS")
+              await self.flush()
+              await self.writer.start_tls(server.tls_context)
+              self.tls_active = True
+          elif verb == "AUTH":
+              mechanism = arg.split(" ")[0].upper()
+              if mechanism == "LOGIN":
+                  self.reply("334 VXNlcm5hbWU6")
+                  await self.readline()
+                  self.reply("334 UGFzc3dvcmQ6")
+                  await self.readline()
+              self.reply("235 2.7.0 Authentication successful")
+          elif verb == "MAIL":
+              self.mail_from = arg
+              self.recipients = []
+              self.reply("250 2.1.0 OK")
+          elif verb == "RCPT":
+              address = arg.partition(":")[2].strip().strip("<>")
+              text = server.rcpt_reply(address)
+              server.count_reply(text)
+              if text.startswith("2"):
+                  self.recipients.append(address)
+              self.reply(text)
+          elif verb == "DATA":
+              if not self.recipients:
+                  self.reply("503 5.5.1 No valid recipients")
+                  continue
+              self.reply("354 End data with <CR><LF>.<CR><LF>")
+              chunks = []
+              while True:
+                  chunk = await self.readline()
+                  if not chunk or chunk == b".\r\n":
+                      break
+                  chunks.append(chunk)
+              data = b"".join(chunks)
+              server.bytes_received += len(data)
+              if server.disconnect_now():
+                  server.disconnects += 1
+                  self.pending = []
+                  return
+              text = server.data_reply(self.mail_from, self.recipients, data)
+              server.count_reply(text)
+              if text.startswith("2"):
+                  server.messages_received += 1
+              self.reply(text)
+              self.mail_from, self.recipients = None, []
+          elif verb == "RSET":
+              self.mail_from, self.recipients = None, []
+              self.reply("250 2.0.0 OK")
+          elif verb == "NOOP":
+              self.reply("250 2.0.0 OK")
+          elif verb == "QUIT":
+              self.reply("221 2.0.0 Bye")
+              break
+          else:
+              self.reply("502 5.5.2 Command not recognized")
+      await self.flush()
+
+if __name__ == "__main__":
+  with StandInSMTPServer(port=2525) as server:
+      print(f"Stand-in SMTP server listening on {server.host}:{server.port} (Ctrl+C to stop)")
+      try:
+          while True:
+              time.sleep(1)
+      except KeyboardInterrupt:
+          pass
@@ -1,52 +1,74 @@
 # Import required modules
+import time
+STARTUP_BEGIN = time.perf_counter()  # Start of the startup timing report
+import sys
+# The packaged app also runs the outbox delivery workers (see fastmail_core.outbox.worker_command)
+if sys.argv[1:2] == ["--outbox-worker"]:
+  from fastmail_core.outbox import main as outbox_worker_main
+  sys.exit(outbox_worker_main(sys.argv[2:]))
 import customtkinter as ctk
 import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
-import smtplib
-from email.message import EmailMessage
-import time
-import random
+from tkinter import filedialog, messagebox, simpledialog, ttk
 import os
-import xml.etree.ElementTree as ET
+import json
 from PIL import Image
-import html  # For escaping HTML characters
 import threading
 import queue  # For inter-thread communication
+from fastmail_core import settings as settings_store
+from fastmail_core.settings import ATTACHMENT_CACHE_DIR, DEFAULT_SETTINGS, DELIVERY_ENGINES, JOURNAL_FILE, MAX_DELIVERY_WORKERS, SETTINGS_DIR, SUPPRESSION_FILE, save_settings
+from fastmail_core.richtext import text_widget_to_html
+from fastmail_core.progress import ProgressState
+from fastmail_core.senders import DEFAULT_SENDER, validate_sender
+from fastmail_core.domains import DEFAULT_DOMAIN_LIMITS, parse_domain_limits
+from fastmail_core.recipients import RecipientCleaner, RecipientFile, guess_email_column, is_csv_file, normalize_email, read_csv_header
+from fastmail_core.template import MergeTemplate, check_fields
+# The sending engine, the send journal and the suppression list (smtplib, email, sqlite3)
+# are imported on first use to keep startup fast.
 
 # ------------------------------------------------------------------------
-# Constants and Configuration
+# Startup Timing
 # ------------------------------------------------------------------------
 
-# Constants for XML settings file
-SETTINGS_FILE = os.path.join(os.getenv('APPDATA'), "FastMails", "settings.xml")  # Path to your XML config file
+# File the startup timing report is appended to (one JSON line per launch), if set
+STARTUP_REPORT_FILE = os.getenv("FASTMAIL_STARTUP_REPORT")
 
-# Ensure the directory exists
-os.makedirs(os.path.dirname(SETTINGS_FILE), exist_ok=True)
+# Close the app once the report is written (for startup benchmarks)
+STARTUP_EXIT = bool(os.getenv("FASTMAIL_STARTUP_EXIT"))
 
-# Default settings
-DEFAULT_SETTINGS = {
-  "sender_email": "",
-  "app_password": "",
-  "smtp_server": "smtp.gmail.com",
-  "emails_per_batch": "70",
-  "batch_delay_min": "181",
-  "batch_delay_max": "230",
-  "email_delay_min": "3",
-  "email_delay_max": "5"
-}
+# (phase, end time) of each startup phase
+startup_marks = [("start", STARTUP_BEGIN)]
 
-# List of randomized closing phrases
-CLOSING_PHRASES = [
-  "Cordialement,",
-  "Sincèrement,",
-  "Salutations,",
-  "Merci,",
-  "Chaleureusement,",
-  "Bien à vous,",
-  "Tous mes vœux,",
-  "Amitiés,",
-  "Respectueusement,"
-]
+def mark_startup(phase):
+  """
+  Record the end of a startup phase.
+  """
+  startup_marks.append((phase, time.perf_counter()))
+
+def report_startup():
+  """
+  Record the first paint and write the startup timing report: how long the
+  imports, the widget build and the first paint took, in milliseconds.
+  """
+  app.update_idletasks()
+  mark_startup("first_paint")
+  report = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "frozen": bool(getattr(sys, "frozen", False))}
+  for (_, start), (phase, end) in zip(startup_marks, startup_marks[1:]):
+      report[f"{phase}_ms"] = round((end - start) * 1000, 1)
+  report["total_ms"] = round((startup_marks[-1][1] - STARTUP_BEGIN) * 1000, 1)
+  if STARTUP_REPORT_FILE:
+      with open(STARTUP_REPORT_FILE, "a", encoding="utf-8") as f:
+          f.write(json.dumps(report) + "\n")
+  if STARTUP_EXIT:
+      app.destroy()
+
+mark_startup("import")
+
+# ------------------------------------------------------------------------
+# Constants and Configuration
+# ------------------------------------------------------------------------
+
+# Ensure the settings directory exists
+os.makedirs(SETTINGS_DIR, exist_ok=True)
 
 # ------------------------------------------------------------------------
 # Functions for Loading and Saving Settings
@@ -57,65 +79,57 @@ def load_settings():
   Load settings from the XML settings file.
   If the file doesn't exist or is corrupted, default settings are loaded.
   """
-  settings = DEFAULT_SETTINGS.copy()
-  if os.path.exists(SETTINGS_FILE):
-      try:
-          tree = ET.parse(SETTINGS_FILE)
-          root = tree.getroot()
-          for key in settings.keys():
-              element = root.find(key)
-              if element is not None:
-                  settings[key] = element.text
-      except ET.ParseError:
-          messagebox.showerror("Error", "Settings file is corrupted. Loading default settings.")
-  return settings
-
-def save_settings(settings):
-  """
-  Save current settings to the XML settings file.
-  """
-  root = ET.Element("settings")
-  for key, value in settings.items():
-      elem = ET.SubElement(root, key)
-      elem.text = value
-  tree = ET.ElementTree(root)
-  tree.write(SETTINGS_FILE)
-  messagebox.showinfo("Success", "Settings saved successfully!")
+  try:
+      return settings_store.load_settings()
+  except ValueError as e:
+      messagebox.showerror("Error", f"{e} Loading default settings.")
+      return dict(DEFAULT_SETTINGS, senders=[])
+
+def get_current_settings():
+  """
+  Return the settings as currently entered in the settings frame,
+  or the saved settings if the frame has not been opened yet.
+  """
+  if settings_frame is None:
+      return dict(settings, senders=[dict(profile) for profile in settings["senders"]])
+  store_sender_account()
+  return {
+      "senders": [dict(profile) for profile in sender_profiles],
+      "delivery_engine": delivery_engine_combobox.get(),
+      "domain_limits": domain_limits_entry.get(),
+      "metrics_port": metrics_port_entry.get(),
+      "delivery_workers": delivery_workers_entry.get()
+  }
 
 def save_current_settings():
   """
   Collect current settings from the settings frame inputs,
   perform basic validation, save them, and update the global settings.
   """
-  current_settings = {
-      "sender_email": sender_email_entry.get(),
-      "app_password": app_password_entry.get(),
-      "smtp_server": smtp_server_entry.get(),
-      "emails_per_batch": emails_per_batch_entry.get(),
-      "batch_delay_min": batch_delay_min_entry.get(),
-      "batch_delay_max": batch_delay_max_entry.get(),
-      "email_delay_min": email_delay_min_entry.get(),
-      "email_delay_max": email_delay_max_entry.get()
-  }
+  current_settings = get_current_settings()
 
-  # Check if email and password are not empty
-  if not current_settings["sender_email"].strip():
-      messagebox.showerror("Error", "Sender email cannot be empty.")
+  # Check every sender account: email, password, server, connections, rate limits and weight
+  for profile in current_settings["senders"]:
+      try:
+          validate_sender(profile)
+      except ValueError as e:
+          messagebox.showerror("Error", f"Invalid sender account: {e}")
+          return
+
+  try:
+      parse_domain_limits(current_settings["domain_limits"])
+  except ValueError as e:
+      messagebox.showerror("Error", f"Invalid domain limits: {e}")
       return
 
-  if not current_settings["app_password"].strip():
-      messagebox.showerror("Error", "App password cannot be empty.")
+  metrics_port = current_settings["metrics_port"].strip()
+  if metrics_port and not (metrics_port.isdigit() and 0 < int(metrics_port) < 65536):
+      messagebox.showerror("Error", "Please enter a valid port number for the metrics endpoint, or leave it empty.")
       return
 
-  # Basic validation
-  try:
-      int(current_settings["emails_per_batch"])
-      int(current_settings["batch_delay_min"])
-      int(current_settings["batch_delay_max"])
-      int(current_settings["email_delay_min"])
-      int(current_settings["email_delay_max"])
-  except ValueError:
-      messagebox.showerror("Error", "Please enter valid integer values for delays and batch sizes.")
+  delivery_workers = current_settings["delivery_workers"].strip()
+  if not (delivery_workers.isdigit() and 0 < int(delivery_workers) <= MAX_DELIVERY_WORKERS):
+      messagebox.showerror("Error", f"Delivery Workers must be a whole number from 1 to {MAX_DELIVERY_WORKERS}.")
       return
 
   save_settings(current_settings)
@@ -124,6 +138,9 @@ def save_current_settings():
   global settings
   settings = current_settings
 
+  # Refresh the account selector with the saved addresses
+  show_sender_account(selected_sender)
+
 # Load settings at startup
 settings = load_settings()
 
@@ -169,11 +186,21 @@ menu_frame = ctk.CTkFrame(app, width=200)
 menu_frame.grid(row=0, column=0, sticky="ns")
 menu_frame.grid_rowconfigure(2, weight=0)
 
+# Resized logo, cached next to the settings so the full-size image is only decoded once
+LOGO_CACHE_FILE = os.path.join(SETTINGS_DIR, "logo_170.png")
+
+def load_logo_image(logo_path):
+  """
+  Return the logo resized to 170x170, from the cache when it is up to date.
+  """
+  if not os.path.exists(LOGO_CACHE_FILE) or os.path.getmtime(LOGO_CACHE_FILE) < os.path.getmtime(logo_path):
+      Image.open(logo_path).resize((170, 170)).save(LOGO_CACHE_FILE)
+  return Image.open(LOGO_CACHE_FILE)
+
 # Load and create the logo image
 logo_path = "logo.png"
 if os.path.exists(logo_path):
-  original_image = Image.open(logo_path).resize((170, 170))
-  logo_image = ctk.CTkImage(original_image, size=(170, 170))
+  logo_image = ctk.CTkImage(load_logo_image(logo_path), size=(170, 170))
   logo_label = ctk.CTkLabel(menu_frame, image=logo_image, text="")
 else:
   logo_label = ctk.CTkLabel(menu_frame, text="Logo Here", font=("Arial", 24))
@@ -183,7 +210,7 @@ logo_label.grid(row=0, column=0, padx=10, pady=(20, 10), sticky="n")
 send_emails_button = ctk.CTkButton(menu_frame, text="Send Emails", command=lambda: show_frame(send_emails_frame))
 send_emails_button.grid(row=1, column=0, padx=20, pady=10, sticky="ew")
 
-settings_button = ctk.CTkButton(menu_frame, text="Settings", command=lambda: show_frame(settings_frame))
+settings_button = ctk.CTkButton(menu_frame, text="Settings", command=lambda: show_settings_frame())
 settings_button.grid(row=2, column=0, padx=20, pady=10, sticky="ew")
 
 # Function to switch between frames
@@ -192,9 +219,18 @@ def show_frame(frame):
   Hide all frames and display the selected frame.
   """
   send_emails_frame.grid_remove()
-  settings_frame.grid_remove()
+  if settings_frame is not None:
+      settings_frame.grid_remove()
   frame.grid()
 
+def show_settings_frame():
+  """
+  Show the settings frame, building it the first time it is opened.
+  """
+  if settings_frame is None:
+      build_settings_frame()
+  show_frame(settings_frame)
+
 # ------------------------------------------------------------------------
 # Send Emails Frame
 # ------------------------------------------------------------------------
@@ -324,29 +360,33 @@ def apply_tag(tag_name):
   except tk.TclError:
       pass  # No text selected
 
-def configure_font_tags():
+# Fonts whose tags are configured (done the first time each font is applied)
+configured_fonts = set()
+
+def configure_font_tags(tag_key):
   """
-  Configure font tags for different fonts and styles.
+  Configure the tags of one font for its different styles.
   """
+  if tag_key in configured_fonts:
+      return
+  configured_fonts.add(tag_key)
   base_size = 10
-  for tag_key, (display_name, font_name) in font_tag_mapping.items():
-      # Configure regular font
-      email_body_text.tag_configure(f"font_{tag_key}", font=(font_name, base_size))
+  display_name, font_name = font_tag_mapping[tag_key]
 
-      # Configure combinations with bold
-      email_body_text.tag_configure(f"font_{tag_key}+bold", 
-                                  font=(font_name, base_size, "bold"))
+  # Configure regular font
+  email_body_text.tag_configure(f"font_{tag_key}", font=(font_name, base_size))
 
-      # Configure combinations with italic
-      email_body_text.tag_configure(f"font_{tag_key}+italic", 
-                                  font=(font_name, base_size, "italic"))
+  # Configure combinations with bold
+  email_body_text.tag_configure(f"font_{tag_key}+bold", 
+                              font=(font_name, base_size, "bold"))
 
-      # Configure combinations with both bold and italic
-      email_body_text.tag_configure(f"font_{tag_key}+bold+italic", 
-                                  font=(font_name, base_size, "bold italic"))
+  # Configure combinations with italic
+  email_body_text.tag_configure(f"font_{tag_key}+italic", 
+                              font=(font_name, base_size, "italic"))
 
-# Configure font tags after creating the text widget
-configure_font_tags()
+  # Configure combinations with both bold and italic
+  email_body_text.tag_configure(f"font_{tag_key}+bold+italic", 
+                              font=(font_name, base_size, "bold italic"))
 
 # ------------------------------------------------------------------------
 # Formatting Buttons
@@ -393,6 +433,8 @@ def apply_font():
   """
   font_key = selected_font.get()
   tag_name = f"font_{font_key}"
+  if font_key in font_tag_mapping:
+      configure_font_tags(font_key)
   apply_tag(tag_name)
 
 font_button = ctk.CTkButton(font_frame, text="Apply Font", command=apply_font)
@@ -410,24 +452,112 @@ recipient_emails_label.grid(row=6, column=0, sticky="w", pady=(10, 5))
 recipient_emails_text = tk.Text(send_emails_frame, height=5)
 recipient_emails_text.grid(row=7, column=0, sticky="nsew", pady=(0, 10))
 
+# Number of addresses shown in the widget when a recipient file is loaded
+RECIPIENT_PREVIEW_LINES = 100
+
+# Recipient file currently loaded (None when addresses are typed in the widget)
+recipient_file = None
+
+# Recipient File Buttons Frame
+recipient_buttons_frame = ctk.CTkFrame(send_emails_frame)
+recipient_buttons_frame.grid(row=8, column=0, sticky="w", pady=(0, 10))
+recipient_buttons_frame.configure(fg_color="transparent")  # Set frame background to transparent
+
 # Load Emails Button
-load_emails_button = ctk.CTkButton(send_emails_frame, text="Load Emails from File", command=lambda: load_emails(recipient_emails_text))
-load_emails_button.grid(row=8, column=0, sticky="w", pady=(0, 10))
+load_emails_button = ctk.CTkButton(recipient_buttons_frame, text="Load Emails from File", command=lambda: load_emails(recipient_emails_text))
+load_emails_button.grid(row=0, column=0, sticky="w", padx=(0, 5))
+
+# Clear Recipients Button
+clear_emails_button = ctk.CTkButton(recipient_buttons_frame, text="Clear", width=60, command=lambda: clear_emails(recipient_emails_text))
+clear_emails_button.grid(row=0, column=1, sticky="w")
+
+def ask_email_column(file_path):
+  """
+  Find the CSV column holding the addresses, asking the user if it cannot be guessed.
+  Returns a column name, a 0-based index, or None if the user cancelled.
+  """
+  header = read_csv_header(file_path)
+  column = guess_email_column(header)
+  if column is not None:
+      return header[column]
+  columns = ", ".join(f"{i + 1}: {name}" for i, name in enumerate(header))
+  answer = simpledialog.askinteger("Email Column", f"Which column holds the email addresses?\n\n{columns}",
+                                   minvalue=1, maxvalue=max(1, len(header)), parent=app)
+  return None if answer is None else answer - 1
 
 # Function to load emails from file
 def load_emails(text_widget):
   """
-  Open a file dialog to select a file containing emails, and load the emails into the text widget.
+  Open a file dialog to select a TXT or CSV file containing emails.
+  The file is streamed when sending; the text widget only shows a preview and the count.
+  The count takes a pass over the whole file, so it is made on another thread.
   """
-  file_path = filedialog.askopenfilename(title="Select Email List File", filetypes=[("Text Files", "*.txt")])
+  global recipient_file
+  file_path = filedialog.askopenfilename(title="Select Email List File",
+                                         filetypes=[("Email Lists", "*.txt *.csv"), ("Text Files", "*.txt"), ("CSV Files", "*.csv")])
   if file_path:
       try:
-          with open(file_path, 'r') as file:
-              emails = file.read()
-              text_widget.delete("1.0", "end")
-              text_widget.insert("1.0", emails)
+          column = None
+          if is_csv_file(file_path):
+              column = ask_email_column(file_path)
+              if column is None:
+                  return
+          source = RecipientFile(file_path, column)
+          preview = source.preview(RECIPIENT_PREVIEW_LINES)
       except Exception as e:
           messagebox.showerror("Error", f"Failed to load emails: {e}")
+          return
+
+      recipient_file = source
+      text_widget.configure(state="normal")
+      text_widget.delete("1.0", "end")
+      text_widget.insert("1.0", "\n".join(preview))
+      text_widget.configure(state="disabled")
+      recipient_emails_label.configure(text=f"Recipient Emails: {os.path.basename(file_path)} (counting…)")
+
+      counted = queue.Queue()
+
+      def count():
+          try:
+              counted.put(source.count())
+          except Exception as e:
+              counted.put(e)
+
+      threading.Thread(target=count, daemon=True).start()
+      app.after(100, lambda: show_recipient_count(text_widget, source, preview, counted))
+
+def show_recipient_count(text_widget, source, preview, counted):
+  """
+  Show the count of a loaded recipient file once its thread has put it on
+  `counted`; a file replaced or cleared meanwhile is not shown.
+  """
+  try:
+      count = counted.get_nowait()
+  except queue.Empty:
+      app.after(100, lambda: show_recipient_count(text_widget, source, preview, counted))
+      return
+  if recipient_file is not source:
+      return
+  name = os.path.basename(source.path)
+  if isinstance(count, Exception):
+      recipient_emails_label.configure(text=f"Recipient Emails: {name}")
+      messagebox.showerror("Error", f"Failed to count emails: {count}")
+      return
+  if count > len(preview):
+      text_widget.configure(state="normal")
+      text_widget.insert("end", f"\n... and {count - len(preview)} more")
+      text_widget.configure(state="disabled")
+  recipient_emails_label.configure(text=f"Recipient Emails: {name} ({count} addresses)")
+
+def clear_emails(text_widget):
+  """
+  Forget the loaded recipient file and go back to typing addresses in the text widget.
+  """
+  global recipient_file
+  recipient_file = None
+  text_widget.configure(state="normal")
+  text_widget.delete("1.0", "end")
+  recipient_emails_label.configure(text="Recipient Emails (comma-separated):")
 
 def process_email_list(email_string):
   """
@@ -437,34 +567,57 @@ def process_email_list(email_string):
   emails = [email.strip() for email in email_string.replace('\n', ',').split(',') if email.strip()]
   return emails
 
+# Suppression list, opened on first use
+suppression_list = None
+
+def get_suppression_list():
+  """
+  Return the persistent suppression list, opening it the first time.
+  """
+  global suppression_list
+  if suppression_list is None:
+      from fastmail_core.suppression import SuppressionList
+      suppression_list = SuppressionList(SUPPRESSION_FILE)
+  return suppression_list
+
+def get_recipients():
+  """
+  Return the recipients to send to: the loaded recipient file (streamed
+  lazily), or the addresses typed in the text widget.
+  """
+  if recipient_file is not None:
+      return recipient_file
+  return process_email_list(recipient_emails_text.get("1.0", "end"))
+
 # ------------------------------------------------------------------------
-# PDF Attachment Section
+# Attachments Section
 # ------------------------------------------------------------------------
 
-# PDF Attachment Frame
-pdf_frame = ctk.CTkFrame(send_emails_frame)
-pdf_frame.grid(row=9, column=0, sticky="w", pady=(0, 10), padx=(0, 10))
-pdf_frame.configure(fg_color="transparent")  # Set frame background to transparent
+# Attachments Frame
+attachments_frame = ctk.CTkFrame(send_emails_frame)
+attachments_frame.grid(row=9, column=0, sticky="w", pady=(0, 10), padx=(0, 10))
+attachments_frame.configure(fg_color="transparent")  # Set frame background to transparent
 
-# PDF File Path Variable
-pdf_file_path = tk.StringVar()
+# Paths of the files attached to every email
+attachment_paths = []
 
-def choose_pdf_file(label):
+def choose_attachments(label):
   """
-  Open a file dialog to choose a PDF file and update the label.
+  Open a file dialog to choose one or more files to attach and update the label.
   """
-  file_path = filedialog.askopenfilename(title="Select PDF File", filetypes=[("PDF Files", "*.pdf")])
-  if file_path:
-      pdf_file_path.set(file_path)
-      label.configure(text=os.path.basename(file_path))
-
-# Button to Attach PDF File
-choose_file_button = ctk.CTkButton(pdf_frame, text="Attach PDF File", command=lambda: choose_pdf_file(pdf_file_label))
+  file_paths = filedialog.askopenfilenames(title="Select Files to Attach",
+                                           filetypes=[("PDF Files", "*.pdf"), ("All Files", "*.*")])
+  if file_paths:
+      attachment_paths[:] = file_paths
+      label.configure(text=", ".join(os.path.basename(path) for path in file_paths))
+
+# Button to Attach Files
+choose_file_button = ctk.CTkButton(attachments_frame, text="Attach Files", command=lambda: choose_attachments(attachments_label))
 choose_file_button.grid(row=0, column=0, sticky="w", pady=(0,10), padx=(0,5))
 
-# Label to Display Selected PDF File
-pdf_file_label = ctk.CTkLabel(pdf_frame, text="No PDF file selected")
-pdf_file_label.grid(row=0, column=1, sticky="w", pady=(0,5))
+# Label to Display the Selected Files
+attachments_label = ctk.CTkLabel(attachments_frame, text="No file selected")
+attachments_label.grid(row=0, column=1, sticky="w", pady=(0,5))
 
 # ------------------------------------------------------------------------
 # Progress and Control Buttons
@@ -474,158 +627,188 @@ pdf_file_label.grid(row=0, column=1, sticky="w", pady=(0,5))
 emails_sent_label = ctk.CTkLabel(send_emails_frame, text="Emails Sent: 0 / 0")
 emails_sent_label.grid(row=10, column=0, sticky="w", pady=(0, 0))
 
-batch_delay_label = ctk.CTkLabel(send_emails_frame, text="")
-batch_delay_label.grid(row=11, column=0, sticky="w", pady=(5, 5))
+progress_stats_label = ctk.CTkLabel(send_emails_frame, text="")
+progress_stats_label.grid(row=11, column=0, sticky="w", pady=(0, 0))
+
+send_delay_label = ctk.CTkLabel(send_emails_frame, text="")
+send_delay_label.grid(row=12, column=0, sticky="w", pady=(5, 5))
 
 # Send Emails Button
 send_button = ctk.CTkButton(send_emails_frame, text="Send Emails", command=lambda: send_emails())
-send_button.grid(row=12, column=0, sticky="nsew", pady=(10,0))
+send_button.grid(row=13, column=0, sticky="nsew", pady=(10,0))
 
 
 # ------------------------------------------------------------------------
 # Functions for Sending Emails
 # ------------------------------------------------------------------------
 
-def send_email(subject, body, to_email, pdf_file, smtp_session, sender_email):
-  """
-  Send a single email using the provided SMTP session.
-  Optionally attach a PDF file.
-  """
-  msg = EmailMessage()
-  msg.set_content(body, subtype='html')
-  msg['Subject'] = subject
-  msg['To'] = to_email
-  msg['From'] = sender_email
-
-  # Attach PDF if it exists
-  if pdf_file and os.path.exists(pdf_file):
-      with open(pdf_file, 'rb') as f:
-          pdf_data = f.read()
-          msg.add_attachment(pdf_data,
-                             maintype='application',
-                             subtype='pdf',
-                             filename=os.path.basename(pdf_file))
-
-  smtp_session.send_message(msg)
-
 # Queue for inter-thread communication
 progress_queue = queue.Queue()
 
-def send_bulk_emails(sender_email, app_password, smtp_server, subject, email_body, pdf_file_path, to_list, settings):
-  """
-  Send bulk emails to the list of recipients.
-  Handles batch delays and email delays.
-  Updates progress via a queue for inter-thread communication.
-  """
-  EMAILS_PER_BATCH = int(settings["emails_per_batch"])
-  BATCH_DELAY_MIN = int(settings["batch_delay_min"])
-  BATCH_DELAY_MAX = int(settings["batch_delay_max"])
-  EMAIL_DELAY_MIN = int(settings["email_delay_min"])
-  EMAIL_DELAY_MAX = int(settings["email_delay_max"])
-
-  smtp_session = smtplib.SMTP(smtp_server, 587)
-  smtp_session.starttls()
-  smtp_session.login(sender_email, app_password)
-
-  # Send total emails count to the queue
-  progress_queue.put({'total_emails': len(to_list)})
-
-  for i, email in enumerate(to_list):
-      # Handle batch delays
-      if i > 0 and i % EMAILS_PER_BATCH == 0:
-          smtp_session.quit()
-          batch_delay = random.randint(BATCH_DELAY_MIN, BATCH_DELAY_MAX)
-          for remaining in range(batch_delay, 0, -1):
-              progress_queue.put({'batch_delay': remaining})
-              time.sleep(1)
-          smtp_session = smtplib.SMTP(smtp_server, 587)
-          smtp_session.starttls()
-          smtp_session.login(sender_email, app_password)
-          # Clear the batch delay label after the delay is over
-          progress_queue.put({'batch_delay': 0})
-
-      # Select a random closing phrase
-      closing_phrase = random.choice(CLOSING_PHRASES)
-      # Create a unique identifier (e.g., email index)
-      unique_id = f" [{i+1}]"
-
-      # Append the closing phrase and unique ID to the email body
-      unique_email_body = f"{email_body}<br><br>{closing_phrase}<br>{sender_email}{unique_id}"
-
-      # Send the email
-      send_email(subject, unique_email_body, email, pdf_file_path, smtp_session, sender_email)
-      # Update progress
-      progress_queue.put({'emails_sent': i + 1})
-
-      if i < len(to_list) - 1:
-          email_delay = random.randint(EMAIL_DELAY_MIN, EMAIL_DELAY_MAX)
-          time.sleep(email_delay)
-
-  smtp_session.quit()
-  # Indicate that sending is done
-  progress_queue.put({'status': 'done'})
+# Progress of the running campaign, folded from the events on progress_queue
+progress_state = ProgressState()
+
+def set_label_text(label, text):
+  """
+  Update a label only when its text changes.
+  """
+  if label.cget("text") != text:
+      label.configure(text=text)
 
 def monitor_progress():
   """
   Monitor the progress of email sending using the progress_queue,
-  and update the GUI accordingly.
+  and update the GUI accordingly. Every pending event is folded into
+  one snapshot per tick, so the display never falls behind the senders.
   """
-  try:
-      message = progress_queue.get_nowait()
-      if 'total_emails' in message:
-          total_emails = message['total_emails']
-          emails_sent_label.configure(text=f"Emails Sent: 0 / {total_emails}")
-
-      if 'emails_sent' in message:
-          emails_sent = message['emails_sent']
-          total_text = emails_sent_label.cget("text")
-          total_emails = total_text.split('/')[-1].strip()
-          emails_sent_label.configure(text=f"Emails Sent: {emails_sent} / {total_emails}")
-
-      if 'batch_delay' in message:
-          remaining = message['batch_delay']
-          if remaining > 0:
-              batch_delay_label.configure(text=f"Waiting for {remaining} seconds")
-          else:
-              batch_delay_label.configure(text="")
-      else:
-          batch_delay_label.configure(text="")
-
-      if 'status' in message and message['status'] == 'done':
-          batch_delay_label.configure(text="Emails sent successfully!")
-          messagebox.showinfo("Success", "Emails sent successfully!")
-          return  # Stop monitoring
-  except queue.Empty:
-      pass
+  progress_state.drain(progress_queue)
+
+  failed_text = f", {progress_state.failed} refused" if progress_state.failed else ""
+  set_label_text(emails_sent_label, f"Emails Sent: {progress_state.sent} / {progress_state.total}{failed_text}")
+  set_label_text(progress_stats_label, progress_state.summary())
+
+  if progress_state.error:
+      set_label_text(send_delay_label, "Sending stopped.")
+      send_button.configure(state="normal")
+      messagebox.showerror("Error", f"Sending stopped: {progress_state.error}\n\n"
+                           "Send the campaign again to resume where it stopped.")
+      return  # Stop monitoring
+
+  if progress_state.done:
+      set_label_text(send_delay_label, "Emails sent successfully!")
+      send_button.configure(state="normal")
+      messagebox.showinfo("Success", "Emails sent successfully!")
+      return  # Stop monitoring
+
+  delay = progress_state.delay_remaining()
+  set_label_text(send_delay_label, f"Waiting for {delay:.0f} seconds (rate limit)" if delay else "")
   app.after(100, monitor_progress)
 
 def send_emails():
   """
-  Gather input data from the GUI and start the email sending process in a new thread.
+  Gather input data from the GUI, render the messages into the outbox on a new
+  thread and start the delivery worker processes, which keep sending if the app is closed.
+  The recipients are checked on another thread first (see check_recipients):
+  the dialogs to resume and confirm follow once the result is on progress_queue.
   """
-  sender_email = sender_email_entry.get()
-  app_password = app_password_entry.get()
-  smtp_server = smtp_server_entry.get()
+  from fastmail_core.journal import campaign_id_for
+
+  current_settings = get_current_settings()
+  senders = current_settings["senders"]
   subject = subject_entry.get()
   # Get formatted email body from the text widget
   email_body = get_formatted_email_body()
-  recipients = recipient_emails_text.get("1.0", "end")
-  pdf_path = pdf_file_path.get()
+  attachments = list(attachment_paths)
+
+  # Recipient file or typed recipient emails
+  to_list = get_recipients()
+
+  if not all([senders, subject, email_body, attachments, to_list]):
+      messagebox.showerror("Error", "Please fill in all fields, set up a sender account and attach a file.")
+      return
+
+  for profile in senders:
+      try:
+          validate_sender(profile)
+      except ValueError as e:
+          messagebox.showerror("Error", f"Invalid sender account: {e}")
+          return
+
+  # Normalize, de-duplicate and drop suppressed addresses; the cleaner streams the source again when sending
+  to_list = RecipientCleaner(to_list, get_suppression_list())
+
+  # Every merge field of the subject and body needs a column of the recipient file (or a default)
+  try:
+      check_fields((MergeTemplate(subject), MergeTemplate(email_body)), to_list.fields)
+  except ValueError as e:
+      messagebox.showerror("Error", str(e))
+      return
+
+  global progress_state
+  progress_state = ProgressState()
+
+  # Sending again is possible once this campaign is cancelled or over
+  send_button.configure(state="disabled")
+  set_label_text(send_delay_label, "Checking the recipients…")
+  campaign_id = campaign_id_for(senders[0]["sender_email"], subject, email_body, attachments)
+  threading.Thread(target=check_recipients, args=(to_list, campaign_id, subject), daemon=True).start()
+  campaign = (subject, email_body, attachments, to_list, current_settings)
+  app.after(100, lambda: monitor_recipient_check(campaign))
+
+def check_recipients(to_list, campaign_id, subject):
+  """
+  Thread of send_emails: run the recipient cleaner's pass over the
+  recipients, open the campaign's send journal and count the recipients a
+  previous run already handled, and put the result on progress_queue.
+  """
+  from fastmail_core.journal import SendJournal
+
+  try:
+      cleaning_report = to_list.scan()
+      journal = SendJournal(JOURNAL_FILE, campaign_id, subject)
+      completed = journal.completed()
+      already_sent = sum(1 for email in to_list if email in completed) if completed else 0
+  except Exception as e:
+      progress_queue.put({'recipients_checked': None, 'error': str(e) or type(e).__name__})
+      return
+  progress_queue.put({'recipients_checked': (cleaning_report, journal, already_sent)})
+
+def monitor_recipient_check(campaign):
+  """
+  Wait for the result of check_recipients on progress_queue, then offer to
+  resume an interrupted run, confirm and start sending the campaign
+  (subject, email body, attachments, cleaned recipients, settings).
+  """
+  from fastmail_core.outbox import send_to_outbox
 
-  # Process recipient emails
-  to_list = process_email_list(recipients)
+  try:
+      message = progress_queue.get_nowait()
+  except queue.Empty:
+      app.after(100, lambda: monitor_recipient_check(campaign))
+      return
+  if 'recipients_checked' not in message:
+      # Left over from an earlier campaign
+      app.after(0, lambda: monitor_recipient_check(campaign))
+      return
 
-  if not all([sender_email, app_password, smtp_server, subject, email_body, pdf_path, to_list]):
-      messagebox.showerror("Error", "Please fill in all fields and attach a PDF file.")
+  subject, email_body, attachments, to_list, current_settings = campaign
+  set_label_text(send_delay_label, "")
+  send_button.configure(state="normal")
+  if message['recipients_checked'] is None:
+      messagebox.showerror("Error", f"Failed to check the recipients: {message['error']}")
       return
+  cleaning_report, journal, already_sent = message['recipients_checked']
+  recipient_count = cleaning_report.valid
+  if not recipient_count:
+      journal.close()
+      messagebox.showerror("Error", f"No valid recipients left to send to.\n\n{cleaning_report.summary()}")
+      return
+
+  # Offer to resume an interrupted run
+  restart = False
+  if already_sent:
+      answer = messagebox.askyesnocancel(
+          "Resume Campaign",
+          f"{already_sent} of {recipient_count} recipients were already handled by a previous run of this campaign.\n\n"
+          "Yes: resume and skip them.\nNo: start over and send to everyone.")
+      if answer is None:
+          journal.close()
+          return
+      if not answer:
+          journal.reset()
+          already_sent = 0
+          restart = True
 
   # Confirm before sending
-  if not messagebox.askyesno("Confirmation", f"Are you sure you want to send emails to {len(to_list)} recipients?"):
+  if not messagebox.askyesno("Confirmation", f"{cleaning_report.summary()}\n\nAre you sure you want to send emails to {recipient_count - already_sent} recipients?"):
+      journal.close()
       return
 
   try:
-      # Start the email sending in a separate thread
-      threading.Thread(target=send_bulk_emails, args=(sender_email, app_password, smtp_server, subject, email_body, pdf_path, to_list, settings), daemon=True).start()
+      # Render the messages into the outbox and follow the delivery workers in a separate thread
+      threading.Thread(target=send_to_outbox, args=(subject, email_body, attachments, to_list, current_settings, progress_queue, journal),
+                       kwargs={"restart": restart, "attachment_cache_dir": ATTACHMENT_CACHE_DIR}, daemon=True).start()
+      send_button.configure(state="disabled")
       # Start the progress monitoring
       monitor_progress()
   except Exception as e:
@@ -639,181 +822,302 @@ def get_formatted_email_body():
   """
   Converts the content of the Text widget, along with its tags, into an HTML-formatted string.
   Handles multiple overlapping tags (e.g., bold, italic, underline) correctly.
+  The text and tag changes are read in one dump rather than one character at a time.
   """
-  # Initialize variables
-  html_output = ""
-  index = "1.0"
-  prev_tags = []
+  return text_widget_to_html(email_body_text)
 
-  while True:
-      # Get the character at the current index
-      char = email_body_text.get(index)
+# ------------------------------------------------------------------------
+# Settings Frame
+# ------------------------------------------------------------------------
 
-      # Break if we've reached the end
-      if char == "":
-          break
+# Built the first time the settings frame is opened
+settings_frame = None
 
-      # Get current tags at this index
-      current_tags = email_body_text.tag_names(index)
+def build_settings_frame():
+  """
+  Create the settings frame and its widgets, filled in from the saved settings.
+  """
+  global settings_frame, sender_account_combobox, sender_entries, sender_profiles
+  global delivery_engine_combobox, delivery_workers_entry, domain_limits_entry, metrics_port_entry, suppression_count_label
+
+  settings_frame = ctk.CTkFrame(app)
+  settings_frame.grid(row=0, column=1, sticky="nsew", padx=10, pady=10)
+  settings_frame.grid_columnconfigure(1, weight=1)
+  settings_frame.configure(fg_color="transparent")  # Set frame background to transparent
+
+  # Sender Account
+  sender_account_label = ctk.CTkLabel(settings_frame, text="Sender Account:")
+  sender_account_label.grid(row=0, column=0, sticky="w", pady=(0,5))
+  sender_account_frame = ctk.CTkFrame(settings_frame)
+  sender_account_frame.grid(row=0, column=1, sticky="w", pady=(0,5))
+  sender_account_frame.configure(fg_color="transparent")  # Set frame background to transparent
+  sender_account_combobox = ctk.CTkComboBox(sender_account_frame, width=220, state="readonly", command=lambda choice: select_sender_account(choice))
+  sender_account_combobox.grid(row=0, column=0, sticky="w", padx=(0, 10))
+  add_sender_button = ctk.CTkButton(sender_account_frame, text="Add", width=80, command=lambda: add_sender_account())
+  add_sender_button.grid(row=0, column=1, sticky="w", padx=(0, 10))
+  remove_sender_button = ctk.CTkButton(sender_account_frame, text="Remove", width=80, command=lambda: remove_sender_account())
+  remove_sender_button.grid(row=0, column=2, sticky="w")
+
+  # Sender Email
+  sender_email_label = ctk.CTkLabel(settings_frame, text="Sender Email:")
+  sender_email_label.grid(row=1, column=0, sticky="w", pady=(0,5))
+  sender_email_entry = ctk.CTkEntry(settings_frame, width=400, placeholder_text="someone@example.com")
+  sender_email_entry.grid(row=1, column=1, sticky="w", pady=(0,5))
+
+  # App Password
+  app_password_label = ctk.CTkLabel(settings_frame, text="App Password:")
+  app_password_label.grid(row=2, column=0, sticky="w", pady=(0,5))
+  app_password_entry = ctk.CTkEntry(settings_frame, width=400, show="*", placeholder_text="Enter your application password")
+  app_password_entry.grid(row=2, column=1, sticky="w", pady=(0,5))
+
+  # SMTP Server
+  smtp_server_label = ctk.CTkLabel(settings_frame, text="SMTP Server:")
+  smtp_server_label.grid(row=3, column=0, sticky="w", pady=(0,5))
+  smtp_server_entry = ctk.CTkEntry(settings_frame, width=400)
+  smtp_server_entry.grid(row=3, column=1, sticky="w", pady=(0,5))
+
+  # SMTP Connections
+  smtp_connections_label = ctk.CTkLabel(settings_frame, text="SMTP Connections:")
+  smtp_connections_label.grid(row=4, column=0, sticky="w", pady=(0,5))
+  smtp_connections_entry = ctk.CTkEntry(settings_frame, width=400)
+  smtp_connections_entry.grid(row=4, column=1, sticky="w", pady=(0,5))
+
+  # Rate per Second
+  rate_per_second_label = ctk.CTkLabel(settings_frame, text="Max Emails Per Second:")
+  rate_per_second_label.grid(row=5, column=0, sticky="w", pady=(0,5))
+  rate_per_second_entry = ctk.CTkEntry(settings_frame, width=400, placeholder_text="No limit")
+  rate_per_second_entry.grid(row=5, column=1, sticky="w", pady=(0,5))
+
+  # Rate per Minute
+  rate_per_minute_label = ctk.CTkLabel(settings_frame, text="Max Emails Per Minute:")
+  rate_per_minute_label.grid(row=6, column=0, sticky="w", pady=(0,5))
+  rate_per_minute_entry = ctk.CTkEntry(settings_frame, width=400, placeholder_text="No limit")
+  rate_per_minute_entry.grid(row=6, column=1, sticky="w", pady=(0,5))
+
+  # Rate per Hour
+  rate_per_hour_label = ctk.CTkLabel(settings_frame, text="Max Emails Per Hour:")
+  rate_per_hour_label.grid(row=7, column=0, sticky="w", pady=(0,5))
+  rate_per_hour_entry = ctk.CTkEntry(settings_frame, width=400, placeholder_text="No limit")
+  rate_per_hour_entry.grid(row=7, column=1, sticky="w", pady=(0,5))
+
+  # Rate per Day
+  rate_per_day_label = ctk.CTkLabel(settings_frame, text="Max Emails Per Day:")
+  rate_per_day_label.grid(row=8, column=0, sticky="w", pady=(0,5))
+  rate_per_day_entry = ctk.CTkEntry(settings_frame, width=400, placeholder_text="No limit")
+  rate_per_day_entry.grid(row=8, column=1, sticky="w", pady=(0,5))
+
+  # Rate Jitter
+  rate_jitter_label = ctk.CTkLabel(settings_frame, text="Random Jitter (seconds):")
+  rate_jitter_label.grid(row=9, column=0, sticky="w", pady=(0,5))
+  rate_jitter_entry = ctk.CTkEntry(settings_frame, width=400)
+  rate_jitter_entry.grid(row=9, column=1, sticky="w", pady=(0,5))
+
+  # Weight
+  weight_label = ctk.CTkLabel(settings_frame, text="Account Weight:")
+  weight_label.grid(row=10, column=0, sticky="w", pady=(0,5))
+  weight_entry = ctk.CTkEntry(settings_frame, width=400)
+  weight_entry.grid(row=10, column=1, sticky="w", pady=(0,5))
+
+  # DKIM Selector
+  dkim_selector_label = ctk.CTkLabel(settings_frame, text="DKIM Selector:")
+  dkim_selector_label.grid(row=11, column=0, sticky="w", pady=(0,5))
+  dkim_selector_entry = ctk.CTkEntry(settings_frame, width=400, placeholder_text="No signing")
+  dkim_selector_entry.grid(row=11, column=1, sticky="w", pady=(0,5))
+
+  # DKIM Key File
+  dkim_key_file_label = ctk.CTkLabel(settings_frame, text="DKIM Private Key:")
+  dkim_key_file_label.grid(row=12, column=0, sticky="w", pady=(0,5))
+  dkim_key_file_frame = ctk.CTkFrame(settings_frame)
+  dkim_key_file_frame.grid(row=12, column=1, sticky="w", pady=(0,5))
+  dkim_key_file_frame.configure(fg_color="transparent")  # Set frame background to transparent
+  dkim_key_file_entry = ctk.CTkEntry(dkim_key_file_frame, width=290, placeholder_text="PEM file (RSA or Ed25519)")
+  dkim_key_file_entry.grid(row=0, column=0, sticky="w", padx=(0, 10))
+  browse_dkim_key_button = ctk.CTkButton(dkim_key_file_frame, text="Browse", width=100,
+                                         command=lambda: browse_dkim_key_file(dkim_key_file_entry))
+  browse_dkim_key_button.grid(row=0, column=1, sticky="w")
+
+  # Fields of the selected sender account
+  sender_entries = {
+      "sender_email": sender_email_entry,
+      "app_password": app_password_entry,
+      "smtp_server": smtp_server_entry,
+      "smtp_connections": smtp_connections_entry,
+      "rate_per_second": rate_per_second_entry,
+      "rate_per_minute": rate_per_minute_entry,
+      "rate_per_hour": rate_per_hour_entry,
+      "rate_per_day": rate_per_day_entry,
+      "rate_jitter": rate_jitter_entry,
+      "weight": weight_entry,
+      "dkim_selector": dkim_selector_entry,
+      "dkim_key_file": dkim_key_file_entry
+  }
 
-      # Determine tags to close
-      closing_tags = [tag for tag in prev_tags if tag not in current_tags]
-      # Determine tags to open
-      opening_tags = [tag for tag in current_tags if tag not in prev_tags]
+  # Delivery Engine
+  delivery_engine_label = ctk.CTkLabel(settings_frame, text="Delivery Engine:")
+  delivery_engine_label.grid(row=13, column=0, sticky="w", pady=(0,5))
+  delivery_engine_combobox = ctk.CTkComboBox(settings_frame, width=400, values=DELIVERY_ENGINES, state="readonly")
+  delivery_engine_combobox.grid(row=13, column=1, sticky="w", pady=(0,5))
+  delivery_engine_combobox.set(settings.get("delivery_engine", "threads"))
+
+  # Delivery Workers
+  delivery_workers_label = ctk.CTkLabel(settings_frame, text="Delivery Workers:")
+  delivery_workers_label.grid(row=14, column=0, sticky="w", pady=(0,5))
+  delivery_workers_entry = ctk.CTkEntry(settings_frame, width=400)
+  delivery_workers_entry.grid(row=14, column=1, sticky="w", pady=(0,5))
+  delivery_workers_entry.insert(0, settings.get("delivery_workers", DEFAULT_SETTINGS["delivery_workers"]))
+
+  # Domain Limits
+  domain_limits_label = ctk.CTkLabel(settings_frame, text="Domain Limits:")
+  domain_limits_label.grid(row=15, column=0, sticky="w", pady=(0,5))
+  domain_limits_entry = ctk.CTkEntry(settings_frame, width=400)
+  domain_limits_entry.grid(row=15, column=1, sticky="w", pady=(0,5))
+  domain_limits_entry.insert(0, settings.get("domain_limits", DEFAULT_DOMAIN_LIMITS))
+
+  # Metrics Port
+  metrics_port_label = ctk.CTkLabel(settings_frame, text="Metrics Port:")
+  metrics_port_label.grid(row=16, column=0, sticky="w", pady=(0,5))
+  metrics_port_entry = ctk.CTkEntry(settings_frame, width=400, placeholder_text="Disabled")
+  metrics_port_entry.grid(row=16, column=1, sticky="w", pady=(0,5))
+  metrics_port_entry.insert(0, settings.get("metrics_port", ""))
+
+  # Suppression List
+  suppression_label = ctk.CTkLabel(settings_frame, text="Suppression List:")
+  suppression_label.grid(row=17, column=0, sticky="w", pady=(0,5))
+  suppression_frame = ctk.CTkFrame(settings_frame)
+  suppression_frame.grid(row=17, column=1, sticky="w", pady=(0,5))
+  suppression_frame.configure(fg_color="transparent")  # Set frame background to transparent
+  import_suppression_button = ctk.CTkButton(suppression_frame, text="Import Addresses", command=lambda: import_suppression_list())
+  import_suppression_button.grid(row=0, column=0, sticky="w", padx=(0, 10))
+  process_bounces_button = ctk.CTkButton(suppression_frame, text="Process Bounces", command=lambda: process_bounce_mailbox())
+  process_bounces_button.grid(row=0, column=1, sticky="w", padx=(0, 10))
+  suppression_count_label = ctk.CTkLabel(suppression_frame, text="")
+  suppression_count_label.grid(row=0, column=2, sticky="w")
+
+  # Save Settings Button
+  save_settings_button = ctk.CTkButton(settings_frame, text="Save Settings", command=lambda: save_current_settings())
+  save_settings_button.grid(row=18, column=1, sticky="e", pady=(10,0))
+
+  # Work on a copy of the saved sender accounts; an empty list starts with one new account
+  sender_profiles = [dict(profile) for profile in settings["senders"]] or [DEFAULT_SENDER.copy()]
+  show_sender_account(0)
+
+  update_suppression_count()
 
-      # Close tags in reverse order to maintain proper nesting
-      for tag in reversed(closing_tags):
-          html_output += get_html_closing_tag(tag)
+# ------------------------------------------------------------------------
+# Sender Accounts
+# ------------------------------------------------------------------------
 
-      # Open new tags
-      for tag in opening_tags:
-          html_output += get_html_opening_tag(tag)
+# Index of the sender account shown in the settings frame
+selected_sender = 0
 
-      # Add the current character, escaped for HTML
-      if char == "\n":
-          html_output += "<br>"
-      else:
-          html_output += escape_html(char)
-
-      # Update previous tags
-      prev_tags = current_tags
-
-      # Move to next character
-      index = email_body_text.index(f"{index}+1c")
-
-  # Close any remaining open tags
-  for tag in reversed(prev_tags):
-      html_output += get_html_closing_tag(tag)
-
-  return html_output
-
-def get_html_opening_tag(tag):
-  """
-  Returns the appropriate HTML opening tag based on the tkinter tag.
-  """
-  if tag == "bold":
-      return "<b>"
-  elif tag == "italic":
-      return "<i>"
-  elif tag == "underline":
-      return "<u>"
-  elif tag.startswith("size_"):
-      size = tag.split("_")[1]
-      return f'<span style="font-size:{size}px">'
-  elif tag.startswith("font_"):
-      font_key = tag.split("_", 1)[1]
-      # Map back the tag to actual font names with spaces
-      font_display_mapping = {
-          "Sans_Serif": "Sans Serif",
-          "Serif": "Serif",
-          "Fixed_Width": "Fixed Width",
-          "Wide": "Wide",
-          "Narrow": "Narrow",
-          "Comic_Sans_MS": "Comic Sans MS",
-          "Garamond": "Garamond",
-          "Georgia": "Georgia",
-          "Tahoma": "Tahoma",
-          "Trebuchet_MS": "Trebuchet MS",
-          "Verdana": "Verdana"
-      }
-      font_name = font_display_mapping.get(font_key, font_key)
-      return f'<span style="font-family:\'{font_name}\';">'
-  elif tag in ["left", "center", "right"]:
-      return f'<div style="text-align:{tag};">'
-  else:
-      return ""
-
-def get_html_closing_tag(tag):
-  """
-  Returns the appropriate HTML closing tag based on the tkinter tag.
-  """
-  if tag == "bold":
-      return "</b>"
-  elif tag == "italic":
-      return "</i>"
-  elif tag == "underline":
-      return "</u>"
-  elif tag.startswith("size_") or tag.startswith("font_"):
-      return "</span>"
-  elif tag in ["left", "center", "right"]:
-      return "</div>"
+def sender_account_labels():
+  """
+  One label per sender account for the account selector.
+  """
+  return [f"{i+1}. {profile['sender_email'] or 'New account'}" for i, profile in enumerate(sender_profiles)]
+
+def show_sender_account(index):
+  """
+  Fill the account fields of the settings frame from the sender account at `index`.
+  """
+  global selected_sender
+  selected_sender = index
+  for field, entry in sender_entries.items():
+      value = sender_profiles[index].get(field, DEFAULT_SENDER[field])
+      entry.delete(0, "end")
+      if value:
+          entry.insert(0, value)
+  sender_account_combobox.configure(values=sender_account_labels())
+  sender_account_combobox.set(sender_account_labels()[index])
+
+def store_sender_account():
+  """
+  Copy the account fields of the settings frame into the selected sender account.
+  """
+  for field, entry in sender_entries.items():
+      sender_profiles[selected_sender][field] = entry.get()
+
+def select_sender_account(choice):
+  """
+  Show the sender account picked in the account selector.
+  """
+  store_sender_account()
+  show_sender_account(sender_account_labels().index(choice))
+
+def add_sender_account():
+  """
+  Add a new sender account with the default limits and show it.
+  """
+  store_sender_account()
+  sender_profiles.append(DEFAULT_SENDER.copy())
+  show_sender_account(len(sender_profiles) - 1)
+
+def remove_sender_account():
+  """
+  Remove the shown sender account (the last one is cleared instead).
+  """
+  if len(sender_profiles) > 1:
+      del sender_profiles[selected_sender]
   else:
-      return ""
+      sender_profiles[0] = DEFAULT_SENDER.copy()
+  show_sender_account(0)
 
-def escape_html(text):
+def browse_dkim_key_file(entry):
   """
-  Escape HTML special characters in text.
+  Put the path of the chosen DKIM private key file in the entry.
   """
-  return html.escape(text)
+  file_path = filedialog.askopenfilename(title="Select DKIM Private Key",
+                                         filetypes=[("PEM Files", "*.pem *.key"), ("All Files", "*.*")])
+  if file_path:
+      entry.delete(0, "end")
+      entry.insert(0, file_path)
 
-# ------------------------------------------------------------------------
-# Settings Frame
-# ------------------------------------------------------------------------
+def update_suppression_count():
+  """
+  Show how many addresses are on the suppression list.
+  """
+  suppression_count_label.configure(text=f"{get_suppression_list().count()} suppressed addresses")
 
-settings_frame = ctk.CTkFrame(app)
-settings_frame.grid(row=0, column=1, sticky="nsew", padx=10, pady=10)
-settings_frame.grid_columnconfigure(1, weight=1)
-settings_frame.configure(fg_color="transparent")  # Set frame background to transparent
-
-# Sender Email
-sender_email_label = ctk.CTkLabel(settings_frame, text="Sender Email:")
-sender_email_label.grid(row=0, column=0, sticky="w", pady=(0,5))
-sender_email_entry = ctk.CTkEntry(settings_frame, width=400, placeholder_text="someone@example.com")
-sender_email_entry.grid(row=0, column=1, sticky="w", pady=(0,5))
-sender_email_entry.insert(0, settings.get("sender_email", ""))
-
-# App Password
-app_password_label = ctk.CTkLabel(settings_frame, text="App Password:")
-app_password_label.grid(row=1, column=0, sticky="w", pady=(0,5))
-app_password_entry = ctk.CTkEntry(settings_frame, width=400, show="*", placeholder_text="Enter your application password")
-app_password_entry.grid(row=1, column=1, sticky="w", pady=(0,5))
-app_password_entry.insert(0, settings.get("app_password", ""))
-
-# SMTP Server
-smtp_server_label = ctk.CTkLabel(settings_frame, text="SMTP Server:")
-smtp_server_label.grid(row=2, column=0, sticky="w", pady=(0,5))
-smtp_server_entry = ctk.CTkEntry(settings_frame, width=400)
-smtp_server_entry.grid(row=2, column=1, sticky="w", pady=(0,5))
-smtp_server_entry.insert(0, settings.get("smtp_server", "smtp.gmail.com"))
-
-# Emails per Batch
-emails_per_batch_label = ctk.CTkLabel(settings_frame, text="Emails Per Batch:")
-emails_per_batch_label.grid(row=3, column=0, sticky="w", pady=(0,5))
-emails_per_batch_entry = ctk.CTkEntry(settings_frame, width=400)
-emails_per_batch_entry.grid(row=3, column=1, sticky="w", pady=(0,5))
-emails_per_batch_entry.insert(0, settings.get("emails_per_batch", "70"))
-
-# Batch Delay Min
-batch_delay_min_label = ctk.CTkLabel(settings_frame, text="Batch Delay Min (seconds):")
-batch_delay_min_label.grid(row=4, column=0, sticky="w", pady=(0,5))
-batch_delay_min_entry = ctk.CTkEntry(settings_frame, width=400)
-batch_delay_min_entry.grid(row=4, column=1, sticky="w", pady=(0,5))
-batch_delay_min_entry.insert(0, settings.get("batch_delay_min", "181"))
-
-# Batch Delay Max
-batch_delay_max_label = ctk.CTkLabel(settings_frame, text="Batch Delay Max (seconds):")
-batch_delay_max_label.grid(row=5, column=0, sticky="w", pady=(0,5))
-batch_delay_max_entry = ctk.CTkEntry(settings_frame, width=400)
-batch_delay_max_entry.grid(row=5, column=1, sticky="w", pady=(0,5))
-batch_delay_max_entry.insert(0, settings.get("batch_delay_max", "230"))
-
-# Email Delay Min
-email_delay_min_label = ctk.CTkLabel(settings_frame, text="Email Delay Min (seconds):")
-email_delay_min_label.grid(row=6, column=0, sticky="w", pady=(0,5))
-email_delay_min_entry = ctk.CTkEntry(settings_frame, width=400)
-email_delay_min_entry.grid(row=6, column=1, sticky="w", pady=(0,5))
-email_delay_min_entry.insert(0, settings.get("email_delay_min", "3"))
-
-# Email Delay Max
-email_delay_max_label = ctk.CTkLabel(settings_frame, text="Email Delay Max (seconds):")
-email_delay_max_label.grid(row=7, column=0, sticky="w", pady=(0,5))
-email_delay_max_entry = ctk.CTkEntry(settings_frame, width=400)
-email_delay_max_entry.grid(row=7, column=1, sticky="w", pady=(0,5))
-email_delay_max_entry.insert(0, settings.get("email_delay_max", "5"))
-
-# Save Settings Button
-save_settings_button = ctk.CTkButton(settings_frame, text="Save Settings", command=lambda: save_current_settings())
-save_settings_button.grid(row=8, column=1, sticky="e", pady=(10,0))
+def import_suppression_list():
+  """
+  Add the addresses of a TXT or CSV file (unsubscribes, complaints...) to the suppression list.
+  """
+  file_path = filedialog.askopenfilename(title="Select Addresses to Suppress",
+                                         filetypes=[("Email Lists", "*.txt *.csv"), ("Text Files", "*.txt"), ("CSV Files", "*.csv")])
+  if not file_path:
+      return
+  try:
+      column = None
+      if is_csv_file(file_path):
+          column = ask_email_column(file_path)
+          if column is None:
+              return
+      emails = (normalize_email(email) or email for email in RecipientFile(file_path, column))
+      added = get_suppression_list().add_many(emails, reason="imported")
+  except Exception as e:
+      messagebox.showerror("Error", f"Failed to import addresses: {e}")
+      return
+  update_suppression_count()
+  messagebox.showinfo("Success", f"{added} new addresses added to the suppression list.")
+
+def process_bounce_mailbox():
+  """
+  Read the bounces in a mailbox exported from the sender account (mbox) and add the addresses
+  that bounced hard, or soft too often, to the suppression list.
+  """
+  from fastmail_core.bounces import BounceProcessor, read_messages
+
+  file_path = filedialog.askopenfilename(title="Select Exported Mailbox",
+                                         filetypes=[("Mailboxes", "*.mbox *.mbx"), ("All Files", "*.*")])
+  if not file_path:
+      return
+  try:
+      report = BounceProcessor(get_suppression_list()).process(read_messages(file_path))
+  except Exception as e:
+      messagebox.showerror("Error", f"Failed to process bounces: {e}")
+      return
+  update_suppression_count()
+  messagebox.showinfo("Bounces Processed", report.summary())
 
 # ------------------------------------------------------------------------
 # Start the Application
@@ -821,6 +1125,11 @@ save_settings_button.grid(row=8, column=1, sticky="e", pady=(10,0))
 
 # Initially show the Send Emails frame
 show_frame(send_emails_frame)
+mark_startup("widgets")
+
+# Report the startup times once the window is painted
+if STARTUP_REPORT_FILE or STARTUP_EXIT:
+  app.after(0, report_startup)
 
 # Run the main application loop
 app.mainloop()
\ No newline at end of file
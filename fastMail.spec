@@ -6,7 +6,14 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    # DKIM signing imports cryptography only when a key is loaded (see fastmail_core/dkim.py)
+    hiddenimports=[
+        'cryptography.hazmat.primitives.asymmetric.ed25519',
+        'cryptography.hazmat.primitives.asymmetric.padding',
+        'cryptography.hazmat.primitives.asymmetric.rsa',
+        'cryptography.hazmat.primitives.hashes',
+        'cryptography.hazmat.primitives.serialization',
+    ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,6 @@
+"""
+Fast Mail sending engine.
+
+This package holds the parts of Fast Mail that do not need a display:
+message building and the SMTP delivery code used by the GUI in fastMail.py.
+"""
@@ -0,0 +1,172 @@
+"""
+Send a campaign from the command line, without the GUI.
+
+Usage:
+    python -m fastmail_core --subject "News" --body body.html --recipients list.csv [--attachment file.pdf ...]
+
+Sender accounts, rate limits and domain limits come from the Fast Mail settings file.
+A JSON summary of the delivery metrics is written to the metrics directory of --data-dir.
+With --workers, the campaign is sent through the outbox of --data-dir by delivery worker
+processes (see fastmail_core.outbox) instead of from this process; so is a campaign given
+a start time, sending windows or a weight, queued with the other campaigns of the outbox.
+An app password missing from the settings can be given in the FASTMAIL_APP_PASSWORD environment variable.
+"""
+# Import required modules
+import argparse
+import os
+import sys
+import time
+
+from fastmail_core.progress import ProgressState
+from fastmail_core.settings import DELIVERY_ENGINES, SETTINGS_DIR
+
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 5.0
+
+class ProgressPrinter:
+  """
+  Takes the place of the GUI's progress queue: folds the events into a
+  ProgressState and prints progress to stderr every PROGRESS_INTERVAL seconds.
+  """
+
+  def __init__(self, quiet=False):
+      self.quiet = quiet
+      self.state = ProgressState()
+      self.last_print = 0.0
+
+  def put(self, message):
+      state = self.state
+      state.update(message)
+      if 'emails_failed' in message:
+          outcome = "deferred" if message.get('deferred') else "refused"
+          self.log(f"{outcome} {message['failed_email']}: {message['reply']}")
+      now = time.monotonic()
+      if state.done or now - self.last_print >= PROGRESS_INTERVAL:
+          self.last_print = now
+          state.sample()
+          self.log(f"sent {state.sent} / {state.total}, refused {state.failed} ({state.summary()})")
+
+  def log(self, text):
+      if not self.quiet:
+          print(text, file=sys.stderr, flush=True)
+
+def parse_args(argv):
+  parser = argparse.ArgumentParser(prog="python -m fastmail_core", description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--subject", required=True)
+  parser.add_argument("--body", required=True, help="HTML file with the email body")
+  parser.add_argument("--recipients", required=True, help="TXT or CSV file of recipient addresses")
+  parser.add_argument("--attachment", action="append", default=[], dest="attachments",
+                      help="file to attach (repeat the option to attach several)")
+  parser.add_argument("--column", help="CSV column holding the addresses (name or 0-based index)")
+  parser.add_argument("--data-dir", default=SETTINGS_DIR,
+                      help="directory of settings.xml, the send journal, the suppression list "
+                           "and the attachment cache")
+  parser.add_argument("--sender", action="append",
+                      help="send only from this account of the settings file (repeatable); "
+                           "an address not in the settings file is added with the default limits")
+  parser.add_argument("--smtp-server", help="SMTP server of every sender account (overrides the settings file)")
+  parser.add_argument("--connections", type=int,
+                      help="SMTP sessions in parallel per sender account (overrides the settings file)")
+  parser.add_argument("--engine", choices=DELIVERY_ENGINES, help="delivery engine (overrides the settings file)")
+  parser.add_argument("--metrics-port", type=int,
+                      help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics while sending")
+  parser.add_argument("--dkim-processes", type=int, default=0, metavar="N",
+                      help="compute DKIM signatures in N worker processes (when signing limits the sending rate)")
+  parser.add_argument("--workers", type=int, metavar="N",
+                      help="render the campaign into the outbox of --data-dir and send it with N delivery "
+                           "worker processes, which keep sending if this command is interrupted")
+  parser.add_argument("--start-at", metavar="'YYYY-MM-DD HH:MM'",
+                      help="send through the outbox, not before this local time")
+  parser.add_argument("--send-window", action="append", metavar="HH:MM-HH:MM",
+                      help="send through the outbox, only between these local times of day (repeatable)")
+  parser.add_argument("--weight", metavar="W",
+                      help="send through the outbox, with W times the share of the delivery capacity of a "
+                           "campaign of weight 1 sending at the same time (default 1)")
+  parser.add_argument("--queue", action="store_true",
+                      help="send through the outbox and return once the campaign is queued, "
+                           "without following its progress")
+  parser.add_argument("--restart", action="store_true",
+                      help="send to everyone again instead of resuming a previous run of this campaign")
+  parser.add_argument("--quiet", action="store_true", help="only print errors")
+  return parser.parse_args(argv)
+
+def main(argv=None):
+  args = parse_args(argv)
+
+  # Imported after parsing so --help and usage errors return immediately
+  from fastmail_core.campaign import send_bulk_emails
+  from fastmail_core.journal import SendJournal, campaign_id_for
+  from fastmail_core.outbox import send_to_outbox
+  from fastmail_core.recipients import RecipientCleaner, RecipientFile
+  from fastmail_core.scheduler import CampaignSchedule
+  from fastmail_core.senders import DEFAULT_SENDER, validate_sender
+  from fastmail_core.settings import load_settings
+  from fastmail_core.suppression import SuppressionList
+
+  progress = ProgressPrinter(args.quiet)
+  use_outbox = bool(args.workers or args.start_at or args.send_window or args.weight or args.queue)
+  try:
+      schedule = CampaignSchedule.from_settings(args.start_at, ",".join(args.send_window or ()), args.weight)
+      settings = load_settings(os.path.join(args.data_dir, "settings.xml"))
+      senders = settings["senders"]
+      if args.sender:
+          known = {profile["sender_email"]: profile for profile in senders}
+          senders = [known.get(email) or dict(DEFAULT_SENDER, sender_email=email) for email in args.sender]
+      for profile in senders:
+          if args.smtp_server:
+              profile["smtp_server"] = args.smtp_server
+          if args.connections:
+              profile["smtp_connections"] = str(args.connections)
+          if not profile["app_password"]:
+              profile["app_password"] = os.getenv("FASTMAIL_APP_PASSWORD", "")
+          validate_sender(profile)
+      if not senders:
+          raise ValueError("No sender account is set up: add one in the settings or pass --sender.")
+      settings["senders"] = senders
+      if args.engine:
+          settings["delivery_engine"] = args.engine
+      if args.metrics_port:
+          settings["metrics_port"] = str(args.metrics_port)
+
+      with open(args.body, "r", encoding="utf-8") as f:
+          email_body = f.read()
+
+      os.makedirs(args.data_dir, exist_ok=True)
+      column = int(args.column) if args.column and args.column.isdigit() else args.column
+      suppression = SuppressionList(os.path.join(args.data_dir, "suppression.sqlite3"))
+      to_list = RecipientCleaner(RecipientFile(args.recipients, column), suppression)
+      cleaning_report = to_list.scan()
+      progress.log(cleaning_report.summary())
+      if not cleaning_report.valid:
+          raise ValueError("No valid recipients left to send to.")
+
+      journal = SendJournal(os.path.join(args.data_dir, "journal.sqlite3"),
+                            campaign_id_for(senders[0]["sender_email"], args.subject, email_body, args.attachments),
+                            args.subject)
+      if args.restart:
+          journal.reset()
+      if use_outbox:
+          if args.workers:
+              settings["delivery_workers"] = str(args.workers)
+          send_to_outbox(args.subject, email_body, args.attachments, to_list, settings, progress, journal,
+                         args.data_dir, args.restart, os.path.join(args.data_dir, "attachment_cache"), schedule,
+                         follow=not args.queue)
+          if args.queue:
+              progress.log(f"queued {progress.state.total} recipients; the delivery workers send them")
+          elif progress.state.error:
+              raise RuntimeError(f"sending stopped: {progress.state.error}")
+      else:
+          send_bulk_emails(args.subject, email_body, args.attachments, to_list, settings, progress, journal,
+                           os.path.join(args.data_dir, "metrics"), args.dkim_processes,
+                           os.path.join(args.data_dir, "attachment_cache"))
+  except KeyboardInterrupt:
+      progress.log("interrupted; run the same command again to resume"
+                   + (" (the delivery workers keep sending)" if use_outbox else ""))
+      return 130
+  except Exception as e:
+      print(f"error: {e}", file=sys.stderr)
+      return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
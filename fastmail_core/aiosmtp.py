@@ -0,0 +1,498 @@
+# Import required modules
+import asyncio
+import base64
+import smtplib
+import ssl
+import time
+
+from fastmail_core.esmtp import (CRLF, TLSSessionCache, WorkerSession, check_pipelined_replies, dot_stuff_chunks,
+                                 message_chunks, message_size, require_smtputf8, transaction_commands)
+from fastmail_core.domains import DISPATCH_WINDOW, TAKE_DONE, TAKE_ITEM
+from fastmail_core.engine import DeliveryEngine
+from fastmail_core.retry import MAX_RECONNECT_ATTEMPTS
+
+# ------------------------------------------------------------------------
+# Asyncio SMTP Client
+# ------------------------------------------------------------------------
+
+class AsyncSMTP:
+  """
+  A small SMTP client running on asyncio streams.
+  Errors are raised as the matching smtplib exceptions so callers can
+  handle both delivery engines the same way.
+  """
+
+  def __init__(self, host, port=587, timeout=60, local_hostname="localhost"):
+      self.host = host
+      self.port = port
+      self.timeout = timeout
+      self.local_hostname = local_hostname
+      self.reader = None
+      self.writer = None
+      self.esmtp_features = {}
+
+  async def connect(self):
+      """
+      Open the TCP connection and read the server greeting.
+      """
+      try:
+          self.reader, self.writer = await asyncio.wait_for(
+              asyncio.open_connection(self.host, self.port), self.timeout)
+      except asyncio.TimeoutError:
+          raise smtplib.SMTPServerDisconnected("Connection timed out")
+      code, message = await self.read_reply()
+      if code != 220:
+          self.close()
+          raise smtplib.SMTPConnectError(code, message)
+      return code, message
+
+  async def read_reply(self):
+      """
+      Read one (possibly multi-line) reply and return (code, message).
+      """
+      lines = []
+      while True:
+          try:
+              line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+          except asyncio.TimeoutError:
+              self.close()
+              raise smtplib.SMTPServerDisconnected("Connection timed out")
+          if not line:
+              self.close()
+              raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+          try:
+              code = int(line[:3])
+          except ValueError:
+              code = -1
+          lines.append(line[4:].strip())
+          if line[3:4] != b"-":
+              return code, b"\n".join(lines)
+
+  async def drain(self):
+      """
+      Wait until the write buffer is flushed to the server, as long as the
+      timeout at most: a server that stops reading must not hold the session.
+      """
+      try:
+          await asyncio.wait_for(self.writer.drain(), self.timeout)
+      except asyncio.TimeoutError:
+          self.close()
+          raise smtplib.SMTPServerDisconnected("Connection timed out")
+
+  async def command(self, line, encoding="ascii"):
+      """
+      Send one command line and wait for its reply. Lines carrying a non-ASCII
+      address are encoded in UTF-8, in a transaction started with SMTPUTF8.
+      """
+      if self.writer is None:
+          raise smtplib.SMTPServerDisconnected("Please run connect() first")
+      self.writer.write(line.encode(encoding) + CRLF)
+      await self.drain()
+      return await self.read_reply()
+
+  async def ehlo(self):
+      """
+      Send EHLO and record the extensions the server advertises.
+      """
+      code, message = await self.command(f"EHLO {self.local_hostname}")
+      if code != 250:
+          raise smtplib.SMTPHeloError(code, message)
+      self.esmtp_features = {}
+      for line in message.decode("latin-1").split("\n")[1:]:
+          keyword, _, params = line.partition(" ")
+          self.esmtp_features[keyword.lower()] = params
+      return code, message
+
+  def has_extn(self, name):
+      """
+      Return True if the server advertised the given extension.
+      """
+      return name.lower() in self.esmtp_features
+
+  async def starttls(self, context=None):
+      """
+      Upgrade the connection to TLS and say EHLO again.
+      """
+      if not self.has_extn("starttls"):
+          raise smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server.")
+      code, message = await self.command("STARTTLS")
+      if code != 220:
+          raise smtplib.SMTPResponseException(code, message)
+      context = context or ssl.create_default_context()
+      await asyncio.wait_for(
+          self.writer.start_tls(context, server_hostname=self.host), self.timeout)
+      await self.ehlo()
+      return code, message
+
+  async def login(self, user, password):
+      """
+      Authenticate with AUTH PLAIN, or AUTH LOGIN if PLAIN is not offered.
+      """
+      mechanisms = self.esmtp_features.get("auth", "").upper().split()
+      if "PLAIN" in mechanisms or "LOGIN" not in mechanisms:
+          token = base64.b64encode(f"\0{user}\0{password}".encode("utf-8")).decode("ascii")
+          code, message = await self.command(f"AUTH PLAIN {token}")
+      else:
+          code, message = await self.command("AUTH LOGIN")
+          if code == 334:
+              code, message = await self.command(base64.b64encode(user.encode("utf-8")).decode("ascii"))
+          if code == 334:
+              code, message = await self.command(base64.b64encode(password.encode("utf-8")).decode("ascii"))
+      if code not in (235, 503):
+          raise smtplib.SMTPAuthenticationError(code, message)
+      return code, message
+
+  async def sendmail(self, from_addr, to_addrs, data, mail_options=()):
+      """
+      Run MAIL FROM / RCPT TO / DATA for one message, pipelined when the
+      server advertises PIPELINING. `mail_options` are added to MAIL FROM,
+      with the message size when the server advertises SIZE; a non-ASCII
+      address needs "SMTPUTF8" (see esmtp.require_smtputf8).
+      Returns a dict of refused recipients, like smtplib.SMTP.sendmail.
+      """
+      require_smtputf8(self, to_addrs, mail_options)
+      mail_options = list(mail_options)
+      if self.has_extn("size"):
+          mail_options.append(f"size={message_size(data)}")
+      encoding = "utf-8" if "SMTPUTF8" in mail_options else "ascii"
+      if self.has_extn("pipelining"):
+          return await self.sendmail_pipelined(from_addr, to_addrs, data, mail_options, encoding)
+
+      mail_line, *rcpt_lines, data_line = transaction_commands(from_addr, to_addrs, mail_options)
+      code, message = await self.command(mail_line, encoding)
+      if code != 250:
+          await self.rset()
+          raise smtplib.SMTPSenderRefused(code, message, from_addr)
+
+      refused = {}
+      for to_addr, rcpt_line in zip(to_addrs, rcpt_lines):
+          code, message = await self.command(rcpt_line, encoding)
+          if code not in (250, 251):
+              refused[to_addr] = (code, message)
+      if len(refused) == len(to_addrs):
+          await self.rset()
+          raise smtplib.SMTPRecipientsRefused(refused)
+
+      code, message = await self.command(data_line)
+      if code != 354:
+          await self.rset()
+          raise smtplib.SMTPDataError(code, message)
+      return await self.send_data(data, refused)
+
+  async def sendmail_pipelined(self, from_addr, to_addrs, data, mail_options=(), encoding="ascii"):
+      """
+      Write MAIL FROM, every RCPT TO and DATA at once, then read the replies
+      and match each one back to its command (RFC 2920).
+      """
+      commands = transaction_commands(from_addr, to_addrs, mail_options)
+      self.writer.write("".join(f"{command}\r\n" for command in commands).encode(encoding))
+      await self.drain()
+      mail_reply = await self.read_reply()
+      rcpt_replies = [await self.read_reply() for _ in to_addrs]
+      data_reply = await self.read_reply()
+
+      try:
+          refused = check_pipelined_replies(from_addr, to_addrs, mail_reply, rcpt_replies, data_reply)
+      except smtplib.SMTPException:
+          if data_reply[0] == 354:
+              # The server accepted DATA anyway: end it with an empty message
+              self.writer.write(b"." + CRLF)
+              await self.read_reply()
+          await self.rset()
+          raise
+      return await self.send_data(data, refused)
+
+  async def send_data(self, data, refused):
+      """
+      Stream the message after a 354 reply and check the final reply. Waiting
+      for the write buffer to drain after each chunk keeps at most about one
+      chunk of the message in memory.
+      """
+      for chunk in dot_stuff_chunks(message_chunks(data)):
+          self.writer.write(chunk)
+          await self.drain()
+      code, message = await self.read_reply()
+      if code != 250:
+          await self.rset()
+          raise smtplib.SMTPDataError(code, message)
+      return refused
+
+  async def rset(self):
+      """
+      Reset the current transaction, ignoring a dropped connection.
+      """
+      try:
+          return await self.command("RSET")
+      except smtplib.SMTPServerDisconnected:
+          return None
+
+  async def noop(self):
+      """
+      Send NOOP (keeps an idle session open) and return its reply.
+      """
+      return await self.command("NOOP")
+
+  async def quit(self):
+      """
+      Say QUIT and close the connection.
+      """
+      try:
+          if self.writer is not None:
+              await self.command("QUIT")
+      except (smtplib.SMTPServerDisconnected, OSError):
+          pass
+      finally:
+          self.close()
+
+  def close(self):
+      """
+      Close the underlying transport without waiting for the server.
+      """
+      if self.writer is not None:
+          self.writer.close()
+      self.reader = None
+      self.writer = None
+
+# ------------------------------------------------------------------------
+# Asyncio Delivery Engine
+# ------------------------------------------------------------------------
+
+class AsyncSMTPEngine(DeliveryEngine):
+  """
+  Delivery engine that runs many SMTP conversations on one event loop.
+  It mirrors SMTPPool, with a coroutine per session instead of a thread
+  (see DeliveryEngine for how sessions share recipients and accounts).
+  Sessions are opened when the engine starts, kept alive with NOOP while
+  they wait and reopened (resuming the account's TLS session) only when lost
+  or closed for a long wait. A session blocked on a domain group or another
+  account's turn sleeps until a send finishes or a turn is taken (see
+  notify), or until the rate limit that blocks it allows the next send.
+  """
+
+  def __init__(self, accounts, progress_queue, journal=None, domain_limits=None, metrics=None, timeout=60,
+               offload_render=False, dispatch_window=DISPATCH_WINDOW):
+      super().__init__(accounts, progress_queue, journal, domain_limits, metrics, dispatch_window)
+      self.timeout = timeout
+      self.offload_render = offload_render
+      self.changed = None  # asyncio.Event, replaced each time it is set (see notify)
+
+  async def connect(self, account, reconnect=False):
+      """
+      Open one authenticated session of an account, timing the connect, STARTTLS
+      (full or resumed) and login stages.
+      """
+      client = AsyncSMTP(account.smtp_server, account.port, self.timeout)
+      try:
+          started = time.perf_counter()
+          await client.connect()
+          await client.ehlo()
+          connected = time.perf_counter()
+          if account.use_starttls:
+              await client.starttls(account.tls_context)
+          secured = time.perf_counter()
+          await client.login(account.sender_email, account.app_password)
+      except BaseException:
+          client.close()
+          raise
+      self.metrics.observe("connect", connected - started)
+      if account.use_starttls:
+          resumed = (isinstance(account.tls_context, TLSSessionCache)
+                     and account.tls_context.remember(client.writer.get_extra_info("ssl_object")))
+          self.metrics.observe("starttls_resumed" if resumed else "starttls", secured - connected)
+      self.metrics.observe("login", time.perf_counter() - secured)
+      self.metrics.session_opened(reconnect)
+      return client
+
+  async def deliver(self, client, account, email, data):
+      """
+      Send one rendered message on a session and record its transfer time,
+      size and reply code.
+      """
+      mail_options = () if email.isascii() else ("SMTPUTF8",)
+      started = time.perf_counter()
+      try:
+          await client.sendmail(account.sender_email, [email], data, mail_options)
+      except smtplib.SMTPException as e:
+          self.observe_failure(email, e)
+          raise
+      self.metrics.observe("transfer", time.perf_counter() - started)
+      self.metrics.reply(250, message_size(data), account.sender_email)
+
+  def run(self, recipients, render):
+      """
+      Send to every (index, email) pair in `recipients` and block until done.
+      `recipients` may be a generator: the dispatcher reads it lazily, at most
+      `dispatch_window` recipients ahead.
+      `render(index, email, account)` returns the message bytes for one recipient,
+      sent from the given SenderAccount.
+      """
+      asyncio.run(self.run_async(recipients, render))
+
+  async def run_async(self, recipients, render):
+      """
+      Coroutine version of run(). The first error cancels the other sessions
+      and is re-raised; cancelling this coroutine closes every session.
+      """
+      self.changed = asyncio.Event()
+      tasks = [asyncio.create_task(self.worker(account, render)) for account in self.start(recipients)]
+      try:
+          await asyncio.gather(*tasks)
+      finally:
+          self.dispatcher.close()
+          self.rotation.close()
+          for task in tasks:
+              task.cancel()
+          await asyncio.gather(*tasks, return_exceptions=True)
+
+  async def next_recipient(self, session=None):
+      """
+      Take the next (index, email, attempt, group) from the dispatcher, waiting while
+      every group with pending recipients is at its limits. Returns None when done.
+      The worker's session is kept alive meanwhile.
+      """
+      while True:
+          kind, value, changes = self.dispatcher.take()
+          if kind == TAKE_ITEM:
+              return value
+          if kind == TAKE_DONE:
+              return None
+          self.report_delay(value)
+          await self.wait_for_change(await self.keep_alive(session, value))
+
+  def notify(self):
+      """
+      Wake the sessions waiting on the dispatcher or the rotation: a send
+      finished, a recipient was put back or an account took its turn. Every
+      call runs on the event loop, so a waiter cannot miss it.
+      """
+      self.changed.set()
+      self.changed = asyncio.Event()
+
+  async def wait_for_change(self, timeout):
+      """
+      Wait until notify() is called or `timeout` seconds pass (None: until notified).
+      """
+      try:
+          await asyncio.wait_for(self.changed.wait(), timeout)
+      except asyncio.TimeoutError:
+          pass
+
+  async def keep_alive(self, session, wait):
+      """
+      Look after a worker's session before it waits `wait` seconds, None for
+      until woken (see SMTPPool.keep_alive). Returns how long to wait.
+      """
+      plan = self.idle_plan(session, wait)
+      if plan == "close":
+          await self.close_session(session)
+          return wait
+      if plan == "noop":
+          try:
+              code, message = await session.connection.noop()
+              if code != 250:
+                  raise smtplib.SMTPResponseException(code, message)
+              session.used()
+              self.metrics.keepalive()
+          except (smtplib.SMTPException, OSError):
+              self.drop_session(session)
+              return wait
+      return self.idle_wait(session, wait)
+
+  async def close_session(self, session):
+      """
+      Say QUIT on a worker's session and forget it.
+      """
+      client = session.detach()
+      if client is not None:
+          self.metrics.session_closed()
+          await client.quit()
+
+  def drop_session(self, session):
+      """
+      Forget a worker's session that was lost, closing its transport.
+      """
+      client = session.detach()
+      if client is not None:
+          self.metrics.session_closed()
+          client.close()
+
+  async def worker(self, account, render):
+      """
+      Worker coroutine: one SMTP session of an account, paced by the sender rotation.
+      The session is opened as soon as the worker starts, and opened again if it
+      is lost; the recipient in hand is then sent again on the new session.
+      """
+      session = WorkerSession()
+      try:
+          session.attach(await self.open_session(account))
+          while True:
+              item = await self.next_recipient(session)
+              if item is None:
+                  break
+              i, email, attempt, group = item
+              try:
+                  await self.wait_for_turn(account, session)
+                  if session.connection is None:
+                      # Lost, or closed during a long wait
+                      session.attach(await self.open_session(account, reconnect=session.opened))
+
+                  started = time.perf_counter()
+                  error = latency = None
+                  self.begin_send()
+                  try:
+                      if self.offload_render:
+                          data = await asyncio.get_running_loop().run_in_executor(None, render, i, email, account)
+                      else:
+                          data = render(i, email, account)
+                      self.metrics.observe("build", time.perf_counter() - started)
+                      try:
+                          await self.deliver(session.connection, account, email, data)
+                          latency = time.perf_counter() - started
+                      except (smtplib.SMTPException, OSError) as e:
+                          error = e
+                  finally:
+                      self.end_send()
+                      self.rotation.finished(account)
+                      session.used()
+
+                  if self.settle(account, item, error, latency):
+                      # The session is gone: open a new one for the next recipient
+                      self.drop_session(session)
+              finally:
+                  self.dispatcher.finish(group)
+                  self.notify()
+      finally:
+          await self.close_session(session)
+
+  async def open_session(self, account, reconnect=False):
+      """
+      Open a session of an account, trying again with backoff while the failure
+      is transient or a connection error (see DeliveryEngine.reconnect_delay).
+      """
+      for attempt in range(1, MAX_RECONNECT_ATTEMPTS + 1):
+          try:
+              return await self.connect(account, reconnect)
+          except (smtplib.SMTPException, OSError) as e:
+              delay = self.reconnect_delay(attempt, e)
+          await asyncio.sleep(delay)
+          reconnect = True
+
+  async def wait_for_turn(self, account, session=None):
+      """
+      Wait for the account's next send slot from the rotation, reporting long waits.
+      The worker's session is kept alive meanwhile.
+      """
+      self.rotation.arrive(account)
+      try:
+          while True:
+              ready, delay, changes = self.rotation.turn(account)
+              if ready:
+                  break
+              self.report_delay(delay)
+              await self.wait_for_change(await self.keep_alive(session, delay))
+      finally:
+          self.rotation.leave(account)
+          self.notify()
+      if delay:
+          # The jitter of the reserved slot
+          await asyncio.sleep(delay)
@@ -0,0 +1,511 @@
+"""
+Read the bounces in an exported mailbox and add the addresses that bounced to the suppression list.
+
+Usage:
+    python -m fastmail_core.bounces PATH [PATH ...] [--data-dir DIR] [--soft-limit N] [--processes N] [--dry-run]
+
+PATH is an mbox file, a Maildir folder, or a folder of .eml files. Delivery status
+notifications (RFC 3464) are read from their report; other bounce formats (qmail,
+Exim, Exchange, Gmail...) from their text. Messages already processed are skipped.
+"""
+# Import required modules
+import argparse
+import binascii
+import collections
+import hashlib
+import itertools
+import os
+import re
+import sys
+
+from fastmail_core.recipients import normalize_email
+from fastmail_core.settings import SETTINGS_DIR
+from fastmail_core.suppression import HARD_BOUNCE, SOFT_BOUNCE, SOFT_BOUNCE_LIMIT
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+# Bytes read from an mbox file at a time
+READ_CHUNK = 1024 * 1024
+
+# Bounce messages whose outcomes are written to the suppression store together
+BOUNCE_BATCH = 5000
+
+# Messages handed to a parsing process at a time
+PARSE_BATCH = 500
+
+# Bytes of a non-standard bounce searched for the failed addresses
+REPORT_SCAN_BYTES = 16 * 1024
+
+# Characters after a failed address searched for its SMTP reply
+DIAGNOSTIC_SPAN = 600
+
+# Longest diagnostic kept with a bounce
+DIAGNOSTIC_LENGTH = 300
+
+# The headers a bounce is recognized by (unfolded, first occurrence of each)
+HEADER_RE = re.compile(
+  r"^(content-type|content-transfer-encoding|x-failed-recipients|return-path|message-id|from|to|subject)[ \t]*:[ \t]*(.*)$",
+  re.I | re.M)
+
+BOUNDARY_RE = re.compile(r'boundary\s*=\s*"?([^";]+)"?', re.I)
+
+# Where the report of a delivery status notification is
+DELIVERY_STATUS_RE = re.compile(r"^content-type:[ \t]*message/(?:global-)?delivery-status", re.I | re.M)
+
+# A header field of a delivery status report
+FIELD_RE = re.compile(r"^([A-Za-z-]+)[ \t]*:[ \t]*(.*)$", re.M)
+
+# Senders and subjects of bounces that are not delivery status notifications.
+# The subject alone is a weak sign (people write it too): see parse_bounce.
+BOUNCE_SENDER_RE = re.compile(r"mailer-daemon|postmaster|mail delivery (?:subsystem|system)", re.I)
+BOUNCE_SUBJECT_RE = re.compile(
+  r"undeliver|undelivered|delivery status notification|delivery (?:has )?fail|failure notice|returned mail|"
+  r"mail delivery|could not be delivered|not delivered|non-?deliver|delivery problem",
+  re.I)
+
+# Subjects of replies and forwards, which are never bounces
+REPLY_SUBJECT_RE = re.compile(r"^\s*(?:re|fwd?|aw|wg|sv|tr)\s*:", re.I)
+
+# The empty envelope sender (null reverse-path) bounces are sent with
+NULL_RETURN_PATH_RE = re.compile(r"^<\s*>$")
+
+# Where the copy of the original message starts in a bounce: addresses past it are not failed recipients
+ORIGINAL_MESSAGE_RE = re.compile(
+  r"^(?:-+ ?(?:this is a copy of|below this line is a copy of|original message|forwarded message|"
+  r"undelivered message)|content-type:[ \t]*(?:message/rfc822|text/rfc822-headers)|return-path:|received:[ \t]*from)",
+  re.I | re.M)
+
+ADDRESS_RE = re.compile(
+  r"[A-Za-z0-9.!#$%&'*+/=?^_`{|}~\-\u0080-\u00ff]+@[A-Za-z0-9\u0080-\u00ff](?:[A-Za-z0-9\-\u0080-\u00ff]*"
+  r"[A-Za-z0-9\u0080-\u00ff])?(?:\.[A-Za-z0-9\u0080-\u00ff](?:[A-Za-z0-9\-\u0080-\u00ff]*[A-Za-z0-9\u0080-\u00ff])?)+")
+
+# Addresses of mail systems, never a failed recipient
+SYSTEM_ADDRESS_RE = re.compile(r"^(?:mailer-daemon|postmaster|double-bounce|noreply|no-reply)@", re.I)
+
+# SMTP replies in a diagnostic: an enhanced status code, or a basic reply code
+ENHANCED_STATUS_RE = re.compile(r"(?<![\d.])([245])\.(\d{1,3})\.(\d{1,3})(?![\d.])")
+REPLY_CODE_RE = re.compile(r"(?<![\d.])([45])\d\d(?=[ \-])")
+
+# Diagnostics that mean the address itself is dead, whatever the reply code (matched lowercased)
+HARD_BOUNCE_RE = re.compile(
+  r"user unknown|unknown user|no such (?:user|mailbox|recipient|address)|(?:does not|doesn't|not) exist|"
+  r"recipient (?:address )?rejected|address rejected|invalid (?:recipient|mailbox|address)|mailbox (?:not found|"
+  r"unavailable|disabled)|account (?:has been )?disabled|recipnotfound|unrouteable|couldn't be found|"
+  r"could not be found|no mailbox|not a valid")
+
+# Diagnostics of a temporary or policy failure, whatever the reply code (matched lowercased)
+SOFT_BOUNCE_RE = re.compile(
+  r"mailbox (?:is )?full|over quota|quota exceeded|exceeded (?:the |its )?(?:storage|quota)|insufficient storage|"
+  r"try again|temporar|greylist|rate limit|too many|spam|blocked|blacklist|blocklist|reputation|policy")
+
+# Enhanced status codes of a permanent failure that does not mean the address is dead:
+# mailbox full, message too big, and (5.7.x) policy or security refusals
+SOFT_STATUSES = ("5.2.2", "5.2.3", "5.3.4")
+SOFT_STATUS_CLASSES = ("5.7.",)
+
+# ------------------------------------------------------------------------
+# Reading Mailboxes
+# ------------------------------------------------------------------------
+
+def mbox_message(data):
+  """
+  A message of an mbox file, without its 'From ' separator line.
+  """
+  if data.startswith(b"From "):
+      data = data[data.find(b"\n") + 1:]
+  return data
+
+def read_mbox(path):
+  """
+  Yield the messages of an mbox file as bytes, one at a time, reading the
+  file in READ_CHUNK blocks: the mailbox is never loaded whole.
+  """
+  with open(path, "rb") as f:
+      pieces = []  # the message being read, when it spans blocks
+      carry = b""
+      for chunk in iter(lambda: f.read(READ_CHUNK), b""):
+          data = carry + chunk
+          position = 0
+          while True:
+              end = data.find(b"\nFrom ", position)
+              if end < 0:
+                  break
+              pieces.append(data[position:end + 1])
+              message = b"".join(pieces)
+              pieces = []
+              position = end + 1
+              if message.strip():
+                  yield mbox_message(message)
+          # A separator may start in the last bytes of the block
+          keep = max(position, len(data) - 5)
+          pieces.append(data[position:keep])
+          carry = data[keep:]
+      pieces.append(carry)
+      message = b"".join(pieces)
+      if message.strip():
+          yield mbox_message(message)
+
+def read_maildir(path):
+  """
+  Yield the messages of a Maildir folder (its cur and new folders), or of a
+  folder of message files such as exported .eml files, as bytes.
+  """
+  folders = [os.path.join(path, name) for name in ("cur", "new") if os.path.isdir(os.path.join(path, name))]
+  for folder in folders or [path]:
+      with os.scandir(folder) as entries:
+          names = sorted(entry.path for entry in entries if entry.is_file() and not entry.name.startswith("."))
+      for name in names:
+          with open(name, "rb") as f:
+              yield f.read()
+
+def read_messages(path):
+  """
+  Yield the messages of an mbox file, a Maildir folder or a folder of message files.
+  """
+  return read_maildir(path) if os.path.isdir(path) else read_mbox(path)
+
+# ------------------------------------------------------------------------
+# Parsing Bounces
+# ------------------------------------------------------------------------
+
+def bounce_status(diagnostic):
+  """
+  The enhanced status code ('5.1.1') of a diagnostic, or its basic reply
+  code class as one ('5.0.0'), or None if it has neither.
+  """
+  match = ENHANCED_STATUS_RE.search(diagnostic)
+  if match is not None:
+      return ".".join(match.groups())
+  match = REPLY_CODE_RE.search(diagnostic)
+  if match is not None:
+      return f"{match.group(1)}.0.0"
+  return None
+
+def classify_bounce(status, diagnostic=""):
+  """
+  HARD_BOUNCE if a failure means the address is dead, SOFT_BOUNCE if it may
+  work later (mailbox full, greylisting, a policy or spam refusal). The
+  diagnostic text decides first, then the status code's class; without
+  either a failure is taken as soft.
+  """
+  text = diagnostic.lower()
+  if HARD_BOUNCE_RE.search(text):
+      return HARD_BOUNCE
+  if SOFT_BOUNCE_RE.search(text):
+      return SOFT_BOUNCE
+  status = status or bounce_status(diagnostic)
+  if status is None or not status.startswith("5."):
+      return SOFT_BOUNCE
+  if status in SOFT_STATUSES or status.startswith(SOFT_STATUS_CLASSES):
+      return SOFT_BOUNCE
+  return HARD_BOUNCE
+
+def decode_part(data, encoding):
+  """
+  Undo a part's Content-Transfer-Encoding.
+  """
+  encoding = encoding.strip().lower()
+  try:
+      if encoding == "base64":
+          return binascii.a2b_base64(data)
+      if encoding == "quoted-printable":
+          return binascii.a2b_qp(data)
+  except binascii.Error:
+      pass
+  return data
+
+def split_headers(data):
+  """
+  Split a message or part into its unfolded headers and its body (text).
+  """
+  end = data.find("\n\n")
+  if end < 0:
+      return data, ""
+  return data[:end].replace("\n ", " ").replace("\n\t", " "), data[end + 2:]
+
+def header_fields(headers):
+  fields = {}
+  for name, value in HEADER_RE.findall(headers):
+      fields.setdefault(name.lower(), value.strip())
+  return fields
+
+def address_of(value):
+  """
+  The normalized address of a recipient field ('rfc822; <user@example.com>'), or None.
+  """
+  value = value.rpartition(";")[2].strip().strip("<>").strip()
+  try:
+      value = value.encode("latin-1").decode("utf-8")
+  except UnicodeError:
+      pass
+  return normalize_email(value) if value else None
+
+def parse_delivery_status(body, boundary):
+  """
+  The (email, kind, status, detail) bounces of a delivery status
+  notification's report (RFC 3464), or None if it has no report. Recipients
+  that were delivered, relayed or only delayed are left out.
+  """
+  match = DELIVERY_STATUS_RE.search(body)
+  if match is None:
+      return None
+  part_headers, report = split_headers(body[match.start():])
+  if boundary:
+      end = report.find("\n--" + boundary)
+      if end >= 0:
+          report = report[:end]
+  encoding = header_fields(part_headers).get("content-transfer-encoding")
+  if encoding:
+      report = decode_part(report.encode("latin-1"), encoding).decode("latin-1").replace("\r\n", "\n")
+
+  bounces = []
+  # The per-message fields come first, then one group of fields per recipient
+  for group in report.replace("\n ", " ").replace("\n\t", " ").split("\n\n"):
+      fields = {name.lower(): value.strip() for name, value in FIELD_RE.findall(group)}
+      recipient = fields.get("original-recipient") or fields.get("final-recipient")
+      if not recipient:
+          continue
+      if fields.get("action", "failed").lower() != "failed":
+          continue
+      email = address_of(recipient) or address_of(fields.get("final-recipient", ""))
+      if email is None:
+          continue
+      diagnostic = fields.get("diagnostic-code", "").partition(";")[2].strip() or fields.get("diagnostic-code", "")
+      status = ENHANCED_STATUS_RE.search(fields.get("status", ""))
+      status = ".".join(status.groups()) if status else bounce_status(diagnostic)
+      bounces.append((email, classify_bounce(status, diagnostic), status, diagnostic[:DIAGNOSTIC_LENGTH]))
+  return bounces
+
+def parse_bounce_text(body, fields):
+  """
+  The (email, kind, status, detail) bounces of a bounce that is not a
+  delivery status notification, read from its text: the addresses named
+  before the copy of the original message (and in X-Failed-Recipients),
+  each with the SMTP reply that follows it.
+  """
+  encoding = fields.get("content-transfer-encoding")
+  if encoding and "multipart" not in fields.get("content-type", "").lower():
+      body = decode_part(body.encode("latin-1"), encoding).decode("latin-1").replace("\r\n", "\n")
+  text = body[:REPORT_SCAN_BYTES]
+  match = ORIGINAL_MESSAGE_RE.search(text)
+  if match is not None:
+      text = text[:match.start()]
+
+  own = {address_of(fields.get(name, "")) for name in ("to", "from")}
+  candidates = [(match.start(), match.group()) for match in ADDRESS_RE.finditer(text)]
+  candidates += [(None, address) for address in ADDRESS_RE.findall(fields.get("x-failed-recipients", ""))]
+  bounces = {}
+  for position, address in candidates:
+      email = address_of(address.strip("."))
+      if email is None or email in own or email in bounces or SYSTEM_ADDRESS_RE.match(email):
+          continue
+      # The reply that follows the address, or else the first of the report
+      diagnostic = text[position:position + DIAGNOSTIC_SPAN] if position is not None else text
+      status = bounce_status(diagnostic) or bounce_status(text)
+      lines = [line.strip() for line in diagnostic.splitlines() if line.strip()]
+      detail = " ".join(lines)[:DIAGNOSTIC_LENGTH]
+      bounces[email] = (email, classify_bounce(status, diagnostic), status, detail)
+  return list(bounces.values())
+
+def message_digest(fields, data):
+  """
+  What identifies a bounce message when a mailbox is processed again: its
+  Message-ID (unchanged by exporting the mailbox again), or its bytes.
+  """
+  key = fields.get("message-id", "").strip().encode("latin-1") or data
+  return hashlib.blake2b(key, digest_size=16).digest()
+
+def parse_bounce(data):
+  """
+  Read one message. Returns (digest, bounces) for a bounce, where bounces are
+  (email, kind, status, detail) tuples (an empty list if no failed address
+  was found), or None if the message is not a bounce.
+  """
+  # Latin-1 maps every byte to one character: offsets are kept and nothing fails to decode
+  text = data.decode("latin-1")
+  if "\r\n" in text:
+      text = text.replace("\r\n", "\n")
+  headers, body = split_headers(text)
+  fields = header_fields(headers)
+  content_type = fields.get("content-type", "")
+  is_report = "report" in content_type.lower() and "delivery-status" in content_type.lower()
+  subject = fields.get("subject", "")
+  if REPLY_SUBJECT_RE.match(subject):
+      return None
+  # A bounce shows it in its structure: a report, the failed recipients header,
+  # a mail system sender or the null envelope sender
+  structural = (is_report or "x-failed-recipients" in fields or BOUNCE_SENDER_RE.search(fields.get("from", ""))
+                or NULL_RETURN_PATH_RE.match(fields.get("return-path", "")))
+  if not (structural or BOUNCE_SUBJECT_RE.search(subject)):
+      return None
+  boundary = BOUNDARY_RE.search(content_type)
+  bounces = parse_delivery_status(body, boundary.group(1) if boundary else None)
+  if bounces is None:
+      bounces = parse_bounce_text(body, fields)
+      if not structural:
+          # Only the subject looks like a bounce: count an address only with an SMTP
+          # reply next to it, and never suppress it at once
+          bounces = [(email, SOFT_BOUNCE, status, detail) for email, kind, status, detail in bounces
+                     if status is not None]
+  return message_digest(fields, data), bounces
+
+# ------------------------------------------------------------------------
+# Bounce Processing
+# ------------------------------------------------------------------------
+
+class BounceReport:
+  """
+  Counts of what a bounce processing pass read and did.
+  """
+
+  def __init__(self):
+      self.messages = 0
+      self.bounces = 0  # bounce messages
+      self.processed_before = 0
+      self.unreadable = 0  # bounces without a failed recipient found
+      self.hard = 0
+      self.soft = 0
+      self.suppressed = 0  # addresses added to the suppression list
+
+  def summary(self):
+      lines = [f"{self.messages} messages read, {self.bounces} bounces."]
+      if self.processed_before:
+          lines.append(f"  - {self.processed_before} processed before (skipped)")
+      if self.unreadable:
+          lines.append(f"  - {self.unreadable} without a failed recipient (delay warnings, unknown formats)")
+      lines.append(f"{self.hard} hard and {self.soft} soft bounces; "
+                   f"{self.suppressed} new addresses added to the suppression list.")
+      return "\n".join(lines)
+
+def parse_bounces(messages):
+  """
+  parse_bounce of each message of a batch; what a parsing process runs.
+  """
+  return [parse_bounce(data) for data in messages]
+
+def batches(items, size):
+  iterator = iter(items)
+  while True:
+      batch = list(itertools.islice(iterator, size))
+      if not batch:
+          return
+      yield batch
+
+class BounceProcessor:
+  """
+  Reads bounce messages in one streaming pass and records their failed
+  recipients in the suppression store in batches: a hard bounce suppresses
+  the address at once, soft bounces after `soft_limit` of them (see
+  SuppressionList.add_bounces). Without a store (`suppression` None), only counts.
+
+  With `processes`, messages are parsed in that many worker processes, a
+  batch of PARSE_BATCH at a time and at most two batches per process ahead
+  of the reading, so memory stays bounded however large the mailbox.
+  """
+
+  def __init__(self, suppression=None, soft_limit=SOFT_BOUNCE_LIMIT, processes=0):
+      self.suppression = suppression
+      self.soft_limit = soft_limit
+      self.processes = processes
+
+  def process(self, messages):
+      """
+      Process an iterable of messages (bytes) and return the BounceReport.
+      """
+      report = BounceReport()
+      batch = []
+      for parsed in self.parse(messages):
+          report.messages += len(parsed)
+          for bounce in parsed:
+              if bounce is None:
+                  continue
+              report.bounces += 1
+              if not bounce[1]:
+                  report.unreadable += 1
+              batch.append(bounce)
+          if len(batch) >= BOUNCE_BATCH:
+              self.record(batch, report)
+              batch = []
+      self.record(batch, report)
+      return report
+
+  def parse(self, messages):
+      """
+      Yield the parse_bounce results of the messages, a batch at a time, in order.
+      """
+      if not self.processes:
+          yield from map(parse_bounces, batches(messages, PARSE_BATCH))
+          return
+      # Imported here: only needed when parsing in processes
+      from concurrent.futures import ProcessPoolExecutor
+
+      with ProcessPoolExecutor(self.processes) as executor:
+          pending = collections.deque()
+          for batch in batches(messages, PARSE_BATCH):
+              pending.append(executor.submit(parse_bounces, batch))
+              if len(pending) >= 2 * self.processes:
+                  yield pending.popleft().result()
+          while pending:
+              yield pending.popleft().result()
+
+  def record(self, batch, report):
+      if not batch:
+          return
+      recorded, added = batch, 0
+      if self.suppression is not None:
+          recorded, added = self.suppression.add_bounces(batch, self.soft_limit)
+      # Bounces of messages processed before are not counted again
+      report.processed_before += len(batch) - len(recorded)
+      report.suppressed += added
+      for digest, bounces in recorded:
+          for email, kind, status, detail in bounces:
+              if kind == HARD_BOUNCE:
+                  report.hard += 1
+              else:
+                  report.soft += 1
+
+def process_bounces(paths, suppression=None, soft_limit=SOFT_BOUNCE_LIMIT, processes=0):
+  """
+  Process the bounces of mbox files and Maildir folders into the suppression
+  store and return the BounceReport.
+  """
+  def messages():
+      for path in paths:
+          yield from read_messages(path)
+
+  return BounceProcessor(suppression, soft_limit, processes).process(messages())
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog="python -m fastmail_core.bounces", description=__doc__.strip().splitlines()[0])
+  parser.add_argument("paths", nargs="+", metavar="PATH", help="mbox file, Maildir folder or folder of .eml files")
+  parser.add_argument("--data-dir", default=SETTINGS_DIR, help="directory of the suppression list")
+  parser.add_argument("--soft-limit", type=int, default=SOFT_BOUNCE_LIMIT,
+                      help="soft bounces after which an address is suppressed")
+  parser.add_argument("--processes", type=int, default=0, metavar="N",
+                      help="parse the messages in N worker processes (for very large mailboxes)")
+  parser.add_argument("--dry-run", action="store_true", help="only count the bounces, change nothing")
+  args = parser.parse_args(argv)
+
+  from fastmail_core.suppression import SuppressionList
+
+  suppression = None
+  try:
+      if not args.dry_run:
+          os.makedirs(args.data_dir, exist_ok=True)
+          suppression = SuppressionList(os.path.join(args.data_dir, "suppression.sqlite3"))
+      report = process_bounces(args.paths, suppression, args.soft_limit, args.processes)
+  except KeyboardInterrupt:
+      return 130
+  except Exception as e:
+      print(f"error: {e}", file=sys.stderr)
+      return 1
+  finally:
+      if suppression is not None:
+          suppression.close()
+  print(report.summary())
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,181 @@
+# Import required modules
+import os
+import random
+import sqlite3
+import time
+
+from fastmail_core.dkim import DKIMSigner, SigningPool
+from fastmail_core.domains import parse_domain_limits
+from fastmail_core.message import Attachment, CampaignMessage
+from fastmail_core.metrics import DeliveryMetrics, MetricsServer
+from fastmail_core.partcache import AttachmentCache
+from fastmail_core.pool import SMTPPool
+from fastmail_core.senders import SenderAccount
+from fastmail_core.settings import ATTACHMENT_CACHE_DIR, METRICS_DIR
+from fastmail_core.template import check_fields
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+# List of randomized closing phrases
+CLOSING_PHRASES = [
+  "Cordialement,",
+  "Sincèrement,",
+  "Salutations,",
+  "Merci,",
+  "Chaleureusement,",
+  "Bien à vous,",
+  "Tous mes vœux,",
+  "Amitiés,",
+  "Respectueusement,"
+]
+
+# ------------------------------------------------------------------------
+# Email Sending
+# ------------------------------------------------------------------------
+
+def closing_footer(sender_email, i):
+  """
+  Footer appended to the body of the i-th email: a random closing phrase,
+  the sender and a unique identifier (the email index).
+  """
+  closing_phrase = random.choice(CLOSING_PHRASES)
+  unique_id = f" [{i+1}]"
+  return f"<br><br>{closing_phrase}<br>{sender_email}{unique_id}"
+
+def metrics_summary_path(metrics_dir, journal=None):
+  """
+  Path of the JSON metrics summary of a campaign run: start time and campaign id.
+  """
+  campaign_id = journal.campaign_id if journal is not None else "campaign"
+  return os.path.join(metrics_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{campaign_id}.json")
+
+def campaign_attachments(attachment_paths, cache_dir, metrics=None):
+  """
+  The Attachments of a campaign, streamed from their encoded parts in the
+  attachment cache at `cache_dir`, or encoded while they are sent if it is
+  None or cannot be opened. Cache hits and misses are counted in the metrics.
+  """
+  if not attachment_paths or not cache_dir:
+      return [Attachment(path) for path in attachment_paths]
+  try:
+      cache = AttachmentCache(cache_dir)
+  except (OSError, sqlite3.Error):
+      return [Attachment(path) for path in attachment_paths]
+  try:
+      attachments = [cache.attachment(path) for path in attachment_paths]
+  finally:
+      cache.close()
+  if metrics is not None:
+      metrics.attachment_cache_lookups(cache.hits, cache.misses)
+  return attachments
+
+def send_bulk_emails(subject, email_body, attachment_paths, to_list, settings, progress_queue, journal=None,
+                     metrics_dir=METRICS_DIR, dkim_processes=0, attachment_cache_dir=ATTACHMENT_CACHE_DIR):
+  """
+  Send bulk emails to the list of recipients from the sender accounts of the settings,
+  with the files of `attachment_paths` attached. Attachments are encoded once into
+  the attachment cache at `attachment_cache_dir` (None for none), where later
+  campaigns find them, and streamed from disk as they are sent.
+  Recipients are shared between the SMTP sessions of every account, run either
+  on threads or on an asyncio event loop, and spread across the accounts by
+  weight within each account's rate limits.
+  The subject and body may use merge fields, {{ column }} or {{ column | default }},
+  filled in from the columns of each recipient's row (see MergeTemplate).
+  Messages of accounts with a DKIM key are signed, in `dkim_processes` worker
+  processes if above 0 (the main module must be safe to import).
+  Every outcome is recorded in the send journal, and recipients the journal
+  already has a final outcome for are skipped. The journal is closed when done.
+  Progress is reported through `progress_queue` (anything with a put() method).
+  Delivery metrics are served on localhost while sending if a metrics port is set,
+  and a JSON summary is written to `metrics_dir` (unless None) when the campaign ends.
+  An error that stops the campaign is put on the progress queue before it is raised,
+  so a GUI running this on a thread hears about it.
+  """
+  metrics = DeliveryMetrics()
+  metrics_server = None
+  summary_path = metrics_summary_path(metrics_dir, journal) if metrics_dir else None
+  try:
+      if settings.get("metrics_port"):
+          metrics_server = MetricsServer(metrics, int(settings["metrics_port"])).start()
+      run_campaign(subject, email_body, attachment_paths, to_list, settings, progress_queue, journal, metrics,
+                   dkim_processes, attachment_cache_dir)
+  except Exception as e:
+      progress_queue.put({'status': 'error', 'error': str(e) or type(e).__name__})
+      raise
+  finally:
+      if metrics_server is not None:
+          metrics_server.stop()
+      if journal is not None:
+          journal.close()
+      if summary_path:
+          metrics.write_summary(summary_path, subject=subject, delivery_engine=settings["delivery_engine"])
+
+def run_campaign(subject, email_body, attachment_paths, to_list, settings, progress_queue, journal, metrics=None,
+                 dkim_processes=0, attachment_cache_dir=None):
+  """
+  Body of send_bulk_emails, run while the journal is open.
+  """
+  # One rate scheduler per sender account, shared by the SMTP sessions of that account
+  accounts = [SenderAccount.from_profile(profile) for profile in settings["senders"]]
+  if not accounts:
+      raise ValueError("No sender account is set up.")
+
+  # Per-provider concurrency and rate limits; the groups are interleaved
+  domain_limits = parse_domain_limits(settings["domain_limits"])
+
+  # Attachments are encoded at most once, shared by the messages of every account
+  attachments = campaign_attachments(attachment_paths, attachment_cache_dir, metrics)
+
+  # DKIM keys are parsed once per campaign
+  signers = {profile["sender_email"]: DKIMSigner.from_profile(profile) for profile in settings["senders"]}
+  signing_pool = None
+  if dkim_processes > 0 and any(signers.values()):
+      signing_pool = SigningPool([signer for signer in signers.values() if signer], dkim_processes)
+  try:
+      send_campaign(subject, email_body, attachments, to_list, settings, progress_queue, journal, metrics,
+                    accounts, domain_limits, signers, signing_pool is not None)
+  finally:
+      if signing_pool is not None:
+          signing_pool.close()
+
+def send_campaign(subject, email_body, attachments, to_list, settings, progress_queue, journal, metrics,
+                  accounts, domain_limits, signers, offload_render=False):
+  """
+  Build the messages and run the delivery engine, once the accounts are set up.
+  """
+  # Build the body and attachment headers once per sender account (the From header differs)
+  messages = {
+      account.sender_email: CampaignMessage(subject, email_body, account.sender_email, attachments,
+                                            signers[account.sender_email])
+      for account in accounts
+  }
+  # Every merge field must be filled in before anything is sent
+  message = messages[accounts[0].sender_email]
+  check_fields((message.subject, message.body), getattr(to_list, "fields", ()))
+
+  def render(i, email, account):
+      return messages[account.sender_email].render(email, closing_footer(account.sender_email, i),
+                                                   getattr(email, "fields", None))
+
+  # Skip recipients already handled by a previous run of this campaign.
+  # to_list may be a RecipientFile: it is streamed, never held in memory.
+  completed = journal.completed() if journal is not None else set()
+  recipients = ((i, email) for i, email in enumerate(to_list) if email not in completed)
+
+  # Send total emails count to the queue
+  progress_queue.put({'total_emails': sum(1 for email in to_list if email not in completed)})
+
+  if settings["delivery_engine"] == "asyncio":
+      # Imported on demand: asyncio and ssl are the slowest imports of the package
+      from fastmail_core.aiosmtp import AsyncSMTPEngine
+      # Rendering waits on the signing processes: keep it off the event loop
+      engine = AsyncSMTPEngine(accounts, progress_queue, journal, domain_limits, metrics,
+                               offload_render=offload_render)
+  else:
+      engine = SMTPPool(accounts, progress_queue, journal, domain_limits, metrics)
+  engine.run(recipients, render)
+
+  # Indicate that sending is done
+  progress_queue.put({'status': 'done'})
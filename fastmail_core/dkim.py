@@ -0,0 +1,278 @@
+# Import required modules
+import base64
+import hashlib
+import re
+
+# The cryptography package is only imported when a DKIM key is loaded
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+# Headers signed when the message has them, in this order
+SIGNED_HEADERS = ("from", "to", "subject", "date", "message-id", "reply-to", "mime-version", "content-type")
+
+CRLF = b"\r\n"
+WSP = re.compile(rb"[ \t]+")
+
+# ------------------------------------------------------------------------
+# Keys
+# ------------------------------------------------------------------------
+
+def load_private_key(pem):
+  """
+  Parse a PEM private key (RSA or Ed25519) and return (key, DKIM algorithm).
+  Raises ValueError with a readable message if it cannot be used.
+  """
+  try:
+      from cryptography.hazmat.primitives import serialization
+      from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+  except ImportError:
+      raise ValueError("DKIM signing needs the 'cryptography' package (pip install cryptography).")
+  try:
+      key = serialization.load_pem_private_key(pem, password=None)
+  except (ValueError, TypeError) as e:
+      raise ValueError(f"The DKIM key cannot be read: {e}")
+  if isinstance(key, rsa.RSAPrivateKey):
+      if key.key_size < 1024:
+          raise ValueError("The DKIM RSA key must have at least 1024 bits.")
+      return key, "rsa-sha256"
+  if isinstance(key, ed25519.Ed25519PrivateKey):
+      return key, "ed25519-sha256"
+  raise ValueError("The DKIM key must be an RSA or Ed25519 private key.")
+
+def key_signature(key, algorithm, data):
+  """
+  Sign the canonicalized header data with a key from load_private_key.
+  """
+  if algorithm == "ed25519-sha256":
+      # RFC 8463: Ed25519 signs the SHA-256 hash of the data
+      return key.sign(hashlib.sha256(data).digest())
+  from cryptography.hazmat.primitives import hashes
+  from cryptography.hazmat.primitives.asymmetric import padding
+  return key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+
+# ------------------------------------------------------------------------
+# Relaxed Canonicalization (RFC 6376, section 3.4)
+# ------------------------------------------------------------------------
+
+def relaxed_header(name, value):
+  """
+  Canonicalize one header field: lowercase name, unfolded value with runs of
+  whitespace reduced to one space and none at either end.
+  """
+  value = WSP.sub(b" ", value.replace(CRLF, b"")).strip(b" ")
+  return name.strip().lower() + b":" + value + CRLF
+
+def relaxed_lines(data):
+  """
+  Canonicalize body lines: runs of whitespace reduced to one space and none at
+  the end of a line. `data` must end at a line end (or be empty); empty lines
+  at the end are kept, see relaxed_body.
+  """
+  if not data:
+      return b""
+  lines = data.split(CRLF)
+  lines.pop()  # the empty piece after the last CRLF
+  return b"".join(WSP.sub(b" ", line).rstrip(b" ") + CRLF for line in lines)
+
+def relaxed_body(data):
+  """
+  Canonicalize a whole body: relaxed_lines without the empty lines at the end.
+  """
+  if data and not data.endswith(CRLF):
+      data += CRLF
+  canonical = relaxed_lines(data)
+  while canonical.endswith(CRLF + CRLF):
+      canonical = canonical[:-2]
+  return b"" if canonical == CRLF else canonical
+
+def split_message(message):
+  """
+  Split a message into its list of (name, value) headers (values keep their
+  folding and line end) and its body.
+  """
+  header_block, separator, body = message.partition(CRLF + CRLF)
+  headers = []
+  for line in (header_block + CRLF).split(CRLF)[:-1]:
+      if line[:1] in (b" ", b"\t") and headers:
+          name, value = headers[-1]
+          headers[-1] = (name, value + CRLF + line)
+      else:
+          name, _, value = line.partition(b":")
+          headers.append((name, value))
+  return headers, body
+
+# ------------------------------------------------------------------------
+# Signer
+# ------------------------------------------------------------------------
+
+class DKIMSigner:
+  """
+  Signs the messages of one sending domain with DKIM, relaxed/relaxed
+  canonicalization. The private key is parsed once, when the signer is made.
+  `signing_pool` (a SigningPool) computes the signatures in other processes.
+  """
+
+  def __init__(self, domain, selector, private_key_pem):
+      self.domain = domain
+      self.selector = selector
+      self.private_key_pem = private_key_pem
+      self.key, self.algorithm = load_private_key(private_key_pem)
+      self.signing_pool = None
+      self.pool_index = None
+
+  @classmethod
+  def from_profile(cls, profile):
+      """
+      The signer of a sender profile with a DKIM selector and key file, or None.
+      The domain is the one of the sender address.
+      """
+      selector = profile.get("dkim_selector", "").strip()
+      key_file = profile.get("dkim_key_file", "").strip()
+      if not selector and not key_file:
+          return None
+      if not selector or not key_file:
+          raise ValueError("DKIM needs both a selector and a key file.")
+      try:
+          with open(key_file, "rb") as f:
+              pem = f.read()
+      except OSError as e:
+          raise ValueError(f"The DKIM key file cannot be read: {e.strerror or e}")
+      return cls(profile["sender_email"].rpartition("@")[2].strip().lower(), selector, pem)
+
+  def signature(self, data):
+      if self.signing_pool is not None:
+          return self.signing_pool.signature(self.pool_index, data)
+      return key_signature(self.key, self.algorithm, data)
+
+  def signature_header(self, header_names, canonical_headers, body_hash):
+      """
+      Return the DKIM-Signature header line (CRLF-terminated) for the canonicalized
+      signed headers, named in `header_names`, and the body hash.
+      """
+      tags = (f"v=1; a={self.algorithm}; c=relaxed/relaxed; d={self.domain}; s={self.selector};\r\n"
+              f"\th={':'.join(header_names)};\r\n"
+              f"\tbh={base64.b64encode(body_hash).decode('ascii')};\r\n"
+              f"\tb=").encode("ascii")
+      # The header itself is signed with an empty b= and without its line end
+      signed = canonical_headers + relaxed_header(b"dkim-signature", tags)[:-2]
+      return b"DKIM-Signature: " + tags + base64.b64encode(self.signature(signed)) + CRLF
+
+  def sign_message(self, message):
+      """
+      Return the DKIM-Signature header line for any CRLF message.
+      """
+      headers, body = split_message(message)
+      latest = {name.strip().lower(): value for name, value in headers}
+      names = [name for name in SIGNED_HEADERS if name.encode("ascii") in latest]
+      canonical = b"".join(relaxed_header(name.encode("ascii"), latest[name.encode("ascii")]) for name in names)
+      return self.signature_header(names, canonical, hashlib.sha256(relaxed_body(body)).digest())
+
+class CampaignSignature:
+  """
+  DKIM signing of the messages of one CampaignMessage. The signed headers that
+  are the same in every message are canonicalized once, and the body hash of
+  the shared start of the body is computed once and copied for each message,
+  so a message only costs canonicalizing and hashing its own headers (To, a
+  merged Subject) and the body from its first merge field or footer on, plus
+  the signature itself.
+  """
+
+  def __init__(self, signer, header_block, varying, body_prefix, body_suffix):
+      """
+      `header_block` holds the template message's header lines, those named in
+      `varying` (lowercase) with placeholder values. Each message's body is
+      `body_prefix` + its own part + the pieces of `body_suffix`: bytes, and
+      attachment streams (iterables of base64 lines, already canonical) that
+      are hashed chunk by chunk.
+      """
+      self.signer = signer
+
+      headers, _ = split_message(header_block + CRLF)
+      latest = {name.strip().lower(): value for name, value in headers}
+      self.header_names = [name for name in SIGNED_HEADERS if name in varying or name.encode("ascii") in latest]
+      # Canonical bytes of each signed header, or the name of a varying one
+      self.header_parts = [name if name in varying else relaxed_header(name.encode("ascii"), latest[name.encode("ascii")])
+                           for name in self.header_names]
+
+      # Body: shared prefix | own part | shared suffix. Both shared parts are cut
+      # at line ends; the partial lines next to the own part are canonicalized with it.
+      cut = body_prefix.rfind(CRLF) + 2 if CRLF in body_prefix else 0
+      self.prefix_rest = body_prefix[cut:]
+      self.prefix_hash = hashlib.sha256(relaxed_lines(body_prefix[:cut]))
+      first = body_suffix[0]
+      cut = first.find(CRLF) + 2 if CRLF in first else len(first)
+      self.suffix_start = first[:cut]
+      # The bytes pieces between attachments end at line ends. Empty lines at the
+      # end of the body are dropped; if the suffix has nothing else, the own
+      # part's lines are at the end of the body.
+      rest = [first[cut:]] + list(body_suffix[1:])
+      self.suffix = [relaxed_lines(part) if isinstance(part, bytes) else part for part in rest[:-1]]
+      self.suffix.append(relaxed_body(rest[-1]))
+
+  def body_hash(self, body):
+      body_hash = self.prefix_hash.copy()
+      middle = self.prefix_rest + body + self.suffix_start
+      if any(self.suffix):
+          body_hash.update(relaxed_lines(middle))
+          for part in self.suffix:
+              if isinstance(part, bytes):
+                  body_hash.update(part)
+              else:
+                  for chunk in part:
+                      body_hash.update(chunk)
+      else:
+          body_hash.update(relaxed_body(middle))
+      return body_hash.digest()
+
+  def sign(self, header_lines, body):
+      """
+      Return the DKIM-Signature header line of one message: `header_lines` maps
+      the varying header names to the message's header lines, `body` is its own
+      part of the body.
+      """
+      canonical = []
+      for part in self.header_parts:
+          if isinstance(part, str):
+              name, _, value = header_lines[part][:-2].partition(b":")
+              part = relaxed_header(name, value)
+          canonical.append(part)
+      return self.signer.signature_header(self.header_names, b"".join(canonical), self.body_hash(body))
+
+# ------------------------------------------------------------------------
+# Signing Processes
+# ------------------------------------------------------------------------
+
+# Keys parsed by a signing process when it starts, indexed like SigningPool.signers
+worker_keys = []
+
+def load_worker_keys(pems):
+  worker_keys[:] = [load_private_key(pem) for pem in pems]
+
+def worker_signature(index, data):
+  key, algorithm = worker_keys[index]
+  return key_signature(key, algorithm, data)
+
+class SigningPool:
+  """
+  Worker processes computing the DKIM signatures of a campaign's signers, for
+  when signing is what limits the sending rate. Each process parses the keys
+  once, when it starts. Only the signature runs there: canonicalization and
+  hashing stay with the caller, so a message sends a few hundred bytes over.
+  The main module must be safe to import (guarded by `if __name__ == "__main__"`).
+  """
+
+  def __init__(self, signers, processes):
+      from concurrent.futures import ProcessPoolExecutor
+
+      self.executor = ProcessPoolExecutor(processes, initializer=load_worker_keys,
+                                          initargs=([signer.private_key_pem for signer in signers],))
+      for index, signer in enumerate(signers):
+          signer.signing_pool, signer.pool_index = self, index
+
+  def signature(self, index, data):
+      return self.executor.submit(worker_signature, index, data).result()
+
+  def close(self):
+      self.executor.shutdown()
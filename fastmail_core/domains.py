@@ -0,0 +1,282 @@
+# Import required modules
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+from fastmail_core.ratelimit import TokenBucket
+from fastmail_core.retry import MAX_DELIVERY_ATTEMPTS
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+# Domains of the big providers, grouped so their limits apply to the provider as a whole
+PROVIDER_DOMAINS = {
+  "gmail": ("gmail.com", "googlemail.com"),
+  "outlook": ("outlook.com", "hotmail.com", "live.com", "msn.com", "outlook.fr", "hotmail.fr", "live.fr"),
+  "yahoo": ("yahoo.com", "yahoo.fr", "ymail.com", "rocketmail.com"),
+  "orange": ("orange.fr", "wanadoo.fr"),
+}
+
+# Group for every domain without its own limits
+OTHER_GROUP = "other"
+
+# Default per-group limits: concurrency / emails per minute (0 means no limit)
+DEFAULT_DOMAIN_LIMITS = "gmail=2/60, outlook=2/60, yahoo=2/60, other=0/0"
+
+# Recipients read ahead of the senders so groups can be interleaved
+DISPATCH_WINDOW = 50000
+
+# Pause applied to a group after a throttling (4xx) reply, doubled on each new one
+THROTTLE_COOLDOWN = 30
+THROTTLE_COOLDOWN_MAX = 600
+
+# take() results
+TAKE_ITEM = "item"
+TAKE_WAIT = "wait"
+TAKE_DONE = "done"
+
+# ------------------------------------------------------------------------
+# Domain Limits
+# ------------------------------------------------------------------------
+
+def parse_domain_limits(text):
+  """
+  Parse the 'domain_limits' setting, e.g. "gmail=2/60, example.com=1/10, other=4/0".
+  Names are provider groups from PROVIDER_DOMAINS, 'other', or a literal domain.
+  Returns {group: (concurrency, per_minute)}; 0 means no limit.
+  Raises ValueError with a readable message if the text is invalid.
+  """
+  limits = {}
+  for entry in (text or "").replace(";", ",").split(","):
+      entry = entry.strip()
+      if not entry:
+          continue
+      name, equals, values = entry.partition("=")
+      concurrency, slash, per_minute = values.partition("/")
+      name = name.strip().lower()
+      try:
+          if not name or not equals:
+              raise ValueError
+          limits[name] = (int(concurrency), int(per_minute or 0))
+      except ValueError:
+          raise ValueError(f"'{entry}' should look like name=concurrency/per_minute.")
+      if min(limits[name]) < 0:
+          raise ValueError(f"'{entry}' cannot have negative limits.")
+  return limits
+
+def share_domain_limits(limits, shares):
+  """
+  Split domain limits between `shares` delivery worker processes: each gets an
+  equal part of every per-minute rate, and of every concurrency limit (at least
+  one session per group, so a limit below the number of workers is exceeded).
+  """
+  if shares <= 1:
+      return limits
+  return {
+      name: (max(1, concurrency // shares) if concurrency else 0, per_minute / shares)
+      for name, (concurrency, per_minute) in limits.items()
+  }
+
+def domain_group_map(limits):
+  """
+  Map each domain with its own limits to its group name.
+  """
+  groups = {}
+  for name in limits:
+      if name in PROVIDER_DOMAINS:
+          for domain in PROVIDER_DOMAINS[name]:
+              groups[domain] = name
+      elif name != OTHER_GROUP:
+          groups[name] = name
+  return groups
+
+# ------------------------------------------------------------------------
+# Domain Dispatcher
+# ------------------------------------------------------------------------
+
+class DomainGroup:
+  """
+  Pending recipients and limits of one domain group.
+  """
+
+  def __init__(self, name, concurrency, per_minute, now):
+      self.name = name
+      self.pending = collections.deque()
+      self.active = 0
+      self.concurrency = concurrency
+      # Sends are spread evenly over the minute rather than allowed in one burst
+      self.bucket = TokenBucket(1, 60 / per_minute, now) if per_minute else None
+      self.cooldown = 0
+      self.cooldown_until = 0.0
+
+  def ready_at(self, now):
+      """
+      Earliest time this group may start another send, or None if it is at its concurrency limit.
+      """
+      if self.concurrency and self.active >= self.concurrency:
+          return None
+      ready = max(now, self.cooldown_until)
+      if self.bucket is not None:
+          ready = max(ready, self.bucket.available_at(now))
+      return ready
+
+class DomainDispatcher:
+  """
+  Buckets recipients by domain group and hands them out to the senders.
+  Groups are served round-robin, each within its own concurrency and rate
+  limits, so one slow or throttling provider does not hold up the others.
+  Recipients to send again wait in a delayed retry queue until they are due.
+  The source is read lazily, at most DISPATCH_WINDOW recipients ahead.
+  Thread-safe; the clock can be swapped out for testing.
+  """
+
+  def __init__(self, recipients, limits=None, window=DISPATCH_WINDOW, clock=time.monotonic):
+      self.source = iter(recipients)
+      self.limits = limits or {}
+      self.group_of = domain_group_map(self.limits)
+      self.window = window
+      self.clock = clock
+
+      self.groups = {}
+      self.order = []
+      self.retries = []  # heap of (due, sequence, index, email, attempt, group name)
+      self.sequence = itertools.count()
+      self.next_group = 0
+      self.buffered = 0
+      self.active = 0
+      self.exhausted = False
+      self.closed = False
+      self.changes = 0  # counts the changes a blocked sender waits for (see wait)
+      self.condition = threading.Condition()
+
+  def group_for(self, email):
+      name = self.group_of.get(email.rpartition("@")[2].lower(), OTHER_GROUP)
+      group = self.groups.get(name)
+      if group is None:
+          concurrency, per_minute = self.limits.get(name, self.limits.get(OTHER_GROUP, (0, 0)))
+          group = self.groups[name] = DomainGroup(name, concurrency, per_minute, self.clock())
+          self.order.append(group)
+      return group
+
+  def fill(self):
+      # Caller holds self.condition
+      while not self.exhausted and self.buffered < self.window:
+          try:
+              i, email = next(self.source)
+          except StopIteration:
+              self.exhausted = True
+              break
+          self.group_for(email).pending.append((i, email, 1))
+          self.buffered += 1
+
+  def release_retries(self, now):
+      # Caller holds self.condition. Due retries go ahead of their group's queue.
+      while self.retries and self.retries[0][0] <= now:
+          due, sequence, i, email, attempt, group_name = heapq.heappop(self.retries)
+          self.groups[group_name].pending.appendleft((i, email, attempt))
+
+  def take(self):
+      """
+      Return (TAKE_ITEM, (index, email, attempt, group)) for the next recipient to send,
+      (TAKE_WAIT, seconds or None) if every group with pending recipients is blocked,
+      or (TAKE_DONE, None) once every recipient has been handed out and finished,
+      followed by the change count to pass to wait().
+      """
+      with self.condition:
+          if self.closed:
+              return TAKE_DONE, None, self.changes
+          self.fill()
+          now = self.clock()
+          self.release_retries(now)
+          wait = self.retries[0][0] - now if self.retries else None
+          count = len(self.order)
+          for step in range(count):
+              group = self.order[(self.next_group + step) % count]
+              if not group.pending:
+                  continue
+              ready = group.ready_at(now)
+              if ready is None:
+                  continue
+              if ready > now:
+                  wait = ready - now if wait is None else min(wait, ready - now)
+                  continue
+              # Serve this group and move the round-robin past it
+              i, email, attempt = group.pending.popleft()
+              if group.bucket is not None:
+                  group.bucket.consume(now)
+              group.active += 1
+              self.active += 1
+              self.buffered -= 1
+              self.next_group = (self.next_group + step + 1) % count
+              return TAKE_ITEM, (i, email, attempt, group.name), self.changes
+
+          if self.exhausted and not self.buffered and not self.active:
+              return TAKE_DONE, None, self.changes
+          return TAKE_WAIT, wait, self.changes
+
+  def finish(self, group_name):
+      """
+      Mark one send of the group as finished.
+      """
+      with self.condition:
+          group = self.groups[group_name]
+          group.active -= 1
+          self.active -= 1
+          self.changed()
+
+  def retry(self, item, delay=0.0, pause_group=False):
+      """
+      Put a recipient taken with take() back to be sent again in `delay` seconds,
+      ahead of the rest of its group. With `pause_group` (a throttling reply the
+      recipient's provider is to blame for) the group is paused too.
+      Returns False (and does not requeue) once the recipient used all its attempts.
+      """
+      i, email, attempt, group_name = item
+      with self.condition:
+          group = self.groups[group_name]
+          now = self.clock()
+          if pause_group:
+              group.cooldown = min(THROTTLE_COOLDOWN_MAX, group.cooldown * 2 or THROTTLE_COOLDOWN)
+              group.cooldown_until = now + group.cooldown
+          if attempt >= MAX_DELIVERY_ATTEMPTS:
+              return False
+          if delay > 0:
+              heapq.heappush(self.retries, (now + delay, next(self.sequence), i, email, attempt + 1, group_name))
+          else:
+              group.pending.appendleft((i, email, attempt + 1))
+          self.buffered += 1
+          self.changed()
+          return True
+
+  def succeeded(self, group_name):
+      """
+      Record a successful send: the group's throttling back-off starts over.
+      """
+      with self.condition:
+          self.groups[group_name].cooldown = 0
+
+  def changed(self):
+      # Caller holds self.condition
+      self.changes += 1
+      self.condition.notify_all()
+
+  def wait(self, timeout, changes=None):
+      """
+      Block until another send finishes or `timeout` seconds pass (None: no timeout).
+      Given the change count take() returned, it returns at once if a send
+      finished or a recipient was put back since, so that wake-up is not missed.
+      """
+      with self.condition:
+          if not self.closed and (changes is None or changes == self.changes):
+              self.condition.wait(timeout)
+
+  def close(self):
+      """
+      Stop handing out recipients and wake every waiting sender.
+      """
+      with self.condition:
+          self.closed = True
+          self.changed()
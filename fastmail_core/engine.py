@@ -0,0 +1,211 @@
+# Import required modules
+import collections
+import smtplib
+import threading
+
+from fastmail_core.domains import DISPATCH_WINDOW, DomainDispatcher
+from fastmail_core.esmtp import KEEPALIVE_INTERVAL, MAX_IDLE_SESSION, RECENT_REFUSALS, TLSSessionCache, reply_code
+from fastmail_core.metrics import DeliveryMetrics
+from fastmail_core.retry import (CONNECTION, MAX_RECONNECT_ATTEMPTS, PERMANENT, RECONNECT_BACKOFF,
+                                 RECONNECT_BACKOFF_MAX, TRANSIENT, backoff_delay, classify_error, failure_reply)
+from fastmail_core.senders import SenderRotation
+
+# ------------------------------------------------------------------------
+# Delivery Engine Base
+# ------------------------------------------------------------------------
+
+class DeliveryEngine:
+  """
+  What the delivery engines (SMTPPool on threads, AsyncSMTPEngine on asyncio)
+  have in common, apart from their I/O and the way they wait: the sender
+  rotation and domain dispatcher, the counts and progress reports, the
+  journal records and what to do with a failed send or session.
+
+  Each sender account gets as many sessions as it has connections. Sessions
+  pull recipients from a shared DomainDispatcher (which interleaves domain
+  groups within their own limits), take their send slots from the
+  SenderRotation (each account's rate limits, weight and throttling pauses)
+  and report the aggregate number of emails sent through the progress queue.
+  Stage latencies, reply codes and session counts are recorded in `metrics`.
+  """
+
+  def __init__(self, accounts, progress_queue, journal=None, domain_limits=None, metrics=None,
+               dispatch_window=DISPATCH_WINDOW):
+      self.rotation = SenderRotation(accounts)
+      self.size = sum(account.connections for account in self.rotation)
+      self.progress_queue = progress_queue
+      self.journal = journal
+      self.domain_limits = domain_limits
+      self.dispatch_window = dispatch_window
+      self.metrics = metrics if metrics is not None else DeliveryMetrics()
+      self.metrics.pool_size = self.size
+      # One TLS context per account, so its sessions can resume each other's TLS session
+      for account in self.rotation:
+          if account.use_starttls and account.tls_context is None:
+              account.tls_context = TLSSessionCache.create()
+
+      self.dispatcher = None
+      self.emails_sent = 0
+      self.in_flight = 0
+      self.emails_failed = 0
+      self.failed = collections.deque(maxlen=RECENT_REFUSALS)  # (email, reply) of the latest refusals
+      self.lock = threading.Lock()
+
+  def start(self, recipients):
+      """
+      Set up the dispatcher for a run and return the account of each session to start.
+      """
+      self.dispatcher = DomainDispatcher(recipients, self.domain_limits, self.dispatch_window)
+      return [account for account in self.rotation for _ in range(account.connections)]
+
+  # --------------------------------------------------------------------
+  # Waiting
+  # --------------------------------------------------------------------
+
+  def report_delay(self, wait):
+      """
+      Tell the progress queue about a wait of a second or more.
+      """
+      if wait is not None and wait >= 1:
+          self.progress_queue.put({'send_delay': wait})
+
+  def idle_plan(self, session, wait):
+      """
+      What a worker's session needs before the worker waits `wait` seconds
+      (None: until woken): "close" for a wait longer than MAX_IDLE_SESSION (it
+      is opened again when needed), "noop" once idle for KEEPALIVE_INTERVAL,
+      or None. The engine does it in its keep_alive().
+      """
+      if session is None or session.connection is None:
+          return None
+      if wait is not None and wait > MAX_IDLE_SESSION:
+          return "close"
+      if session.idle_time() >= KEEPALIVE_INTERVAL:
+          return "noop"
+      return None
+
+  def idle_wait(self, session, wait):
+      """
+      How long a worker waits before it looks after its session again.
+      """
+      if session is None or session.connection is None:
+          return wait
+      remaining = KEEPALIVE_INTERVAL - session.idle_time()
+      return remaining if wait is None else min(wait, remaining)
+
+  def reconnect_delay(self, attempt, error):
+      """
+      Seconds to wait before opening a session again after its `attempt`-th
+      failure in a row. Re-raises the error after MAX_RECONNECT_ATTEMPTS, or at
+      once unless it is transient or a connection error (e.g. a wrong password).
+      """
+      if classify_error(error) not in (TRANSIENT, CONNECTION) or attempt == MAX_RECONNECT_ATTEMPTS:
+          raise error
+      return backoff_delay(attempt, RECONNECT_BACKOFF, RECONNECT_BACKOFF_MAX)
+
+  # --------------------------------------------------------------------
+  # Outcomes
+  # --------------------------------------------------------------------
+
+  def observe_failure(self, email, error):
+      """
+      Record the reply code of a failed send in the metrics.
+      """
+      if isinstance(error, smtplib.SMTPRecipientsRefused):
+          self.metrics.reply(error.recipients.get(email, (None,))[0])
+      elif isinstance(error, smtplib.SMTPException):
+          self.metrics.reply(reply_code(error))
+
+  def settle(self, account, item, error=None, latency=None):
+      """
+      Act on the outcome of one send and return whether the session was lost
+      (the worker then drops it and opens a new one for the next recipient).
+      """
+      i, email, attempt, group = item
+      if error is None:
+          self.dispatcher.succeeded(group)
+          self.rotation.succeeded(account)
+          self.record_sent(email, latency, account)
+          return False
+      return self.handle_failure(account, item, error) == CONNECTION
+
+  def handle_failure(self, account, item, error):
+      """
+      Act on a failed send according to the class of its error, and return the class:
+      a permanent refusal is recorded, a transient one (4xx) is sent again after a
+      backoff, and after a connection error the recipient is sent again at once
+      (on a new session); after MAX_DELIVERY_ATTEMPTS it is recorded as deferred.
+      Throttling replies also pause the account (when another can take over, or
+      MAIL FROM was refused) or else the recipient's group.
+      Errors that are not delivery errors are re-raised.
+      """
+      i, email, attempt, group = item
+      kind = classify_error(error, email)
+      reply = failure_reply(error, email)
+      sender_refused = isinstance(error, smtplib.SMTPSenderRefused)
+      if kind is None or (kind == PERMANENT and sender_refused):
+          # A bug, or the server will not take mail from this account at all
+          raise error
+
+      if kind == PERMANENT:
+          # Only this address (or message) was rejected
+          self.record_failed(email, reply)
+          return kind
+
+      if kind == TRANSIENT:
+          # A throttling reply pauses the account (when another can take over)
+          # or the recipient's group, and puts the recipient back in line
+          blame_account = self.rotation.blames_account(sender_refused)
+          if blame_account:
+              self.rotation.throttled(account)
+          retried = self.dispatcher.retry(item, backoff_delay(attempt), pause_group=not blame_account)
+      else:
+          retried = self.dispatcher.retry(item)
+      if retried:
+          self.metrics.retried(kind)
+      else:
+          # Out of attempts: not refused for good, so a resumed campaign sends it again
+          self.record_failed(email, reply, "deferred")
+      return kind
+
+  def begin_send(self):
+      """
+      Count one send as in flight.
+      """
+      with self.lock:
+          self.in_flight += 1
+      self.metrics.send_started()
+
+  def end_send(self):
+      """
+      Count one send as finished.
+      """
+      with self.lock:
+          self.in_flight -= 1
+      self.metrics.send_finished()
+
+  def record_sent(self, email, latency=None, account=None):
+      """
+      Count one delivered email and report the aggregate total,
+      with how long the send took and how many sends are in flight.
+      The journal records which account sent it.
+      """
+      if self.journal is not None:
+          self.journal.record(email, "sent", sender=account.sender_email if account else None)
+      with self.lock:
+          self.emails_sent += 1
+          self.progress_queue.put({'emails_sent': self.emails_sent, 'latency': latency, 'in_flight': self.in_flight})
+
+  def record_failed(self, email, reply, status="refused"):
+      """
+      Record a recipient that was not sent, with its (code, message) reply:
+      "refused" for good, or "deferred" when it still failed after its last
+      attempt (the journal does not count it as done, see FINAL_STATUSES).
+      """
+      if self.journal is not None:
+          self.journal.record(email, status, reply)
+      with self.lock:
+          self.emails_failed += 1
+          self.failed.append((email, reply))
+          self.progress_queue.put({'emails_failed': self.emails_failed, 'failed_email': email, 'reply': reply,
+                                   'deferred': status == "deferred", 'in_flight': self.in_flight})
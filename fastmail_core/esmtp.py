@@ -0,0 +1,304 @@
+# Import required modules
+import smtplib
+import ssl
+import time
+
+# ------------------------------------------------------------------------
+# ESMTP Helpers Shared by the Delivery Engines
+# ------------------------------------------------------------------------
+
+CRLF = b"\r\n"
+
+# Seconds an open session may sit idle before a NOOP keeps it open
+KEEPALIVE_INTERVAL = 30
+
+# A worker about to wait longer than this closes its session and opens it again afterwards
+MAX_IDLE_SESSION = 300
+
+# Refusals a delivery engine keeps in memory, the most recent ones: the send
+# journal has all of them (see SendJournal.refused)
+RECENT_REFUSALS = 100
+
+# Reply a non-ASCII address is refused with, before any command is sent, when
+# the server does not support SMTPUTF8 (RFC 6531)
+SMTPUTF8_REFUSAL = (553, b"5.6.7 The server does not support SMTPUTF8, needed for a non-ASCII address")
+
+# Rendered messages are either bytes or a list of pieces: bytes and attachment
+# streams (iterables of byte chunks with a len(), see message.Attachment), so
+# an attachment is never held in memory whole.
+
+def message_size(data):
+  """
+  Size in bytes of a rendered message.
+  """
+  if isinstance(data, bytes):
+      return len(data)
+  return sum(len(part) for part in data)
+
+def message_chunks(data):
+  """
+  Yield the bytes of a rendered message in chunks: the small pieces between
+  attachment chunks are joined to the next chunk rather than sent on their own.
+  """
+  if isinstance(data, bytes):
+      yield data
+      return
+  pending = []
+  for part in data:
+      if isinstance(part, bytes):
+          pending.append(part)
+          continue
+      for chunk in part:
+          pending.append(chunk)
+          yield b"".join(pending)
+          pending.clear()
+  if pending:
+      yield b"".join(pending)
+
+def message_bytes(data):
+  """
+  A rendered message as one bytes object.
+  """
+  return data if isinstance(data, bytes) else b"".join(message_chunks(data))
+
+def dot_stuff_chunks(chunks):
+  """
+  Prepare the chunks of a message for the DATA command: escape leading dots,
+  including on lines split between two chunks, and end the last chunk with
+  the CRLF . CRLF terminator. The terminator goes out in the same write as
+  the end of the message: written on its own, it would wait for the server's
+  delayed ACK (Nagle's algorithm), about 40 ms per message.
+  """
+  ending = CRLF  # last two bytes sent; the message starts a line
+  previous = b""  # held back until it is known whether it is the last chunk
+  for chunk in chunks:
+      if not chunk:
+          continue
+      if chunk[:1] == b"." and ending == CRLF:
+          chunk = b"." + chunk
+      elif chunk[:2] == b"\n." and ending.endswith(b"\r"):
+          chunk = b"\n." + chunk[1:]
+      chunk = chunk.replace(b"\r\n.", b"\r\n..")
+      ending = (ending + chunk[-2:])[-2:]
+      if previous:
+          yield previous
+      previous = chunk
+  yield previous + (b"" if ending == CRLF else CRLF) + b"." + CRLF
+
+def transaction_commands(from_addr, to_addrs, mail_options=()):
+  """
+  Return the MAIL FROM, RCPT TO and DATA command lines for one message.
+  """
+  mail_line = f"MAIL FROM:{smtplib.quoteaddr(from_addr)}"
+  if mail_options:
+      mail_line += " " + " ".join(mail_options)
+  commands = [mail_line]
+  commands.extend(f"RCPT TO:{smtplib.quoteaddr(to_addr)}" for to_addr in to_addrs)
+  commands.append("DATA")
+  return commands
+
+def require_smtputf8(smtp_session, to_addrs, mail_options):
+  """
+  Refuse the recipients of a message sent with SMTPUTF8 (a non-ASCII address)
+  for good when the server does not advertise it: the address cannot be sent
+  to on this server, but the other recipients can.
+  """
+  if "SMTPUTF8" in mail_options and not smtp_session.has_extn("smtputf8"):
+      raise smtplib.SMTPRecipientsRefused({to_addr: SMTPUTF8_REFUSAL for to_addr in to_addrs})
+
+def check_pipelined_replies(from_addr, to_addrs, mail_reply, rcpt_replies, data_reply):
+  """
+  Match pipelined replies back to their commands (RFC 2920).
+  Returns the dict of refused recipients, each keyed by its own address,
+  or raises the smtplib exception sendmail() would raise.
+  The caller must have reset the transaction before an exception is raised.
+  """
+  if mail_reply[0] != 250:
+      raise smtplib.SMTPSenderRefused(mail_reply[0], mail_reply[1], from_addr)
+  refused = {
+      to_addr: reply
+      for to_addr, reply in zip(to_addrs, rcpt_replies)
+      if reply[0] not in (250, 251)
+  }
+  if len(refused) == len(to_addrs):
+      raise smtplib.SMTPRecipientsRefused(refused)
+  if data_reply[0] != 354:
+      raise smtplib.SMTPDataError(data_reply[0], data_reply[1])
+  return refused
+
+def reply_code(error):
+  """
+  Return the SMTP reply code carried by an smtplib exception, or None.
+  """
+  if isinstance(error, smtplib.SMTPResponseException):
+      return error.smtp_code
+  return None
+
+def reset_quietly(smtp_session):
+  """
+  Reset the current transaction, ignoring a dropped connection.
+  """
+  try:
+      smtp_session.rset()
+  except smtplib.SMTPServerDisconnected:
+      pass
+
+def send_message_data(smtp_session, msg):
+  """
+  Stream a rendered message after the server's 354 reply to DATA, end it and
+  check the final reply.
+  """
+  for chunk in dot_stuff_chunks(message_chunks(msg)):
+      smtp_session.send(chunk)
+  code, message = smtp_session.getreply()
+  if code != 250:
+      if code == 421:
+          smtp_session.close()
+      else:
+          reset_quietly(smtp_session)
+      raise smtplib.SMTPDataError(code, message)
+
+def unpipelined_sendmail(smtp_session, from_addr, to_addrs, msg, mail_options=()):
+  """
+  smtp_session.sendmail, one command at a time, for a rendered message that is
+  streamed rather than held in memory. The session must have said EHLO/HELO.
+  """
+  options = []
+  if smtp_session.does_esmtp:
+      if smtp_session.has_extn("size"):
+          options.append(f"size={message_size(msg)}")
+      options.extend(mail_options)
+  code, message = smtp_session.mail(from_addr, options)
+  if code != 250:
+      if code == 421:
+          smtp_session.close()
+      else:
+          reset_quietly(smtp_session)
+      raise smtplib.SMTPSenderRefused(code, message, from_addr)
+
+  refused = {}
+  for to_addr in to_addrs:
+      code, message = smtp_session.rcpt(to_addr)
+      if code not in (250, 251):
+          refused[to_addr] = (code, message)
+      if code == 421:
+          smtp_session.close()
+          raise smtplib.SMTPRecipientsRefused(refused)
+  if len(refused) == len(to_addrs):
+      reset_quietly(smtp_session)
+      raise smtplib.SMTPRecipientsRefused(refused)
+
+  code, message = smtp_session.docmd("DATA")
+  if code != 354:
+      reset_quietly(smtp_session)
+      raise smtplib.SMTPDataError(code, message)
+  send_message_data(smtp_session, msg)
+  return refused
+
+def pipelined_sendmail(smtp_session, from_addr, to_addrs, msg, mail_options=()):
+  """
+  Send one rendered message on an smtplib session, pipelining MAIL FROM, RCPT TO
+  and DATA when the server advertises PIPELINING, one command at a time otherwise.
+  The message is streamed in chunks.
+  Returns the dict of refused recipients, like smtplib.SMTP.sendmail.
+  """
+  smtp_session.ehlo_or_helo_if_needed()
+  require_smtputf8(smtp_session, to_addrs, mail_options)
+  if not smtp_session.has_extn("pipelining") or "SMTPUTF8" in mail_options:
+      return unpipelined_sendmail(smtp_session, from_addr, to_addrs, msg, mail_options)
+
+  mail_options = list(mail_options)
+  if smtp_session.does_esmtp and smtp_session.has_extn("size"):
+      mail_options.append(f"size={message_size(msg)}")
+
+  # One write for the whole command group, then read the replies in order
+  commands = transaction_commands(from_addr, to_addrs, mail_options)
+  smtp_session.send("".join(f"{command}\r\n" for command in commands))
+  mail_reply = smtp_session.getreply()
+  rcpt_replies = [smtp_session.getreply() for _ in to_addrs]
+  data_reply = smtp_session.getreply()
+
+  try:
+      refused = check_pipelined_replies(from_addr, to_addrs, mail_reply, rcpt_replies, data_reply)
+  except smtplib.SMTPException:
+      if data_reply[0] == 354:
+          # The server accepted DATA anyway: end it with an empty message
+          smtp_session.send(b"." + CRLF)
+          smtp_session.getreply()
+      reset_quietly(smtp_session)
+      raise
+
+  send_message_data(smtp_session, msg)
+  return refused
+
+# ------------------------------------------------------------------------
+# Sessions
+# ------------------------------------------------------------------------
+
+class TLSSessionCache(ssl.SSLContext):
+  """
+  TLS client context that offers the last session it saw when a connection is
+  opened again, so the server can resume it (session ticket or id) instead of
+  running a full handshake. Certificates are verified as with
+  ssl.create_default_context(). Use one per sender account, i.e. per server.
+  """
+
+  last_session = None
+
+  @classmethod
+  def create(cls):
+      context = cls(ssl.PROTOCOL_TLS_CLIENT)
+      context.load_default_certs()
+      return context
+
+  def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True, suppress_ragged_eofs=True,
+                  server_hostname=None, session=None):
+      # Used by smtplib's starttls()
+      return super().wrap_socket(sock, server_side, do_handshake_on_connect, suppress_ragged_eofs,
+                                 server_hostname, session or self.last_session)
+
+  def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+      # Used by asyncio's start_tls()
+      return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session or self.last_session)
+
+  def remember(self, ssl_object):
+      """
+      Keep the session of an established connection (an SSLSocket or SSLObject)
+      for the next one. Call it after the first reply read over TLS: TLS 1.3
+      tickets arrive after the handshake. Returns whether this connection
+      resumed an earlier session.
+      """
+      session = ssl_object.session
+      if session is not None and (session.has_ticket or session.id):
+          self.last_session = session
+      return ssl_object.session_reused
+
+class WorkerSession:
+  """
+  The SMTP session of one engine worker: the connection (None until it is
+  opened, and after it is closed or lost), whether one was opened before (so
+  opening another counts as a reconnect) and when it was last used.
+  """
+
+  def __init__(self):
+      self.connection = None
+      self.opened = False
+      self.last_used = 0.0
+
+  def attach(self, connection):
+      self.connection = connection
+      self.opened = True
+      self.used()
+
+  def used(self):
+      self.last_used = time.monotonic()
+
+  def idle_time(self):
+      return time.monotonic() - self.last_used
+
+  def detach(self):
+      """
+      Forget the connection and return it, for the caller to close.
+      """
+      connection, self.connection = self.connection, None
+      return connection
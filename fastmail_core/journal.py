@@ -0,0 +1,160 @@
+# Import required modules
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+# Outcomes that mean a recipient must not be sent to again on resume; a
+# "deferred" recipient (still failing after its last attempt) is sent again
+FINAL_STATUSES = ("sent", "refused")
+
+# Pending records are committed together once either limit is reached
+COMMIT_EVERY = 200
+COMMIT_INTERVAL = 1.0  # seconds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    campaign_id TEXT PRIMARY KEY,
+    subject TEXT,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS sends (
+    campaign_id TEXT NOT NULL,
+    email TEXT NOT NULL,
+    status TEXT NOT NULL,
+    code INTEGER,
+    detail TEXT,
+    sent_at REAL NOT NULL,
+    sender TEXT,
+    PRIMARY KEY (campaign_id, email)
+) WITHOUT ROWID;
+"""
+
+# ------------------------------------------------------------------------
+# Campaign Identity
+# ------------------------------------------------------------------------
+
+def campaign_id_for(sender_email, subject, html_body, attachment_paths=()):
+  """
+  Derive a stable campaign id from what is being sent, so sending the same
+  campaign again finds the journal of the previous run.
+  """
+  attachment_names = "\0".join(os.path.basename(path) for path in attachment_paths)
+  digest = hashlib.sha256()
+  for part in (sender_email, subject, html_body, attachment_names):
+      digest.update(part.encode("utf-8"))
+      digest.update(b"\0")
+  return digest.hexdigest()[:32]
+
+# ------------------------------------------------------------------------
+# Send Journal
+# ------------------------------------------------------------------------
+
+class SendJournal:
+  """
+  Append-only record of every recipient's outcome, per campaign.
+  Stored in SQLite in WAL mode. Records are buffered and committed in groups
+  (every COMMIT_EVERY records or COMMIT_INTERVAL seconds), so a crash loses at
+  most the last group. Safe to use from several sender threads.
+  """
+
+  def __init__(self, path, campaign_id, subject=""):
+      self.path = path
+      self.campaign_id = campaign_id
+      self.lock = threading.Lock()
+      self.pending = []
+      self.last_commit = time.monotonic()
+
+      self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+      self.connection.execute("PRAGMA journal_mode=WAL")
+      self.connection.execute("PRAGMA synchronous=NORMAL")
+      self.connection.executescript(SCHEMA)
+      # Journals written before sender accounts were recorded lack the column
+      columns = {row[1] for row in self.connection.execute("PRAGMA table_info(sends)")}
+      if "sender" not in columns:
+          self.connection.execute("ALTER TABLE sends ADD COLUMN sender TEXT")
+      self.connection.execute(
+          "INSERT OR IGNORE INTO campaigns (campaign_id, subject, created) VALUES (?, ?, ?)",
+          (campaign_id, subject, time.time()))
+
+  def completed(self):
+      """
+      Return the set of addresses that already reached a final outcome,
+      for O(1) skipping when a campaign is resumed.
+      """
+      placeholders = ",".join("?" * len(FINAL_STATUSES))
+      rows = self.connection.execute(
+          f"SELECT email FROM sends WHERE campaign_id = ? AND status IN ({placeholders})",
+          (self.campaign_id, *FINAL_STATUSES))
+      return {email for (email,) in rows}
+
+  def counts(self):
+      """
+      Return a {status: count} summary of this campaign.
+      """
+      rows = self.connection.execute(
+          "SELECT status, COUNT(*) FROM sends WHERE campaign_id = ? GROUP BY status",
+          (self.campaign_id,))
+      return dict(rows)
+
+  def refused(self):
+      """
+      Yield (email, code, detail) for every recipient of this campaign the
+      server refused, in the order they were recorded; buffered records are
+      committed first.
+      """
+      self.flush()
+      yield from self.connection.execute(
+          "SELECT email, code, detail FROM sends WHERE campaign_id = ? AND status = 'refused' ORDER BY sent_at",
+          (self.campaign_id,))
+
+  def reset(self):
+      """
+      Forget every recorded outcome of this campaign (start it over).
+      """
+      with self.lock:
+          self.pending = []
+          self.connection.execute("DELETE FROM sends WHERE campaign_id = ?", (self.campaign_id,))
+
+  def record(self, email, status, reply=None, sender=None):
+      """
+      Record one recipient's outcome. `reply` is an optional (code, message) pair,
+      `sender` the account the message was sent from.
+      """
+      code, detail = reply if reply else (None, None)
+      if isinstance(detail, bytes):
+          detail = detail.decode("utf-8", "replace")
+      with self.lock:
+          self.pending.append((self.campaign_id, email, status, code, detail, time.time(), sender))
+          if len(self.pending) >= COMMIT_EVERY or time.monotonic() - self.last_commit >= COMMIT_INTERVAL:
+              self.commit_pending()
+
+  def commit_pending(self):
+      # Caller holds self.lock
+      if self.pending:
+          self.connection.execute("BEGIN")
+          self.connection.executemany(
+              "INSERT OR REPLACE INTO sends (campaign_id, email, status, code, detail, sent_at, sender) "
+              "VALUES (?, ?, ?, ?, ?, ?, ?)", self.pending)
+          self.connection.execute("COMMIT")
+          self.pending = []
+      self.last_commit = time.monotonic()
+
+  def flush(self):
+      """
+      Commit every buffered record now.
+      """
+      with self.lock:
+          self.commit_pending()
+
+  def close(self):
+      """
+      Commit buffered records and close the database.
+      """
+      self.flush()
+      self.connection.close()
@@ -0,0 +1,278 @@
+# Import required modules
+import base64
+import mimetypes
+import mmap
+import os
+import email.quoprimime as quoprimime
+from email import policy
+from email.message import EmailMessage
+
+from fastmail_core.dkim import CampaignSignature
+from fastmail_core.esmtp import pipelined_sendmail
+from fastmail_core.template import EMAIL_FIELD, MergeTemplate, escape_value
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+# Placeholders written into the template message and cut out afterwards
+RECIPIENT_PLACEHOLDER = "fastmail-recipient@placeholder.invalid"
+SUBJECT_PLACEHOLDER = "FASTMAILSUBJECTPLACEHOLDER"
+BODY_PLACEHOLDER = "FASTMAILBODYPLACEHOLDER"
+ATTACHMENT_PLACEHOLDER = "FASTMAILATTACHMENT{}PLACEHOLDER"
+
+CRLF = b"\r\n"
+SOFT_BREAK = b"=" + CRLF
+
+# Longest field value written as is in a quoted-printable line (76 with the soft break)
+MAX_PLAIN_VALUE = 75
+
+# Attachments are base64-encoded this many bytes at a time: 1024 lines of 76 characters
+ATTACHMENT_CHUNK = 57 * 1024
+BASE64_LINE = 76
+
+# Encoded parts are streamed from the attachment cache in chunks of the same 1024 lines
+ENCODED_CHUNK = ATTACHMENT_CHUNK // 3 * 4 // BASE64_LINE * (BASE64_LINE + 2)
+
+# Positions of the per-recipient pieces of a CampaignMessage
+TO_PIECE = 1
+SUBJECT_PIECE = 2
+FIRST_FIELD_PIECE = 4
+
+# ------------------------------------------------------------------------
+# Attachments
+# ------------------------------------------------------------------------
+
+class Attachment:
+  """
+  A file attached to every message of a campaign, never held in memory whole:
+  each message reads it through a memory map and base64-encodes it
+  ATTACHMENT_CHUNK bytes at a time while it is sent, or, once an
+  AttachmentCache has set `encoded_path`, streams the encoded part from the
+  cache as is. Iterating yields the encoded chunks (CRLF-terminated lines of
+  76 characters, as the email package writes them); len() is the encoded size.
+  The file must not change while the campaign is sent. An encoded part that
+  is evicted from the cache meanwhile (by another campaign or process) is
+  replaced by encoding the file again.
+  """
+
+  def __init__(self, path):
+      self.path = path
+      self.filename = os.path.basename(path)
+      mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+      self.maintype, self.subtype = mime_type.split("/", 1)
+      self.size = os.path.getsize(path)
+      self.encoded_path = None
+      self.encoded_size = 0
+
+  def __len__(self):
+      if self.encoded_path is not None:
+          return self.encoded_size
+      encoded = (self.size + 2) // 3 * 4
+      return encoded + (encoded + BASE64_LINE - 1) // BASE64_LINE * 2
+
+  def __iter__(self):
+      if self.encoded_path is not None:
+          return self.cached()
+      return self.encode()
+
+  def cached(self):
+      """
+      Yield the encoded part from the cache, or the file encoded again if the
+      part was removed from the cache since it was looked up. The part is
+      opened before anything is yielded, so nothing was sent when it is missing.
+      """
+      chunks = map_chunks(self.encoded_path, self.encoded_size, ENCODED_CHUNK)
+      try:
+          first = next(chunks, None)
+      except FileNotFoundError:
+          # Encode the file for this message and every later one
+          self.encoded_path = None
+          yield from self.encode()
+          return
+      if first is not None:
+          yield first
+          yield from chunks
+
+  def encode(self):
+      """
+      Yield the file base64-encoded, ATTACHMENT_CHUNK bytes of it at a time.
+      """
+      for data in map_chunks(self.path, self.size, ATTACHMENT_CHUNK):
+          encoded = base64.b64encode(data)
+          lines = [encoded[i:i + BASE64_LINE] for i in range(0, len(encoded), BASE64_LINE)]
+          yield CRLF.join(lines) + CRLF
+
+def map_chunks(path, size, chunk_size):
+  """
+  Yield the first `size` bytes of a file through a memory map, `chunk_size` at a time.
+  """
+  if not size:
+      return  # an empty file cannot be mapped
+  with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      for start in range(0, size, chunk_size):
+          yield data[start:min(start + chunk_size, size)]
+
+# ------------------------------------------------------------------------
+# Precompiled Campaign Message
+# ------------------------------------------------------------------------
+
+def encode_html(text):
+  """
+  Quoted-printable encode an HTML string as UTF-8 with CRLF line endings.
+  """
+  return quoprimime.body_encode(text.encode("utf-8").decode("latin-1"), eol="\r\n").encode("ascii")
+
+def encode_segment(text):
+  """
+  Quoted-printable encode a piece of the HTML body, followed by a soft line
+  break so the next piece continues it without a newline.
+  """
+  encoded = encode_html(text)
+  return encoded + SOFT_BREAK if encoded else encoded
+
+def encode_field(value):
+  """
+  encode_segment for a recipient's field value, HTML-escaped. Short printable
+  ASCII values, the usual case, only need their '=' signs encoded.
+  """
+  value = escape_value(value)
+  if value.isascii() and value.isprintable() and not value.endswith(" "):
+      encoded = value.replace("=", "=3D")
+      if len(encoded) <= MAX_PLAIN_VALUE:
+          return encoded.encode("ascii") + SOFT_BREAK
+  return encode_segment(value)
+
+def format_to_header(to_email):
+  """
+  Render the 'To:' header line for one recipient.
+  Plain ASCII addresses take a fast path, anything else goes through the email policy.
+  """
+  if to_email.isascii() and len(to_email) < 900 and "\n" not in to_email and "\r" not in to_email:
+      return b"To: " + to_email.encode("ascii") + CRLF
+  return policy.SMTPUTF8.fold_binary("To", to_email)
+
+def format_subject_header(subject):
+  """
+  Render the 'Subject:' header line. Short printable ASCII subjects take a fast
+  path, anything else is folded and encoded by the email policy.
+  """
+  if subject.isascii() and subject.isprintable() and len(subject) <= 68 and subject.strip() == subject:
+      return b"Subject: " + subject.encode("ascii") + CRLF
+  name, header = policy.SMTP.header_store_parse("Subject", subject)
+  return header.fold(policy=policy.SMTP).encode("ascii")
+
+def header_value(value):
+  """
+  A field value for a header: on one line, whitespace runs collapsed.
+  """
+  return " ".join(value.split())
+
+class CampaignMessage:
+  """
+  A message serialized once for a whole campaign.
+  From, the static parts of the subject and HTML body and the MIME headers and
+  boundaries of the attachments are rendered to bytes up front, as a list of
+  pieces with empty slots for what differs per recipient: the 'To:' header,
+  the subject if it has merge fields, the body's merge fields (see
+  MergeTemplate) and the closing footer. The attachments themselves are
+  Attachment streams among the pieces (`attachments` holds file paths or
+  Attachment objects, from an AttachmentCache). Rendering a message fills the slots.
+  With a DKIMSigner as `dkim`, each message is signed, reusing the hash of
+  everything the messages share up to the first slot.
+  """
+
+  def __init__(self, subject, html_body, sender_email, attachments=(), dkim=None):
+      self.sender_email = sender_email
+      self.subject = MergeTemplate(subject)
+      self.body = MergeTemplate(html_body)
+
+      msg = EmailMessage()
+      msg['To'] = RECIPIENT_PLACEHOLDER
+      msg['Subject'] = SUBJECT_PLACEHOLDER
+      msg['From'] = sender_email
+      msg.set_content(BODY_PLACEHOLDER, subtype='html', cte='quoted-printable')
+
+      # Attachment parts with a placeholder for the content, streamed when sending
+      self.attachments = [Attachment(a) if isinstance(a, str) else a for a in attachments]
+      for index, attachment in enumerate(self.attachments):
+          msg.add_attachment(ATTACHMENT_PLACEHOLDER.format(index).encode("ascii"),
+                             maintype=attachment.maintype,
+                             subtype=attachment.subtype,
+                             filename=attachment.filename)
+
+      rendered = msg.as_bytes(policy=policy.SMTP)
+
+      # Cut the rendered message around the 'To:' and 'Subject:' lines and the body placeholder
+      to_line = format_to_header(RECIPIENT_PLACEHOLDER)
+      subject_line = format_subject_header(SUBJECT_PLACEHOLDER)
+      head, rest = rendered.split(to_line + subject_line, 1)
+      middle, tail = rest.split(BODY_PLACEHOLDER.encode("ascii"), 1)
+      tail = [tail]
+      for index, attachment in enumerate(self.attachments):
+          placeholder = base64.b64encode(ATTACHMENT_PLACEHOLDER.format(index).encode("ascii")) + CRLF
+          before, after = tail.pop().split(placeholder, 1)
+          tail.extend((before, attachment, after))
+
+      # head | To | Subject | middle + body start | field | segment | ... | footer | tail (with attachments)
+      self.subject_line = None if self.subject.slots else format_subject_header(subject)
+      self.body_defaults = [encode_segment(default) if default else b"" for name, default in self.body.slots]
+      self.pieces = [head, None, self.subject_line, middle + encode_segment(self.body.segments[0])]
+      for segment in self.body.segments[1:]:
+          self.pieces.extend((None, encode_segment(segment)))
+      self.footer_piece = len(self.pieces)
+      self.pieces.append(None)
+      self.pieces.extend(tail)
+
+      self.signature = None
+      if dkim:
+          # A merged subject is signed per message; the static one is part of the header block
+          header_end = middle.index(CRLF + CRLF) + 2
+          header_block = head + to_line + (self.subject_line or subject_line) + middle[:header_end]
+          varying = ("to",) if self.subject_line is not None else ("to", "subject")
+          self.signature = CampaignSignature(dkim, header_block, varying, self.pieces[3][header_end + 2:], tail)
+
+  @property
+  def fields(self):
+      """
+      Names of the merge fields of the subject and body.
+      """
+      return list(dict.fromkeys(self.subject.fields + self.body.fields))
+
+  def render(self, to_email, footer_html="", fields=None):
+      """
+      Return the full message for one recipient, CRLF-terminated, as a list of
+      bytes and Attachment streams (see esmtp.message_chunks).
+      `fields` holds the recipient's merge field values ({name: text}).
+      """
+      pieces = self.pieces.copy()
+      pieces[TO_PIECE] = format_to_header(to_email)
+      if self.subject_line is None or self.body.slots:
+          values = dict(fields or (), **{EMAIL_FIELD: to_email})
+          if self.subject_line is None:
+              pieces[SUBJECT_PIECE] = format_subject_header(self.subject.render(values, header_value))
+          # A field used several times is encoded once
+          encoded = {}
+          index = FIRST_FIELD_PIECE
+          for (name, default), encoded_default in zip(self.body.slots, self.body_defaults):
+              piece = encoded.get(name)
+              if piece is None:
+                  value = values.get(name)
+                  piece = encoded[name] = encode_field(value) if value else b""
+              pieces[index] = piece or encoded_default
+              index += 2
+      pieces[self.footer_piece] = encode_html(footer_html)
+      if self.signature is not None:
+          signature = self.signature.sign({"to": pieces[TO_PIECE], "subject": pieces[SUBJECT_PIECE]},
+                                          b"".join(pieces[FIRST_FIELD_PIECE:self.footer_piece + 1]))
+          pieces[0] = signature + pieces[0]
+      return pieces
+
+  def send(self, smtp_session, to_email, footer_html="", fields=None):
+      """
+      Send the rendered message for one recipient through an open SMTP session,
+      pipelining the SMTP commands when the server supports it.
+      """
+      data = self.render(to_email, footer_html, fields)
+      mail_options = () if to_email.isascii() else ("SMTPUTF8",)
+      return pipelined_sendmail(smtp_session, self.sender_email, [to_email], data, mail_options)
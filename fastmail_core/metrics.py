@@ -0,0 +1,282 @@
+# Import required modules
+import bisect
+import json
+import os
+import threading
+import time
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+# Delivery stages timed by the engines
+STAGES = ("connect", "starttls", "starttls_resumed", "login", "build", "transfer")
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is +Inf
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Percentiles reported in the JSON summary
+SUMMARY_PERCENTILES = (50, 90, 99)
+
+# ------------------------------------------------------------------------
+# Histogram
+# ------------------------------------------------------------------------
+
+class Histogram:
+  """
+  Fixed-bucket latency histogram (Prometheus style). Observing is a bisect
+  and a few additions; percentiles are estimated from the buckets, within
+  the smallest and largest values seen.
+  """
+
+  def __init__(self, buckets=LATENCY_BUCKETS):
+      self.buckets = buckets
+      self.counts = [0] * (len(buckets) + 1)
+      self.count = 0
+      self.sum = 0.0
+      self.min = None
+      self.max = None
+
+  def observe(self, value):
+      self.counts[bisect.bisect_left(self.buckets, value)] += 1
+      self.count += 1
+      self.sum += value
+      if self.min is None or value < self.min:
+          self.min = value
+      if self.max is None or value > self.max:
+          self.max = value
+
+  def percentile(self, p):
+      """
+      Estimate the p-th percentile by interpolating inside its bucket, or None if empty.
+      """
+      if not self.count:
+          return None
+      rank = self.count * p / 100
+      seen = 0
+      for i, n in enumerate(self.counts):
+          if n and seen + n >= rank:
+              low = max(self.buckets[i - 1] if i else 0.0, self.min)
+              high = min(self.buckets[i] if i < len(self.buckets) else self.max, self.max)
+              return low + (high - low) * (rank - seen) / n
+          seen += n
+      return self.max
+
+# ------------------------------------------------------------------------
+# Delivery Metrics
+# ------------------------------------------------------------------------
+
+class DeliveryMetrics:
+  """
+  Counters, gauges and per-stage latency histograms of one campaign.
+  Shared by every session of a delivery engine; thread-safe.
+  """
+
+  def __init__(self, pool_size=0):
+      self.lock = threading.Lock()
+      self.started = time.time()
+      self.stages = {stage: Histogram() for stage in STAGES}
+      self.replies = {}  # SMTP reply code -> count
+      self.sent_by = {}  # sender account -> messages delivered
+      self.retries = {}  # error class (transient, connection) -> sends queued again
+      self.bytes_sent = 0
+      self.sessions_opened = 0
+      self.reconnects = 0
+      self.keepalives = 0
+      self.attachment_cache = {"hit": 0, "miss": 0}  # attachments streamed from the cache, or encoded first
+      self.pool_size = pool_size
+      self.sessions_open = 0
+      self.in_flight = 0
+
+  def observe(self, stage, seconds):
+      """
+      Record how long one delivery stage took.
+      """
+      with self.lock:
+          self.stages[stage].observe(seconds)
+
+  def reply(self, code, size=0, sender=None):
+      """
+      Count one final SMTP reply code (None when the session was lost), and the
+      bytes sent with the message and the account it was delivered from.
+      """
+      with self.lock:
+          if code is not None:
+              self.replies[code] = self.replies.get(code, 0) + 1
+          self.bytes_sent += size
+          if sender is not None:
+              self.sent_by[sender] = self.sent_by.get(sender, 0) + 1
+
+  def retried(self, kind):
+      """
+      Count one recipient queued to be sent again after an error of class `kind`.
+      """
+      with self.lock:
+          self.retries[kind] = self.retries.get(kind, 0) + 1
+
+  def session_opened(self, reconnect=False):
+      with self.lock:
+          self.sessions_opened += 1
+          self.sessions_open += 1
+          if reconnect:
+              self.reconnects += 1
+
+  def keepalive(self):
+      """
+      Count one NOOP sent to keep an idle session open.
+      """
+      with self.lock:
+          self.keepalives += 1
+
+  def attachment_cache_lookups(self, hits, misses):
+      """
+      Count the attachments found in the attachment cache and those encoded into it.
+      """
+      with self.lock:
+          self.attachment_cache["hit"] += hits
+          self.attachment_cache["miss"] += misses
+
+  def session_closed(self):
+      with self.lock:
+          self.sessions_open -= 1
+
+  def send_started(self):
+      with self.lock:
+          self.in_flight += 1
+
+  def send_finished(self):
+      with self.lock:
+          self.in_flight -= 1
+
+  # --------------------------------------------------------------------
+  # Export
+  # --------------------------------------------------------------------
+
+  def prometheus(self):
+      """
+      Render every metric in the Prometheus text exposition format.
+      """
+      lines = []
+      with self.lock:
+          lines.append("# HELP fastmail_stage_seconds Time spent in each delivery stage.")
+          lines.append("# TYPE fastmail_stage_seconds histogram")
+          for stage, histogram in self.stages.items():
+              cumulative = 0
+              for bound, n in zip(histogram.buckets, histogram.counts):
+                  cumulative += n
+                  lines.append(f'fastmail_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+              lines.append(f'fastmail_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+              lines.append(f'fastmail_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+              lines.append(f'fastmail_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+          lines.append("# HELP fastmail_smtp_replies_total Final SMTP replies by code.")
+          lines.append("# TYPE fastmail_smtp_replies_total counter")
+          for code, n in sorted(self.replies.items()):
+              lines.append(f'fastmail_smtp_replies_total{{code="{code}"}} {n}')
+          lines.append("# HELP fastmail_sent_by_account_total Messages delivered per sender account.")
+          lines.append("# TYPE fastmail_sent_by_account_total counter")
+          for sender, n in sorted(self.sent_by.items()):
+              sender = sender.replace("\\", "\\\\").replace('"', '\\"')
+              lines.append(f'fastmail_sent_by_account_total{{sender="{sender}"}} {n}')
+          lines.append("# HELP fastmail_retries_total Recipients queued to be sent again, by error class.")
+          lines.append("# TYPE fastmail_retries_total counter")
+          for kind, n in sorted(self.retries.items()):
+              lines.append(f'fastmail_retries_total{{error="{kind}"}} {n}')
+          lines.append("# HELP fastmail_attachment_cache_total Attachments found in the attachment cache or encoded into it.")
+          lines.append("# TYPE fastmail_attachment_cache_total counter")
+          for result, n in self.attachment_cache.items():
+              lines.append(f'fastmail_attachment_cache_total{{result="{result}"}} {n}')
+          for name, kind, text, value in (
+              ("bytes_sent_total", "counter", "Message bytes sent.", self.bytes_sent),
+              ("sessions_opened_total", "counter", "SMTP sessions opened.", self.sessions_opened),
+              ("reconnects_total", "counter", "SMTP sessions reopened after a session was lost or closed while idle.", self.reconnects),
+              ("keepalives_total", "counter", "NOOPs sent to keep idle SMTP sessions open.", self.keepalives),
+              ("pool_size", "gauge", "Configured number of SMTP sessions.", self.pool_size),
+              ("sessions_open", "gauge", "SMTP sessions currently open.", self.sessions_open),
+              ("sends_in_flight", "gauge", "Messages currently being sent.", self.in_flight),
+          ):
+              lines.append(f"# HELP fastmail_{name} {text}")
+              lines.append(f"# TYPE fastmail_{name} {kind}")
+              lines.append(f"fastmail_{name} {value}")
+      return "\n".join(lines) + "\n"
+
+  def summary(self):
+      """
+      Return a JSON-serializable summary: count, mean and percentiles (ms) per stage,
+      reply codes, bytes, retries, sessions, reconnects, keepalives and attachment cache lookups.
+      """
+      with self.lock:
+          stages = {}
+          for stage, histogram in self.stages.items():
+              entry = {"count": histogram.count}
+              if histogram.count:
+                  entry["mean_ms"] = round(histogram.sum / histogram.count * 1000, 3)
+                  for p in SUMMARY_PERCENTILES:
+                      entry[f"p{p}_ms"] = round(histogram.percentile(p) * 1000, 3)
+              stages[stage] = entry
+          return {
+              "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+              "elapsed_seconds": round(time.time() - self.started, 3),
+              "stages": stages,
+              "replies": {str(code): n for code, n in sorted(self.replies.items())},
+              "sent_by": dict(sorted(self.sent_by.items())),
+              "bytes_sent": self.bytes_sent,
+              "retries": dict(sorted(self.retries.items())),
+              "sessions_opened": self.sessions_opened,
+              "reconnects": self.reconnects,
+              "keepalives": self.keepalives,
+              "attachment_cache": {"hits": self.attachment_cache["hit"], "misses": self.attachment_cache["miss"]},
+              "pool_size": self.pool_size,
+          }
+
+  def write_summary(self, path, **extra):
+      """
+      Write the summary (plus any `extra` fields) as JSON.
+      """
+      os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+      with open(path, "w", encoding="utf-8") as f:
+          json.dump(dict(self.summary(), **extra), f, indent=2)
+
+# ------------------------------------------------------------------------
+# Prometheus Endpoint
+# ------------------------------------------------------------------------
+
+class MetricsServer:
+  """
+  Serves the metrics in the Prometheus text format on http://127.0.0.1:<port>/metrics
+  from a background thread, for the duration of a campaign.
+  """
+
+  def __init__(self, metrics, port, host="127.0.0.1"):
+      # Imported here: only needed when the endpoint is enabled
+      from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+      class Handler(BaseHTTPRequestHandler):
+          def do_GET(self):
+              if self.path.split("?")[0] not in ("/", "/metrics"):
+                  self.send_error(404)
+                  return
+              body = metrics.prometheus().encode("utf-8")
+              self.send_response(200)
+              self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+              self.send_header("Content-Length", str(len(body)))
+              self.end_headers()
+              self.wfile.write(body)
+
+          def log_message(self, format, *args):
+              pass  # No request log
+
+      self.server = ThreadingHTTPServer((host, port), Handler)
+      self.server.daemon_threads = True
+      self.port = self.server.server_address[1]
+      self.thread = None
+
+  def start(self):
+      self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+      self.thread.start()
+      return self
+
+  def stop(self):
+      self.server.shutdown()
+      self.server.server_close()
+      self.thread.join()
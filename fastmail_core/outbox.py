@@ -0,0 +1,878 @@
+"""
+Deliver the campaigns of the outbox: one delivery worker process.
+
+Usage:
+    python -m fastmail_core.outbox [--data-dir DIR] [--workers N]
+
+Started by Fast Mail (see start_workers) as many times as there are delivery
+workers; a worker exits once the outbox has had nothing to send for WORKER_IDLE seconds.
+"""
+# Import required modules
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from fastmail_core.message import Attachment
+from fastmail_core.scheduler import CampaignSchedule, CampaignScheduler
+from fastmail_core.settings import SETTINGS_DIR, load_settings
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+# Folders of a campaign in the outbox, as in a Maildir: entries are written to
+# tmp, renamed into new, claimed by a worker into cur, then moved to sent or
+# failed, or to deferred when they still failed after their last attempt
+# (moved back to new when the campaign is sent again)
+OUTBOX_FOLDERS = ("tmp", "new", "cur", "sent", "failed", "deferred")
+
+# Files of a campaign folder: the settings it is sent with, the error that
+# stopped it, the refused and deferred recipients and one byte per entry moved to sent
+# (progress is read from its size, without listing the folders)
+CAMPAIGN_FILE = "campaign.json"
+ERROR_FILE = "error.txt"
+REFUSALS_FILE = "refusals.jsonl"
+SENT_LOG = "sent.log"
+
+# Fields of a sender profile never written to the outbox: the workers read
+# them from the settings file when they send (see resolve_credentials)
+CREDENTIAL_FIELDS = ("app_password",)
+
+# Environment variable with the app password of an account the settings file has none for
+PASSWORD_VARIABLE = "FASTMAIL_APP_PASSWORD"
+
+# Folder of the worker heartbeat files, named after the worker's process id
+WORKERS_FOLDER = "workers"
+
+# A worker touches its heartbeat file every HEARTBEAT_INTERVAL seconds and is
+# taken for dead (its claimed messages go back to new) after HEARTBEAT_TIMEOUT
+HEARTBEAT_INTERVAL = 5.0
+HEARTBEAT_TIMEOUT = 30.0
+
+# Seconds a worker waits for something to send before it exits
+WORKER_IDLE = 10.0
+
+# Seconds between two looks at the outbox while waiting
+POLL_INTERVAL = 0.5
+
+# Seconds a worker's delivery engine sends the campaigns of one set of sender
+# accounts before campaigns due from other accounts get a turn
+GROUP_SLICE = 60.0
+
+# Names of new read (and sorted) at a time when a worker claims entries:
+# a large spool is never listed whole
+CLAIM_SCAN = 4096
+
+# Entries a worker claims ahead of its SMTP sessions, per session: enough to
+# interleave domain groups, few enough to leave the rest to the other workers
+CLAIM_AHEAD = 4
+
+# ------------------------------------------------------------------------
+# Spool Entries
+# ------------------------------------------------------------------------
+
+def entry_name(index, email):
+  """
+  Spool entry name of the index-th recipient: the index keeps the recipient
+  order, the address hash finds the recipient's entry when the campaign is
+  spooled again.
+  """
+  return f"{index:09d}-{address_hash(email)}"
+
+def address_hash(email):
+  return hashlib.sha256(email.encode("utf-8")).hexdigest()[:24]
+
+def claimed_name(name, worker_id):
+  """
+  Name of an entry in cur: the entry name and the worker that claimed it.
+  """
+  return f"{name}.{worker_id}"
+
+def pack_entry(email, rendered):
+  """
+  Serialize one recipient's message, rendered for each sender account
+  ({sender email: pieces}, see CampaignMessage.render), to a spool entry:
+  a JSON header line describing the pieces, then their bytes. Attachments
+  are stored as references to the file and its encoded part in the
+  attachment cache, not copied into every entry.
+  """
+  accounts = {}
+  blobs = []
+  for sender, pieces in rendered.items():
+      parts = []
+      pending = []
+      for piece in pieces:
+          if isinstance(piece, bytes):
+              pending.append(piece)
+              continue
+          if pending:
+              blobs.append(b"".join(pending))
+              parts.append(len(blobs[-1]))
+              pending = []
+          parts.append([piece.path, piece.encoded_path, piece.encoded_size])
+      if pending:
+          blobs.append(b"".join(pending))
+          parts.append(len(blobs[-1]))
+      accounts[sender] = parts
+  header = json.dumps({"email": str(email), "accounts": accounts})
+  return header.encode("utf-8") + b"\n" + b"".join(blobs)
+
+def entry_email(data):
+  """
+  Recipient address of a spool entry.
+  """
+  return json.loads(data[:data.index(b"\n")])["email"]
+
+def unpack_entry(data, sender, attachments=None):
+  """
+  The pieces of a spool entry's message as sent from `sender`. `attachments`
+  is a dict reused between entries, so each attachment is looked up once.
+  An encoded part no longer in the cache is encoded from the file again.
+  """
+  end = data.index(b"\n")
+  header = json.loads(data[:end])
+  position = end + 1
+  for account, parts in header["accounts"].items():
+      if account != sender:
+          position += sum(part for part in parts if isinstance(part, int))
+          continue
+      pieces = []
+      for part in parts:
+          if isinstance(part, int):
+              pieces.append(data[position:position + part])
+              position += part
+              continue
+          key = tuple(part)
+          attachment = attachments.get(key) if attachments is not None else None
+          if attachment is None:
+              path, encoded_path, encoded_size = part
+              attachment = Attachment(path)
+              if encoded_path and os.path.isfile(encoded_path) and os.path.getsize(encoded_path) == encoded_size:
+                  attachment.encoded_path = encoded_path
+                  attachment.encoded_size = encoded_size
+              if attachments is not None:
+                  attachments[key] = attachment
+          pieces.append(attachment)
+      return pieces
+  raise ValueError(f"The outbox has no message from {sender} to {header['email']}.")
+
+# ------------------------------------------------------------------------
+# Outbox
+# ------------------------------------------------------------------------
+
+def stored_settings(settings):
+  """
+  The settings a campaign folder keeps: the sender profiles without their credentials.
+  """
+  stored = dict(settings)
+  stored["senders"] = [{field: value for field, value in profile.items() if field not in CREDENTIAL_FIELDS}
+                       for profile in settings["senders"]]
+  return stored
+
+def resolve_credentials(settings, data_dir=SETTINGS_DIR):
+  """
+  The settings of a campaign folder with the app password of each sender
+  account filled in from the settings file of `data_dir`, or else from the
+  FASTMAIL_APP_PASSWORD environment variable, as the command line does.
+  Raises ValueError for an account with no password.
+  """
+  saved = load_settings(os.path.join(data_dir, "settings.xml"))
+  passwords = {profile["sender_email"]: profile["app_password"] for profile in saved["senders"]}
+  senders = []
+  for profile in settings["senders"]:
+      password = passwords.get(profile["sender_email"]) or os.getenv(PASSWORD_VARIABLE, "")
+      if not password:
+          raise ValueError(f"{profile['sender_email']}: the saved settings have no app password for the delivery workers. "
+                           "Save the settings first.")
+      senders.append(dict(profile, app_password=password))
+  return dict(settings, senders=senders)
+
+def write_atomically(path, data):
+  """
+  Write a file under a temporary name and rename it, so it is never seen half written.
+  """
+  temp_path = f"{path}.{os.getpid()}.tmp"
+  with open(temp_path, "wb") as f:
+      f.write(data)
+  os.replace(temp_path, path)
+
+class OutboxCampaign:
+  """
+  The folder of one campaign in the outbox, named after its campaign id: the
+  settings it is sent with and one spool entry per recipient, which moves from
+  folder to folder (see OUTBOX_FOLDERS). Moves are renames, so an entry is in
+  exactly one folder and only one worker can claim it.
+  """
+
+  def __init__(self, directory):
+      self.directory = directory
+      self.campaign_id = os.path.basename(directory)
+
+  def path(self, *names):
+      return os.path.join(self.directory, *names)
+
+  def names(self, folder):
+      try:
+          return os.listdir(self.path(folder))
+      except FileNotFoundError:
+          return []
+
+  # --------------------------------------------------------------------
+  # Spooling (the sending app)
+  # --------------------------------------------------------------------
+
+  def create(self, settings, subject, restart=False, schedule=None):
+      """
+      Create or reopen the campaign folder with the settings its workers send
+      with (sender accounts without their passwords, see stored_settings) and
+      its CampaignSchedule, and clear the error that stopped a previous run.
+      Deferred entries are put back in new. `restart` forgets what was already sent.
+      """
+      for folder in OUTBOX_FOLDERS:
+          os.makedirs(self.path(folder), exist_ok=True)
+      if os.path.exists(self.path(ERROR_FILE)):
+          os.remove(self.path(ERROR_FILE))
+      for name in self.names("deferred"):
+          os.replace(self.path("deferred", name), self.path("new", name))
+      if restart:
+          for folder in ("sent", "failed"):
+              for name in self.names(folder):
+                  os.remove(self.path(folder, name))
+          for name in (REFUSALS_FILE, SENT_LOG):
+              if os.path.exists(self.path(name)):
+                  os.remove(self.path(name))
+      campaign = {"subject": subject, "settings": stored_settings(settings), "schedule": (schedule or CampaignSchedule()).to_dict()}
+      write_atomically(self.path(CAMPAIGN_FILE), json.dumps(campaign, indent=2).encode("utf-8"))
+
+  def waiting(self):
+      """
+      Whether entries wait in new; reads no more of the folder than needed.
+      """
+      return self.occupied("new")
+
+  def occupied(self, folder):
+      """
+      Whether a folder has any entry, without listing it.
+      """
+      try:
+          with os.scandir(self.path(folder)) as entries:
+              return any(True for _ in entries)
+      except FileNotFoundError:
+          return False
+
+  def spooled(self):
+      """
+      Address hashes of the recipients that already have an entry (see entry_name).
+      """
+      return {name.split(".")[0].partition("-")[2]
+              for folder in ("new", "cur", "sent", "failed", "deferred") for name in self.names(folder)}
+
+  def add(self, name, data):
+      """
+      Put one entry in the spool: written to tmp, then renamed into new.
+      """
+      with open(self.path("tmp", name), "wb") as f:
+          f.write(data)
+      os.replace(self.path("tmp", name), self.path("new", name))
+
+  # --------------------------------------------------------------------
+  # Delivery (the workers)
+  # --------------------------------------------------------------------
+
+  def load(self):
+      """
+      Return the subject, settings and CampaignSchedule the campaign is sent
+      with. The settings have no credentials (see resolve_credentials).
+      """
+      with open(self.path(CAMPAIGN_FILE), "r", encoding="utf-8") as f:
+          campaign = json.load(f)
+      # Campaigns spooled before schedules existed are sent at once; passwords
+      # of campaigns spooled before they were left out are not used
+      return (campaign["subject"], stored_settings(campaign["settings"]),
+              CampaignSchedule.from_dict(campaign.get("schedule")))
+
+  def claims(self, worker_id):
+      """
+      Move entries from new to cur for a worker, yielding their claimed names
+      as they are taken; ends once new is empty. The folder is read
+      CLAIM_SCAN names at a time, each batch taken in recipient order, so a
+      large spool is never listed or sorted whole. Workers race for entries
+      by renaming them.
+      """
+      while True:
+          found = False
+          try:
+              with os.scandir(self.path("new")) as entries:
+                  while True:
+                      names = sorted(entry.name for entry in itertools.islice(entries, CLAIM_SCAN))
+                      if not names:
+                          break
+                      found = True
+                      for name in names:
+                          claimed = claimed_name(name, worker_id)
+                          try:
+                              os.rename(self.path("new", name), self.path("cur", claimed))
+                          except FileNotFoundError:
+                              continue  # taken by another worker
+                          yield claimed
+          except FileNotFoundError:
+              return
+          if not found:
+              return
+
+  def read(self, claimed):
+      with open(self.path("cur", claimed), "rb") as f:
+          return f.read()
+
+  def finish(self, claimed, status, email=None, reply=None):
+      """
+      Move a claimed entry to sent, or to failed or deferred (by its status)
+      with the refusal logged.
+      """
+      name = claimed.split(".")[0]
+      if status == "sent":
+          os.replace(self.path("cur", claimed), self.path("sent", name))
+          with open(self.path(SENT_LOG), "ab") as f:
+              f.write(b".")
+          return
+      code, detail = reply if reply else (None, None)
+      if isinstance(detail, bytes):
+          detail = detail.decode("utf-8", "replace")
+      with open(self.path(REFUSALS_FILE), "a", encoding="utf-8") as f:
+          f.write(json.dumps({"email": email, "code": code, "reply": detail, "status": status}) + "\n")
+      os.replace(self.path("cur", claimed), self.path("deferred" if status == "deferred" else "failed", name))
+
+  def release(self, claimed):
+      """
+      Put a claimed entry back in new, for any worker to send.
+      """
+      os.replace(self.path("cur", claimed), self.path("new", claimed.split(".")[0]))
+
+  def recover(self, alive):
+      """
+      Put back in new the entries claimed by workers that are not `alive` (worker ids).
+      """
+      for claimed in self.names("cur"):
+          if claimed.partition(".")[2] not in alive:
+              try:
+                  self.release(claimed)
+              except FileNotFoundError:
+                  pass
+
+  def set_error(self, text):
+      with open(self.path(ERROR_FILE), "w", encoding="utf-8") as f:
+          f.write(text)
+
+  def error(self):
+      try:
+          with open(self.path(ERROR_FILE), "r", encoding="utf-8") as f:
+              return f.read()
+      except FileNotFoundError:
+          return None
+
+  def sent_count(self):
+      """
+      Entries moved to sent since the campaign was (re)started, from the size of the sent log.
+      """
+      try:
+          return os.path.getsize(self.path(SENT_LOG))
+      except FileNotFoundError:
+          return 0
+
+  def in_flight(self):
+      """
+      Entries claimed by the workers; cur never holds more than they claim ahead.
+      """
+      return len(self.names("cur"))
+
+  def progress_mark(self):
+      """
+      Where progress reported from now on starts (see watch_campaign): the
+      sizes of the sent log and of the refusals file.
+      """
+      try:
+          refusals = os.path.getsize(self.path(REFUSALS_FILE))
+      except FileNotFoundError:
+          refusals = 0
+      return self.sent_count(), refusals
+
+class Outbox:
+  """
+  A Maildir-style outbox on disk: one OutboxCampaign folder per campaign,
+  plus the heartbeat files of the delivery workers. Everything in it survives
+  the app closing or crashing: workers pick up where they stopped.
+  """
+
+  def __init__(self, directory):
+      self.directory = directory
+      os.makedirs(os.path.join(directory, WORKERS_FOLDER), exist_ok=True)
+
+  def campaign(self, campaign_id):
+      return OutboxCampaign(os.path.join(self.directory, campaign_id))
+
+  def campaigns(self):
+      """
+      The campaigns with entries waiting in new, oldest first, except those
+      stopped by an error.
+      """
+      campaigns = []
+      for name in os.listdir(self.directory):
+          campaign = self.campaign(name)
+          if name == WORKERS_FOLDER or not os.path.isfile(campaign.path(CAMPAIGN_FILE)):
+              continue
+          if campaign.waiting() and campaign.error() is None:
+              campaigns.append((os.path.getmtime(campaign.path(CAMPAIGN_FILE)), campaign))
+      return [campaign for mtime, campaign in sorted(campaigns, key=lambda item: item[0])]
+
+  def heartbeat_path(self, worker_id):
+      return os.path.join(self.directory, WORKERS_FOLDER, str(worker_id))
+
+  def heartbeat(self, worker_id):
+      """
+      Mark a worker as alive.
+      """
+      with open(self.heartbeat_path(worker_id), "w"):
+          pass
+
+  def alive_workers(self):
+      """
+      Ids of the workers whose heartbeat is recent; stale heartbeat files are removed.
+      """
+      alive = set()
+      now = time.time()
+      for worker_id in os.listdir(os.path.join(self.directory, WORKERS_FOLDER)):
+          path = self.heartbeat_path(worker_id)
+          try:
+              if now - os.path.getmtime(path) < HEARTBEAT_TIMEOUT:
+                  alive.add(worker_id)
+              else:
+                  os.remove(path)
+          except FileNotFoundError:
+              pass
+      return alive
+
+  def recover(self):
+      """
+      Put back in new the entries claimed by workers that died.
+      """
+      alive = self.alive_workers()
+      for name in os.listdir(self.directory):
+          if name != WORKERS_FOLDER and os.path.isdir(os.path.join(self.directory, name)):
+              self.campaign(name).recover(alive)
+
+# ------------------------------------------------------------------------
+# Delivery Workers
+# ------------------------------------------------------------------------
+
+class OutboxRecipient(str):
+  """
+  A recipient address taken from the outbox, with the campaign, claimed name
+  and data of its spool entry: campaigns sent by one delivery engine can
+  share an address, so outcomes are matched to entries through the address
+  object the engine hands back.
+  """
+
+  def __new__(cls, email, campaign, claimed, data):
+      recipient = super().__new__(cls, email)
+      recipient.campaign = campaign
+      recipient.claimed = claimed
+      recipient.data = data
+      return recipient
+
+class OutboxJournal:
+  """
+  The journal a worker's delivery engine records outcomes in: records them in
+  the send journal of the recipient's campaign and moves its entry to sent, failed or deferred.
+  """
+
+  def __init__(self, journals, claimed):
+      self.journals = journals  # campaign id -> SendJournal
+      self.claimed = claimed  # (campaign id, claimed entry name) of the entries not sent yet
+
+  def record(self, email, status, reply=None, sender=None):
+      campaign = email.campaign
+      self.journals[campaign.campaign_id].record(email, status, reply, sender)
+      self.claimed.discard((campaign.campaign_id, email.claimed))
+      campaign.finish(email.claimed, status, email, reply)
+
+class DiscardProgress:
+  """
+  Progress queue of a worker: the app follows the outbox folders instead.
+  """
+
+  def put(self, message):
+      pass
+
+def delivery_key(settings):
+  """
+  What campaigns must have in common to be sent by the same delivery engine,
+  sharing its SMTP sessions and rate limits: sender accounts, delivery engine and domain limits.
+  """
+  return json.dumps([settings["senders"], settings["delivery_engine"], settings["domain_limits"]], sort_keys=True)
+
+class OutboxWorker:
+  """
+  One delivery worker process: sends the campaigns of the outbox with the
+  delivery engine of their settings, claiming entries from new as its SMTP
+  sessions need them. Several workers share the outbox; each sends from every
+  account of a campaign with that account's SMTP connections, and an equal
+  share of its rate limits and of the domain limits (`shares` is the number
+  of workers).
+
+  Campaigns are queued in a CampaignScheduler: each starts at its start time
+  and sends within its sending windows, and the campaigns sending from the
+  same accounts share one delivery engine, taking turns by weighted fair
+  queuing. Campaigns sending from other accounts get the worker after GROUP_SLICE seconds.
+  """
+
+  def __init__(self, data_dir=SETTINGS_DIR, shares=1, worker_id=None, clock=time.time):
+      self.data_dir = data_dir
+      self.outbox = Outbox(os.path.join(data_dir, "outbox"))
+      self.shares = max(1, shares)
+      self.worker_id = str(worker_id or os.getpid())
+      self.stop_event = threading.Event()
+      self.scheduler = CampaignScheduler(clock)
+      self.campaigns = {}  # campaign id -> (OutboxCampaign, subject, settings) of the scheduled campaigns
+
+  def run(self):
+      """
+      Send until the outbox has had nothing to send or schedule for WORKER_IDLE seconds.
+      """
+      self.outbox.heartbeat(self.worker_id)
+      beating = threading.Thread(target=self.beat, daemon=True)
+      beating.start()
+      try:
+          idle_since = time.monotonic()
+          while len(self.scheduler) or time.monotonic() - idle_since < WORKER_IDLE:
+              self.outbox.recover()
+              self.refresh()
+              campaign_id = self.scheduler.peek()
+              if campaign_id is None:
+                  # Nothing due: campaigns wait for their start time or sending window
+                  time.sleep(POLL_INTERVAL)
+                  continue
+              self.deliver(delivery_key(self.campaigns[campaign_id][2]))
+              idle_since = time.monotonic()
+      finally:
+          self.stop_event.set()
+          beating.join()
+          try:
+              os.remove(self.outbox.heartbeat_path(self.worker_id))
+          except FileNotFoundError:
+              pass
+
+  def beat(self):
+      while not self.stop_event.wait(HEARTBEAT_INTERVAL):
+          self.outbox.heartbeat(self.worker_id)
+
+  def refresh(self):
+      """
+      Queue the campaigns of the outbox with entries waiting, and forget those
+      with none left or stopped by an error.
+      """
+      waiting = {campaign.campaign_id: campaign for campaign in self.outbox.campaigns()}
+      for campaign_id in list(self.campaigns):
+          if campaign_id not in waiting:
+              self.forget(campaign_id)
+      for campaign_id, campaign in waiting.items():
+          if campaign_id in self.scheduler:
+              continue
+          try:
+              subject, settings, schedule = campaign.load()
+          except (OSError, ValueError):
+              continue  # being written by the app
+          self.campaigns[campaign_id] = (campaign, subject, settings)
+          self.scheduler.add(campaign_id, schedule)
+
+  def group(self, key):
+      """
+      Ids of the scheduled campaigns whose settings have this delivery_key.
+      """
+      return {campaign_id for campaign_id, (_, _, settings) in self.campaigns.items()
+              if delivery_key(settings) == key}
+
+  def forget(self, campaign_id):
+      self.scheduler.remove(campaign_id)
+      self.campaigns.pop(campaign_id, None)
+
+  def deliver(self, key):
+      """
+      Send the due campaigns whose settings have this delivery_key with one
+      delivery engine, in the order the scheduler gives, until none has
+      entries left in new or its turn is over. An error that stops the engine
+      is written to the folders of the campaigns it was sending, for the app
+      to show; the entries still claimed go back to new.
+      """
+      # Imported here: the worker's command line parses without them
+      from fastmail_core.domains import parse_domain_limits, share_domain_limits
+      from fastmail_core.journal import SendJournal
+      from fastmail_core.metrics import DeliveryMetrics, MetricsServer
+      from fastmail_core.pool import SMTPPool
+      from fastmail_core.senders import SenderAccount
+
+      group = self.group(key)
+      settings = self.campaigns[next(iter(group))][2]
+      claimed = set()  # (campaign id, claimed entry name) of the entries not sent yet
+      journals = {}  # campaign id -> SendJournal of the campaigns sent
+      attachments = {}
+
+      def recipients():
+          claims = {}  # campaign id -> claims generator
+          started = refreshed = time.monotonic()
+          while True:
+              now = time.monotonic()
+              if now - refreshed >= POLL_INTERVAL:
+                  refreshed = now
+                  self.refresh()
+                  group.update(self.group(key))
+                  # Campaigns sending from other accounts get their turn
+                  if now - started >= GROUP_SLICE and self.scheduler.peek() not in group:
+                      return
+              campaign_id = self.scheduler.next(group)
+              if campaign_id is None:
+                  return
+              campaign, subject, _ = self.campaigns[campaign_id]
+              if campaign_id not in claims:
+                  claims[campaign_id] = campaign.claims(self.worker_id)
+              name = next(claims[campaign_id], None)
+              if name is None:
+                  del claims[campaign_id]
+                  self.forget(campaign_id)  # nothing left to claim; queued again if entries come back
+                  continue
+              if campaign_id not in journals:
+                  journals[campaign_id] = SendJournal(os.path.join(self.data_dir, "journal.sqlite3"), campaign_id,
+                                                      subject)
+              data = campaign.read(name)
+              claimed.add((campaign_id, name))
+              yield name, OutboxRecipient(entry_email(data), campaign, name, data)
+
+      def render(name, email, account):
+          return unpack_entry(email.data, account.sender_email, attachments)
+
+      metrics = DeliveryMetrics()
+      metrics_server = None
+      try:
+          # Credentials are read at run time, never from the outbox
+          settings = resolve_credentials(settings, self.data_dir)
+          accounts = [SenderAccount.from_profile(profile, self.shares) for profile in settings["senders"]]
+          domain_limits = share_domain_limits(parse_domain_limits(settings["domain_limits"]), self.shares)
+          if settings.get("metrics_port"):
+              try:
+                  metrics_server = MetricsServer(metrics, int(settings["metrics_port"])).start()
+              except OSError:
+                  pass  # served by another worker
+          outcomes = OutboxJournal(journals, claimed)
+          window = CLAIM_AHEAD * sum(account.connections for account in accounts)
+          if settings["delivery_engine"] == "asyncio":
+              from fastmail_core.aiosmtp import AsyncSMTPEngine
+              engine = AsyncSMTPEngine(accounts, DiscardProgress(), outcomes, domain_limits, metrics,
+                                       dispatch_window=window)
+          else:
+              engine = SMTPPool(accounts, DiscardProgress(), outcomes, domain_limits, metrics, window)
+          engine.run(recipients(), render)
+      except Exception as e:
+          # The campaigns it was sending, or all it was started for if it failed before taking a message
+          for campaign_id in set(journals) or group:
+              self.outbox.campaign(campaign_id).set_error(str(e) or type(e).__name__)
+              self.forget(campaign_id)
+      finally:
+          for campaign_id, name in claimed:
+              try:
+                  self.outbox.campaign(campaign_id).release(name)
+              except FileNotFoundError:
+                  pass
+          if metrics_server is not None:
+              metrics_server.stop()
+          for journal in journals.values():
+              journal.close()
+          if journals:
+              summary_path = os.path.join(self.data_dir, "metrics",
+                                          f"{time.strftime('%Y%m%d-%H%M%S')}-outbox-{self.worker_id}.json")
+              metrics.write_summary(summary_path, campaigns=sorted(journals),
+                                    delivery_engine=settings["delivery_engine"], worker=self.worker_id)
+
+def worker_command(data_dir, workers):
+  """
+  Command line of a delivery worker process. The packaged app is its own
+  worker (see the start of fastMail.py).
+  """
+  arguments = ["--data-dir", data_dir, "--workers", str(workers)]
+  if getattr(sys, "frozen", False):
+      return [sys.executable, "--outbox-worker"] + arguments
+  return [sys.executable, "-m", "fastmail_core.outbox"] + arguments
+
+def start_workers(data_dir, workers):
+  """
+  Start delivery worker processes until `workers` are running. They are
+  detached: they keep sending when the app is closed. Returns how many were started.
+  """
+  outbox = Outbox(os.path.join(data_dir, "outbox"))
+  missing = workers - len(outbox.alive_workers())
+  options = {}
+  if os.name == "nt":
+      options["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.CREATE_NO_WINDOW
+  else:
+      options["start_new_session"] = True
+  for _ in range(max(0, missing)):
+      process = subprocess.Popen(worker_command(data_dir, workers),
+                                 cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                 **options)
+      # Counted as running at once, before it has started up
+      outbox.heartbeat(process.pid)
+  return max(0, missing)
+
+# ------------------------------------------------------------------------
+# Sending Through the Outbox
+# ------------------------------------------------------------------------
+
+def spool_campaign(subject, email_body, attachment_paths, to_list, settings, journal, data_dir=SETTINGS_DIR,
+                   restart=False, attachment_cache_dir=None, schedule=None, spooling=None):
+  """
+  Render the message of every recipient into the campaign's folder of the
+  outbox, once per sender account (the workers pick the account when they
+  send), and return the OutboxCampaign and the number of recipients it has
+  to send to. Recipients the journal has a final outcome for, or that are
+  already in the spool, are skipped, unless `restart` forgets what was sent.
+  The workers send it as its CampaignSchedule allows (at once by default).
+  `spooling(campaign)` is called once the first entry is spooled, so the
+  workers can start sending while the rest is rendered.
+  """
+  from fastmail_core.campaign import campaign_attachments, closing_footer
+  from fastmail_core.dkim import DKIMSigner
+  from fastmail_core.message import CampaignMessage
+  from fastmail_core.template import check_fields
+
+  profiles = settings["senders"]
+  if not profiles:
+      raise ValueError("No sender account is set up.")
+  # The workers must find the same passwords in the settings file
+  resolved = resolve_credentials(stored_settings(settings), data_dir)
+  for profile, given in zip(resolved["senders"], profiles):
+      if given.get("app_password") and given["app_password"] != profile["app_password"]:
+          raise ValueError(f"{profile['sender_email']}: the app password differs from the saved settings. "
+                           "Save the settings first: the delivery workers read it from there.")
+  attachments = campaign_attachments(attachment_paths, attachment_cache_dir)
+  messages = {
+      profile["sender_email"]: CampaignMessage(subject, email_body, profile["sender_email"], attachments,
+                                               DKIMSigner.from_profile(profile))
+      for profile in profiles
+  }
+  message = messages[profiles[0]["sender_email"]]
+  check_fields((message.subject, message.body), getattr(to_list, "fields", ()))
+
+  campaign = Outbox(os.path.join(data_dir, "outbox")).campaign(journal.campaign_id)
+  campaign.create(settings, subject, restart, schedule)
+  completed = journal.completed()
+  spooled = campaign.spooled()
+  count = len(campaign.names("new")) + len(campaign.names("cur"))
+  for i, email in enumerate(to_list):
+      if email in completed or address_hash(email) in spooled:
+          continue
+      fields = getattr(email, "fields", None)
+      rendered = {sender: message.render(email, closing_footer(sender, i), fields)
+                  for sender, message in messages.items()}
+      campaign.add(entry_name(i, email), pack_entry(email, rendered))
+      if spooling is not None:
+          spooling(campaign)
+          spooling = None  # only for the first entry
+      count += 1
+  return campaign, count
+
+def watch_campaign(campaign, total, progress_queue, restart_workers=None, since=None):
+  """
+  Report a campaign's progress through `progress_queue`, from its outbox
+  folders, until every entry is sent or refused or an error stops it.
+  `restart_workers()` is called whenever entries wait with no worker alive.
+  Progress is counted from `since`, a progress_mark() of the campaign (by default taken now).
+  """
+  outbox = Outbox(os.path.dirname(campaign.directory))
+  # Only sizes are read while following: the folders are never listed whole.
+  # Sends and refusals of earlier runs are not reported
+  sent_before, refusals = since or campaign.progress_mark()
+  progress_queue.put({'total_emails': total})
+  sent = failed = 0
+  while True:
+      in_flight = campaign.in_flight()
+      if campaign.sent_count() - sent_before != sent:
+          sent = campaign.sent_count() - sent_before
+          progress_queue.put({'emails_sent': sent, 'in_flight': in_flight})
+      if os.path.exists(campaign.path(REFUSALS_FILE)):
+          with open(campaign.path(REFUSALS_FILE), "rb") as f:
+              f.seek(refusals)
+              lines = f.read().split(b"\n")
+          for line in lines[:-1]:
+              refusals += len(line) + 1
+              refusal = json.loads(line)
+              failed += 1
+              progress_queue.put({'emails_failed': failed, 'failed_email': refusal["email"],
+                                  'reply': (refusal["code"], refusal["reply"]),
+                                  'deferred': refusal.get("status") == "deferred", 'in_flight': in_flight})
+      error = campaign.error()
+      if error is not None:
+          progress_queue.put({'status': 'error', 'error': error})
+          return
+      # new is looked at before and after cur: an entry moving between them meanwhile is seen
+      if not campaign.waiting() and not campaign.in_flight() and not campaign.waiting():
+          progress_queue.put({'status': 'done'})
+          return
+      if restart_workers is not None and not outbox.alive_workers():
+          restart_workers()
+      time.sleep(POLL_INTERVAL)
+
+def send_to_outbox(subject, email_body, attachment_paths, to_list, settings, progress_queue, journal,
+                   data_dir=SETTINGS_DIR, restart=False, attachment_cache_dir=None, schedule=None, follow=True):
+  """
+  Send a campaign through the outbox: render every message into it, start
+  the delivery worker processes of the settings as soon as the first one is
+  spooled and report their progress through `progress_queue` until the
+  campaign is done, or only queue it when not `follow`. The workers send it as its CampaignSchedule allows and keep
+  sending if the caller goes away; sending the campaign again resumes it.
+  An error is put on the progress queue before it is raised. The journal is
+  closed once the messages are spooled (the workers keep their own).
+  """
+  workers = int(settings.get("delivery_workers") or 1)
+  marks = []
+
+  def spooling(campaign):
+      # Delivery overlaps the rendering of the rest, and is followed from here
+      marks.append(campaign.progress_mark())
+      start_workers(data_dir, workers)
+
+  try:
+      try:
+          campaign, total = spool_campaign(subject, email_body, attachment_paths, to_list, settings, journal,
+                                           data_dir, restart, attachment_cache_dir, schedule, spooling)
+      finally:
+          journal.close()
+      # Also when nothing new was spooled: entries of an earlier run may wait
+      start_workers(data_dir, workers)
+      if not follow:
+          progress_queue.put({'total_emails': total})
+          return
+      watch_campaign(campaign, total, progress_queue, lambda: start_workers(data_dir, workers),
+                     marks[0] if marks else None)
+  except Exception as e:
+      progress_queue.put({'status': 'error', 'error': str(e) or type(e).__name__})
+      raise
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog="python -m fastmail_core.outbox", description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--data-dir", default=SETTINGS_DIR, help="directory of the outbox and the send journal")
+  parser.add_argument("--workers", type=int, default=1,
+                      help="number of workers sharing the outbox (rate and domain limits are split between them)")
+  args = parser.parse_args(argv)
+  try:
+      OutboxWorker(args.data_dir, args.workers).run()
+  except KeyboardInterrupt:
+      return 130
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
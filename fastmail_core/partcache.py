@@ -0,0 +1,211 @@
+# Import required modules
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from fastmail_core.message import BASE64_LINE, Attachment
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS parts (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+# Size limit of the encoded parts kept; the least recently used go first
+ATTACHMENT_CACHE_BYTES = 1024 ** 3
+
+# Files are hashed this many bytes at a time
+HASH_CHUNK = 1024 * 1024
+
+# Extension of the encoded parts in the cache directory
+PART_SUFFIX = ".b64"
+
+# ------------------------------------------------------------------------
+# Attachment Cache
+# ------------------------------------------------------------------------
+
+def content_hash(path):
+  """
+  SHA-256 of a file's content, hex-encoded.
+  """
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+      for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+          digest.update(chunk)
+  return digest.hexdigest()
+
+def part_key(file_hash, attachment):
+  """
+  Cache key of an attachment's encoded part: the content hash and the MIME
+  parameters the encoding is written with. The file name is not part of it,
+  so the same file attached under another name is a hit.
+  """
+  parameters = f"{attachment.maintype}/{attachment.subtype}; base64; {BASE64_LINE}"
+  return hashlib.sha256(f"{file_hash}\0{parameters}".encode("utf-8")).hexdigest()
+
+class AttachmentCache:
+  """
+  A persistent, content-addressed cache of base64-encoded attachment parts,
+  shared by every campaign: a file sent again, even after a restart, is
+  streamed from its encoded part instead of being encoded for each message.
+
+  The encoded parts are files in `directory`, indexed in SQLite with their
+  size and when they were last used; past `max_bytes` the least recently used
+  are removed. Each source file's content hash is kept with its mtime and size,
+  so an unchanged file is not read again, and a changed one is hashed and
+  encoded again.
+  """
+
+  def __init__(self, directory, max_bytes=ATTACHMENT_CACHE_BYTES):
+      self.directory = directory
+      self.max_bytes = max_bytes
+      os.makedirs(directory, exist_ok=True)
+      self.lock = threading.Lock()
+      self.connection = sqlite3.connect(os.path.join(directory, "index.sqlite3"),
+                                        check_same_thread=False, isolation_level=None)
+      self.connection.execute("PRAGMA journal_mode=WAL")
+      self.connection.executescript(SCHEMA)
+      self.hits = 0
+      self.misses = 0
+      self.in_use = set()  # keys of the parts handed out: never evicted by this cache
+
+  def part_path(self, key):
+      return os.path.join(self.directory, key + PART_SUFFIX)
+
+  # --------------------------------------------------------------------
+  # Lookup
+  # --------------------------------------------------------------------
+
+  def attachment(self, path):
+      """
+      Return the Attachment for a file, streamed from its encoded part, which
+      is encoded into the cache first on a miss. If the cache cannot be read or
+      written the Attachment is encoded while it is sent, as without a cache.
+      """
+      attachment = Attachment(path)
+      try:
+          with self.lock:
+              key = part_key(self.source_hash(path), attachment)
+              part_path = self.part_path(key)
+              row = self.connection.execute("SELECT size FROM parts WHERE key = ?", (key,)).fetchone()
+              if row is not None and os.path.isfile(part_path) and os.path.getsize(part_path) == row[0]:
+                  self.hits += 1
+                  self.count("hits")
+                  size = row[0]
+              else:
+                  self.misses += 1
+                  self.count("misses")
+                  size = self.store(attachment, part_path)
+              self.connection.execute("INSERT OR REPLACE INTO parts (key, size, last_used) VALUES (?, ?, ?)",
+                                      (key, size, time.time()))
+              self.in_use.add(key)
+              self.evict()
+      except (OSError, sqlite3.Error):
+          return attachment
+      attachment.encoded_path = part_path
+      attachment.encoded_size = size
+      return attachment
+
+  def source_hash(self, path):
+      """
+      Content hash of a file, read again only if its mtime or size changed.
+      """
+      path = os.path.abspath(path)
+      stat = os.stat(path)
+      row = self.connection.execute("SELECT mtime_ns, size, content_hash FROM sources WHERE path = ?",
+                                    (path,)).fetchone()
+      if row is not None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+          return row[2]
+      file_hash = content_hash(path)
+      self.connection.execute(
+          "INSERT OR REPLACE INTO sources (path, mtime_ns, size, content_hash) VALUES (?, ?, ?, ?)",
+          (path, stat.st_mtime_ns, stat.st_size, file_hash))
+      return file_hash
+
+  def store(self, attachment, part_path):
+      """
+      Encode an attachment into the cache and return the encoded size. The part
+      is written under a temporary name and renamed, so a part is never seen half written.
+      """
+      temp_path = f"{part_path}.{os.getpid()}.tmp"
+      try:
+          with open(temp_path, "wb") as f:
+              for chunk in attachment.encode():
+                  f.write(chunk)
+          os.replace(temp_path, part_path)
+      except BaseException:
+          if os.path.exists(temp_path):
+              os.remove(temp_path)
+          raise
+      return os.path.getsize(part_path)
+
+  # --------------------------------------------------------------------
+  # Size Limit and Statistics
+  # --------------------------------------------------------------------
+
+  def evict(self):
+      """
+      Remove the least recently used parts until the cache fits in max_bytes.
+      The parts this cache handed out are kept. Another cache (another campaign,
+      process or outbox worker) may remove a part still being sent: the
+      Attachment then encodes its file again (see Attachment.cached).
+      """
+      total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM parts").fetchone()[0]
+      if total <= self.max_bytes:
+          return
+      for key, size in self.connection.execute("SELECT key, size FROM parts ORDER BY last_used").fetchall():
+          if total <= self.max_bytes:
+              break
+          if key in self.in_use:
+              continue
+          try:
+              os.remove(self.part_path(key))
+          except FileNotFoundError:
+              pass
+          except OSError:
+              continue  # still mapped by a campaign being sent (Windows)
+          self.connection.execute("DELETE FROM parts WHERE key = ?", (key,))
+          total -= size
+
+  def count(self, name):
+      self.connection.execute(
+          "INSERT INTO meta (key, value) VALUES (?, 1) ON CONFLICT(key) DO UPDATE SET value = value + 1", (name,))
+
+  def stats(self):
+      """
+      Hits and misses of this cache and of every run so far, and the parts kept.
+      """
+      with self.lock:
+          totals = dict(self.connection.execute("SELECT key, value FROM meta"))
+          entries, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM parts").fetchone()
+      return {
+          "hits": self.hits,
+          "misses": self.misses,
+          "total_hits": totals.get("hits", 0),
+          "total_misses": totals.get("misses", 0),
+          "entries": entries,
+          "bytes": size,
+          "max_bytes": self.max_bytes,
+      }
+
+  def close(self):
+      with self.lock:
+          self.connection.close()
@@ -0,0 +1,258 @@
+# Import required modules
+import smtplib
+import threading
+import time
+
+from fastmail_core.domains import DISPATCH_WINDOW, TAKE_DONE, TAKE_ITEM
+from fastmail_core.engine import DeliveryEngine
+from fastmail_core.esmtp import TLSSessionCache, WorkerSession, message_size, pipelined_sendmail
+from fastmail_core.retry import MAX_RECONNECT_ATTEMPTS
+
+# ------------------------------------------------------------------------
+# SMTP Sessions
+# ------------------------------------------------------------------------
+
+def open_smtp_session(smtp_server, sender_email, app_password, port=587, use_starttls=True, metrics=None,
+                      tls_context=None):
+  """
+  Open an SMTP connection (port 587 by default), upgrade it with STARTTLS and log in.
+  With a TLSSessionCache as `tls_context`, the TLS session of the previous connection
+  is resumed when the server allows it.
+  When `metrics` is given, the connect, STARTTLS (full or resumed) and login stages are timed.
+  """
+  started = time.perf_counter()
+  smtp_session = smtplib.SMTP(smtp_server, port)
+  connected = time.perf_counter()
+  try:
+      if use_starttls:
+          smtp_session.starttls(context=tls_context)
+      secured = time.perf_counter()
+      smtp_session.login(sender_email, app_password)
+  except BaseException:
+      smtp_session.close()
+      raise
+  resumed = use_starttls and isinstance(tls_context, TLSSessionCache) and tls_context.remember(smtp_session.sock)
+  if metrics is not None:
+      metrics.observe("connect", connected - started)
+      if use_starttls:
+          metrics.observe("starttls_resumed" if resumed else "starttls", secured - connected)
+      metrics.observe("login", time.perf_counter() - secured)
+  return smtp_session
+
+# ------------------------------------------------------------------------
+# Connection Pool
+# ------------------------------------------------------------------------
+
+class SMTPPool(DeliveryEngine):
+  """
+  A pool of authenticated SMTP sessions, each driven by its own worker thread
+  (see DeliveryEngine for how sessions share recipients and accounts).
+  Every session is opened as soon as the pool starts and kept open for the
+  whole campaign: a NOOP keeps it alive while its worker waits, and it is
+  only opened again (resuming its account's TLS session) when it was lost or
+  closed for a long wait.
+  """
+
+  def __init__(self, accounts, progress_queue, journal=None, domain_limits=None, metrics=None,
+               dispatch_window=DISPATCH_WINDOW):
+      super().__init__(accounts, progress_queue, journal, domain_limits, metrics, dispatch_window)
+      self.stop_event = threading.Event()
+      self.errors = []
+
+  def connect(self, account, reconnect=False):
+      """
+      Open one authenticated session of an account for a worker.
+      """
+      smtp_session = open_smtp_session(account.smtp_server, account.sender_email, account.app_password,
+                                       account.port, account.use_starttls, self.metrics, account.tls_context)
+      self.metrics.session_opened(reconnect)
+      return smtp_session
+
+  def run(self, recipients, render):
+      """
+      Send to every (index, email) pair in `recipients` and block until the pool is done.
+      `recipients` may be a generator: the dispatcher reads it lazily, at most
+      `dispatch_window` recipients ahead.
+      `render(index, email, account)` returns the message bytes for one recipient,
+      sent from the given SenderAccount.
+      The first error raised by a worker stops the pool and is re-raised here.
+      """
+      workers = [threading.Thread(target=self.worker, args=(account, render), daemon=True)
+                 for account in self.start(recipients)]
+      for worker in workers:
+          worker.start()
+      try:
+          for worker in workers:
+              worker.join()
+      finally:
+          self.stop_event.set()
+          self.dispatcher.close()
+          self.rotation.close()
+
+      if self.errors:
+          raise self.errors[0]
+
+  def next_recipient(self, session=None):
+      """
+      Take the next (index, email, attempt, group) from the dispatcher, waiting while
+      every group with pending recipients is at its limits. Returns None when done.
+      The worker's session is kept alive meanwhile.
+      """
+      while not self.stop_event.is_set():
+          kind, value, changes = self.dispatcher.take()
+          if kind == TAKE_ITEM:
+              return value
+          if kind == TAKE_DONE:
+              return None
+          self.report_delay(value)
+          self.dispatcher.wait(self.keep_alive(session, value), changes)
+      return None
+
+  def keep_alive(self, session, wait):
+      """
+      Look after a worker's session before it waits `wait` seconds (None: until
+      woken), see DeliveryEngine.idle_plan; a session the server does not answer
+      is dropped. Returns how long to wait before the next check.
+      """
+      plan = self.idle_plan(session, wait)
+      if plan == "close":
+          self.close_session(session)
+          return wait
+      if plan == "noop":
+          try:
+              code, message = session.connection.noop()
+              if code != 250:
+                  raise smtplib.SMTPResponseException(code, message)
+              session.used()
+              self.metrics.keepalive()
+          except (smtplib.SMTPException, OSError):
+              self.drop_session(session)
+              return wait
+      return self.idle_wait(session, wait)
+
+  def close_session(self, session):
+      """
+      Say QUIT on a worker's session and forget it.
+      """
+      smtp_session = session.detach()
+      if smtp_session is not None:
+          self.metrics.session_closed()
+          try:
+              smtp_session.quit()
+          except (smtplib.SMTPException, OSError):
+              smtp_session.close()
+
+  def drop_session(self, session):
+      """
+      Forget a worker's session that was lost, closing its socket.
+      """
+      smtp_session = session.detach()
+      if smtp_session is not None:
+          self.metrics.session_closed()
+          smtp_session.close()
+
+  def deliver(self, smtp_session, account, email, data):
+      """
+      Send one rendered message on a session, pipelining the SMTP commands when
+      the server supports it, and record its transfer time, size and reply code.
+      """
+      mail_options = () if email.isascii() else ("SMTPUTF8",)
+      started = time.perf_counter()
+      try:
+          pipelined_sendmail(smtp_session, account.sender_email, [email], data, mail_options)
+      except smtplib.SMTPException as e:
+          self.observe_failure(email, e)
+          raise
+      self.metrics.observe("transfer", time.perf_counter() - started)
+      self.metrics.reply(250, message_size(data), account.sender_email)
+
+  def worker(self, account, render):
+      """
+      Worker loop: one SMTP session of an account, paced by the sender rotation.
+      The session is opened as soon as the worker starts, and opened again if it
+      is lost; the recipient in hand is then sent again on the new session.
+      """
+      session = WorkerSession()
+      try:
+          smtp_session = self.open_session(account)
+          if smtp_session is not None:
+              session.attach(smtp_session)
+          while not self.stop_event.is_set():
+              item = self.next_recipient(session)
+              if item is None:
+                  break
+              i, email, attempt, group = item
+              try:
+                  self.wait_for_turn(account, session)
+                  if self.stop_event.is_set():
+                      break
+                  if session.connection is None:
+                      # Lost, or closed during a long wait
+                      smtp_session = self.open_session(account, reconnect=session.opened)
+                      if smtp_session is None:
+                          break
+                      session.attach(smtp_session)
+
+                  started = time.perf_counter()
+                  error = latency = None
+                  self.begin_send()
+                  try:
+                      data = render(i, email, account)
+                      self.metrics.observe("build", time.perf_counter() - started)
+                      try:
+                          self.deliver(session.connection, account, email, data)
+                          latency = time.perf_counter() - started
+                      except (smtplib.SMTPException, OSError) as e:
+                          error = e
+                  finally:
+                      self.end_send()
+                      self.rotation.finished(account)
+                      session.used()
+
+                  if self.settle(account, item, error, latency):
+                      # The session is gone: open a new one for the next recipient
+                      self.drop_session(session)
+              finally:
+                  self.dispatcher.finish(group)
+      except Exception as e:
+          with self.lock:
+              self.errors.append(e)
+          self.stop_event.set()
+          self.dispatcher.close()
+      finally:
+          self.close_session(session)
+
+  def open_session(self, account, reconnect=False):
+      """
+      Open a session of an account, trying again with backoff while the failure
+      is transient or a connection error (see DeliveryEngine.reconnect_delay).
+      Returns None if the pool is stopped meanwhile.
+      """
+      for attempt in range(1, MAX_RECONNECT_ATTEMPTS + 1):
+          try:
+              return self.connect(account, reconnect)
+          except (smtplib.SMTPException, OSError) as e:
+              delay = self.reconnect_delay(attempt, e)
+          if self.stop_event.wait(delay):
+              return None
+          reconnect = True
+
+  def wait_for_turn(self, account, session=None):
+      """
+      Wait for the account's next send slot from the rotation, reporting long waits.
+      The worker's session is kept alive meanwhile.
+      """
+      self.rotation.arrive(account)
+      try:
+          while not self.stop_event.is_set():
+              ready, delay, changes = self.rotation.turn(account)
+              if not ready:
+                  self.report_delay(delay)
+                  self.rotation.wait(self.keep_alive(session, delay), changes)
+                  continue
+              if delay:
+                  # The jitter of the reserved slot
+                  self.stop_event.wait(delay)
+              return
+      finally:
+          self.rotation.leave(account)
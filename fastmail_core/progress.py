@@ -0,0 +1,148 @@
+# Import required modules
+import collections
+import queue
+import time
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+# Seconds of history used for the messages/sec rate (and so the ETA)
+RATE_WINDOW = 10.0
+
+# Weight of the newest send in the moving-average latency
+LATENCY_SMOOTHING = 0.05
+
+# ------------------------------------------------------------------------
+# Progress State
+# ------------------------------------------------------------------------
+
+def format_duration(seconds):
+  """
+  Format a duration as '45s', '3m 05s' or '1h 02m'.
+  """
+  seconds = int(seconds)
+  if seconds < 60:
+      return f"{seconds}s"
+  if seconds < 3600:
+      return f"{seconds // 60}m {seconds % 60:02d}s"
+  return f"{seconds // 3600}h {seconds // 60 % 60:02d}m"
+
+class ProgressState:
+  """
+  One snapshot of a campaign's progress, folded from the events the delivery
+  engines put on the progress queue: counts, sends in flight, the current
+  rate-limit wait, a moving-average send latency, messages/sec and an ETA.
+  Folding an event is O(1), so the whole queue can be drained on every tick.
+  """
+
+  def __init__(self, clock=time.monotonic):
+      self.clock = clock
+      self.total = 0
+      self.sent = 0
+      self.failed = 0
+      self.in_flight = 0
+      self.latency = None  # seconds, moving average
+      self.delay_until = None  # end of the current rate-limit wait
+      self.last_failed = None  # (email, reply)
+      self.error = None  # message of the error that stopped the campaign
+      self.done = False
+      self.samples = collections.deque()  # (time, handled) once per drain
+
+  @property
+  def handled(self):
+      return self.sent + self.failed
+
+  def update(self, message):
+      """
+      Fold one progress event into the snapshot.
+      """
+      if 'total_emails' in message:
+          self.total = message['total_emails']
+      if 'emails_sent' in message:
+          self.sent = message['emails_sent']
+          latency = message.get('latency')
+          if latency is not None:
+              if self.latency is None:
+                  self.latency = latency
+              else:
+                  self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+      if 'emails_failed' in message:
+          self.failed = message['emails_failed']
+          self.last_failed = (message['failed_email'], message['reply'])
+      if 'in_flight' in message:
+          self.in_flight = message['in_flight']
+      if 'send_delay' in message:
+          self.delay_until = self.clock() + message['send_delay']
+      elif 'emails_sent' in message or 'emails_failed' in message:
+          self.delay_until = None
+      if message.get('status') == 'error':
+          self.error = message['error']
+      if message.get('status') in ('done', 'error'):
+          self.done = True
+          self.in_flight = 0
+          self.delay_until = None
+
+  def drain(self, progress_queue):
+      """
+      Fold the events waiting on the queue into the snapshot and take a rate sample.
+      Only the events already queued when the drain starts are taken, so a tick
+      stays short even while the senders keep adding events.
+      Returns the number of events folded.
+      """
+      count = 0
+      try:
+          for _ in range(progress_queue.qsize()):
+              self.update(progress_queue.get_nowait())
+              count += 1
+      except queue.Empty:
+          pass
+      self.sample()
+      return count
+
+  def sample(self):
+      now = self.clock()
+      self.samples.append((now, self.handled))
+      while len(self.samples) > 2 and now - self.samples[1][0] >= RATE_WINDOW:
+          self.samples.popleft()
+
+  def rate(self):
+      """
+      Messages handled per second over the last RATE_WINDOW seconds.
+      """
+      if len(self.samples) < 2:
+          return 0.0
+      (start, first), (end, last) = self.samples[0], self.samples[-1]
+      return (last - first) / (end - start) if end > start else 0.0
+
+  def eta(self):
+      """
+      Estimated seconds until every recipient is handled, or None if unknown.
+      """
+      remaining = self.total - self.handled
+      rate = self.rate()
+      if remaining <= 0:
+          return 0.0
+      return remaining / rate if rate > 0 else None
+
+  def delay_remaining(self):
+      """
+      Seconds left in the current rate-limit wait, or None.
+      """
+      if self.delay_until is None:
+          return None
+      return max(0.0, self.delay_until - self.clock())
+
+  def summary(self):
+      """
+      One line for the progress label: rate, latency, ETA and sends in flight.
+      """
+      parts = [f"{self.rate():.1f} msg/s"]
+      if self.latency is not None:
+          parts.append(f"latency {self.latency * 1000:.0f} ms")
+      eta = self.eta()
+      if eta is not None and not self.done:
+          parts.append(f"ETA {format_duration(eta)}")
+      if self.in_flight:
+          parts.append(f"{self.in_flight} in flight")
+      return ", ".join(parts)
@@ -0,0 +1,162 @@
+# Import required modules
+import random
+import threading
+import time
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+# Rate limit settings and the period (in seconds) each one covers
+RATE_LIMIT_PERIODS = {
+  "rate_per_second": 1,
+  "rate_per_minute": 60,
+  "rate_per_hour": 3600,
+  "rate_per_day": 86400
+}
+
+# ------------------------------------------------------------------------
+# Rate Limit Settings
+# ------------------------------------------------------------------------
+
+def parse_rate_limits(settings):
+  """
+  Read the rate limits from the settings.
+  Returns a list of (rate, period) pairs and the jitter in seconds.
+  An empty or zero rate means no limit for that period.
+  Raises ValueError with a readable message if a value is invalid.
+  """
+  limits = []
+  for key, period in RATE_LIMIT_PERIODS.items():
+      value = (settings.get(key) or "").strip()
+      if not value:
+          continue
+      try:
+          rate = int(value)
+      except ValueError:
+          raise ValueError(f"'{key}' must be a whole number, got {value!r}.")
+      if rate < 0:
+          raise ValueError(f"'{key}' cannot be negative.")
+      if rate:
+          limits.append((rate, period))
+
+  value = (settings.get("rate_jitter") or "0").strip()
+  try:
+      jitter = float(value)
+  except ValueError:
+      raise ValueError(f"'rate_jitter' must be a number of seconds, got {value!r}.")
+  if jitter < 0:
+      raise ValueError("'rate_jitter' cannot be negative.")
+  return limits, jitter
+
+def share_rate_limits(limits, shares):
+  """
+  Split (rate, period) limits between `shares` schedulers sending in parallel
+  (one per delivery worker process), each getting an equal part of every rate.
+  A rate lower than the number of shares becomes one send per longer period.
+  """
+  if shares <= 1:
+      return limits
+  return [(rate / shares, period) if rate >= shares else (1, period * shares / rate) for rate, period in limits]
+
+# ------------------------------------------------------------------------
+# Token Buckets
+# ------------------------------------------------------------------------
+
+class TokenBucket:
+  """
+  Allows `rate` sends per `period` seconds, with bursts of up to `rate` sends.
+  Times are plain numbers on the scheduler's clock.
+  """
+
+  def __init__(self, rate, period, now):
+      self.capacity = rate
+      self.fill_rate = rate / period
+      self.tokens = float(rate)
+      self.updated = now
+
+  def refill(self, now):
+      if now > self.updated:
+          self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+          self.updated = now
+
+  def available_at(self, now):
+      """
+      Earliest time (>= now) at which one token is available.
+      """
+      self.refill(now)
+      if self.tokens >= 1:
+          return max(now, self.updated)
+      return self.updated + (1 - self.tokens) / self.fill_rate
+
+  def consume(self, at):
+      """
+      Take one token at time `at` (which may be in the future).
+      """
+      self.refill(at)
+      self.tokens -= 1
+
+class RateScheduler:
+  """
+  Hands out send times that respect every configured token bucket.
+  Send slots are reserved on a schedule rather than by sleeping after each send,
+  so time spent sending counts towards the configured rate instead of adding to it.
+  The clock, sleep and random functions can be swapped out for testing.
+  """
+
+  def __init__(self, limits, jitter=0.0, clock=time.monotonic, sleep=time.sleep, rng=random.uniform):
+      self.clock = clock
+      self.sleep = sleep
+      self.rng = rng
+      self.jitter = jitter
+      now = clock()
+      self.buckets = [TokenBucket(rate, period, now) for rate, period in limits]
+      self.lock = threading.Lock()
+
+  @classmethod
+  def from_settings(cls, settings, shares=1, **kwargs):
+      """
+      Build a scheduler from the rate limit settings, for one of `shares`
+      schedulers sharing them (see share_rate_limits).
+      """
+      limits, jitter = parse_rate_limits(settings)
+      return cls(share_rate_limits(limits, shares), jitter, **kwargs)
+
+  def reserve(self):
+      """
+      Reserve the next send slot and return its time on the scheduler's clock.
+      """
+      with self.lock:
+          now = self.clock()
+          send_time = now
+          for bucket in self.buckets:
+              send_time = max(send_time, bucket.available_at(now))
+          for bucket in self.buckets:
+              bucket.consume(send_time)
+      if self.jitter:
+          send_time += self.rng(0, self.jitter)
+      return send_time
+
+  def wait_time(self):
+      """
+      Seconds until the next send slot comes up, without reserving it.
+      """
+      with self.lock:
+          now = self.clock()
+          return max([0.0] + [bucket.available_at(now) - now for bucket in self.buckets])
+
+  def delay(self):
+      """
+      Reserve the next send slot and return how many seconds to wait for it.
+      """
+      return max(0.0, self.reserve() - self.clock())
+
+  def wait(self):
+      """
+      Reserve the next send slot and block until it comes up.
+      Returns the number of seconds waited.
+      """
+      delay = self.delay()
+      if delay:
+          self.sleep(delay)
+      return delay
@@ -0,0 +1,254 @@
+# Import required modules
+import csv
+import itertools
+import os
+import re
+
+from fastmail_core.template import field_name
+
+# ------------------------------------------------------------------------
+# Address Normalization
+# ------------------------------------------------------------------------
+
+# Dot-atom local part (no leading, trailing or doubled dots) and a domain of LDH labels.
+# Non-ASCII local parts are allowed for SMTPUTF8.
+ADDRESS_RE = re.compile(
+  r"([A-Za-z0-9!#$%&'*+/=?^_`{|}~\-\u0080-\uffff]+(?:\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~\-\u0080-\uffff]+)*)"
+  r"@((?:[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+[A-Za-z0-9-]{2,63})"
+)
+
+def normalize_email(email):
+  """
+  Normalize one address: strip whitespace, angle brackets and 'mailto:',
+  lowercase the domain (IDNA-encoding it if needed) and check the syntax.
+  Returns the normalized address, or None if it is not a valid address.
+  """
+  email = email.strip()
+  match = ADDRESS_RE.fullmatch(email)
+  if match is None:
+      # Slow path: decorations around the address or an internationalized domain
+      email = email.strip("<>").strip()
+      if email[:7].lower() == "mailto:":
+          email = email[7:]
+      local, at, domain = email.rpartition("@")
+      if not at or domain.isascii():
+          match = ADDRESS_RE.fullmatch(email)
+      else:
+          try:
+              match = ADDRESS_RE.fullmatch(f"{local}@{domain.encode('idna').decode('ascii')}")
+          except UnicodeError:
+              return None
+      if match is None:
+          return None
+  local, domain = match.groups()
+  if len(local) > 64 or len(domain) > 253:
+      return None
+  return f"{local}@{domain.lower()}"
+
+# ------------------------------------------------------------------------
+# Recipients
+# ------------------------------------------------------------------------
+
+class Recipient(str):
+  """
+  An address read from a CSV file with a header row, carrying the other columns
+  of its row as `fields` ({column name: value}, names as from field_name) for
+  mail merge. It is a str, so it goes wherever a plain address does.
+  """
+
+  def __new__(cls, email, fields=None):
+      recipient = super().__new__(cls, email)
+      recipient.fields = fields or {}
+      return recipient
+
+# ------------------------------------------------------------------------
+# Recipient Cleaning
+# ------------------------------------------------------------------------
+
+class CleaningReport:
+  """
+  Counts of what the cleaning stage kept and dropped, and why.
+  """
+
+  def __init__(self):
+      self.valid = 0
+      self.invalid = 0
+      self.duplicate = 0
+      self.suppressed = 0
+      self.invalid_examples = []
+
+  @property
+  def dropped(self):
+      return self.invalid + self.duplicate + self.suppressed
+
+  def summary(self):
+      """
+      One line per reason, for the confirmation dialog.
+      """
+      lines = [f"{self.valid} recipients will be sent to."]
+      if self.dropped:
+          lines.append(f"{self.dropped} addresses dropped:")
+          lines.append(f"  - {self.invalid} invalid")
+          lines.append(f"  - {self.duplicate} duplicates")
+          lines.append(f"  - {self.suppressed} on the suppression list")
+      if self.invalid_examples:
+          lines.append("Invalid examples: " + ", ".join(self.invalid_examples))
+      return "\n".join(lines)
+
+class RecipientCleaner:
+  """
+  Wraps a recipient source and yields normalized, de-duplicated addresses
+  that are not on the suppression list. Each iteration starts from scratch,
+  so a file-backed source is still streamed; `report` describes the last pass.
+  Recipients keep their merge fields.
+  """
+
+  def __init__(self, source, suppression=None):
+      self.source = source
+      self.suppression = suppression
+      self.report = CleaningReport()
+
+  @property
+  def fields(self):
+      return getattr(self.source, "fields", ())
+
+  def __iter__(self):
+      report = self.report = CleaningReport()
+      is_suppressed = self.suppression.matcher() if self.suppression is not None else None
+      seen = set()
+      for email in self.source:
+          normalized = normalize_email(email)
+          if normalized is None:
+              report.invalid += 1
+              if len(report.invalid_examples) < 5:
+                  report.invalid_examples.append(email)
+              continue
+          key = normalized.lower()
+          if key in seen:
+              report.duplicate += 1
+              continue
+          seen.add(key)
+          if is_suppressed is not None and is_suppressed(key):
+              report.suppressed += 1
+              continue
+          report.valid += 1
+          if isinstance(email, Recipient):
+              normalized = Recipient(normalized, email.fields)
+          yield normalized
+
+  def scan(self):
+      """
+      Run one full pass and return its report.
+      """
+      for _ in self:
+          pass
+      return self.report
+
+# ------------------------------------------------------------------------
+# Recipient Sources
+# ------------------------------------------------------------------------
+
+def is_csv_file(path):
+  """
+  Return True if the file should be read as CSV rather than plain text.
+  """
+  return os.path.splitext(path)[1].lower() == ".csv"
+
+def read_csv_header(path):
+  """
+  Return the first row of a CSV file (its column names), or an empty list.
+  """
+  with open(path, "r", encoding="utf-8-sig", errors="replace", newline="") as f:
+      return next(csv.reader(f), [])
+
+def guess_email_column(header):
+  """
+  Return the index of the column that looks like it holds email addresses, or None.
+  """
+  for i, name in enumerate(header):
+      if "mail" in name.strip().lower():
+          return i
+  return None
+
+class RecipientFile:
+  """
+  A recipient list read lazily from a TXT or CSV file.
+  Iterating streams the addresses one at a time, so memory use stays bounded
+  whatever the size of the file. TXT files may hold one or more comma-separated
+  addresses per line; CSV files are read from one column (a name from the header
+  row or a 0-based index). With a header row, each address is a Recipient with
+  the other columns of its row as merge fields, named in `fields`.
+  """
+
+  def __init__(self, path, column=None):
+      self.path = path
+      self.is_csv = is_csv_file(path)
+      self.column = column
+      self.column_index = None
+      self.has_header = False
+      self.fields = ()
+      self.counted = None  # (mtime, size, count) of the last count()
+      if self.is_csv:
+          self.resolve_column()
+
+  def resolve_column(self):
+      header = read_csv_header(self.path)
+      if isinstance(self.column, int):
+          self.column_index = self.column
+          # A first row without an address in that column is a header row
+          self.has_header = len(header) > self.column and "@" not in header[self.column]
+      elif self.column is not None:
+          names = [name.strip().lower() for name in header]
+          if self.column.strip().lower() not in names:
+              raise ValueError(f"Column '{self.column}' not found in {os.path.basename(self.path)}.")
+          self.column_index = names.index(self.column.strip().lower())
+          self.has_header = True
+      else:
+          self.column_index = guess_email_column(header)
+          if self.column_index is None:
+              raise ValueError(f"No email column found in {os.path.basename(self.path)}.")
+          self.has_header = True
+      if self.has_header:
+          self.fields = tuple(field_name(name) for name in header)
+
+  def __iter__(self):
+      if self.is_csv:
+          return self.iter_csv()
+      return self.iter_text()
+
+  def iter_text(self):
+      with open(self.path, "r", encoding="utf-8-sig", errors="replace") as f:
+          for line in f:
+              for email in line.split(','):
+                  email = email.strip()
+                  if email:
+                      yield email
+
+  def iter_csv(self):
+      with open(self.path, "r", encoding="utf-8-sig", errors="replace", newline="") as f:
+          reader = csv.reader(f)
+          if self.has_header:
+              next(reader, None)
+          index = self.column_index
+          fields = self.fields
+          for row in reader:
+              if len(row) > index:
+                  email = row[index].strip()
+                  if email:
+                      yield Recipient(email, dict(zip(fields, row))) if fields else email
+
+  def preview(self, limit=100):
+      """
+      Return the first `limit` addresses.
+      """
+      return list(itertools.islice(self, limit))
+
+  def count(self):
+      """
+      Count the addresses with one streaming pass over the file.
+      The result is kept until the file's modification time or size changes.
+      """
+      stat = os.stat(self.path)
+      if self.counted is None or self.counted[:2] != (stat.st_mtime, stat.st_size):
+          self.counted = (stat.st_mtime, stat.st_size, sum(1 for _ in self))
+      return self.counted[2]
@@ -0,0 +1,84 @@
+# Import required modules
+import random
+import smtplib
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+# Classes of delivery errors
+PERMANENT = "permanent"  # the recipient (or message) is refused for good: record it and move on
+TRANSIENT = "transient"  # a 4xx reply: send again later
+CONNECTION = "connection"  # the session is lost: open a new one and send again
+
+# Attempts per recipient before a transient or connection error is recorded as final
+MAX_DELIVERY_ATTEMPTS = 5
+
+# Delay before sending a recipient again after a transient error, doubled on each attempt
+RETRY_BACKOFF = 5  # seconds
+RETRY_BACKOFF_MAX = 300
+
+# Delay before opening a lost session again, doubled on each failed attempt
+RECONNECT_BACKOFF = 1  # seconds
+RECONNECT_BACKOFF_MAX = 60
+
+# Failed attempts in a row to open a session of an account before the campaign stops
+MAX_RECONNECT_ATTEMPTS = 6
+
+# ------------------------------------------------------------------------
+# Error Classification
+# ------------------------------------------------------------------------
+
+def classify_reply(reply):
+  """
+  Class of a (code, message) reply refusing a message: 421 (the server is closing
+  the session) is a connection error, other 4xx replies are transient and
+  anything else permanent.
+  """
+  code = reply[0] if reply else None
+  if code == 421:
+      return CONNECTION
+  if code is not None and 400 <= code < 500:
+      return TRANSIENT
+  return PERMANENT
+
+def failure_reply(error, email=None):
+  """
+  The (code, message) reply behind a delivery error, for the journal and the
+  progress queue. Errors without a reply (a dropped connection) have code None.
+  """
+  if isinstance(error, smtplib.SMTPRecipientsRefused):
+      return error.recipients.get(email, (None, str(error)))
+  if isinstance(error, smtplib.SMTPResponseException):
+      return error.smtp_code, error.smtp_error
+  return None, str(error) or type(error).__name__
+
+def classify_error(error, email=None):
+  """
+  Class of an exception raised while opening a session or sending to `email`,
+  or None if it is not a delivery error (a bug, which must stop the campaign).
+  Note that smtplib exceptions are OSErrors: replies are checked first.
+  """
+  if isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException)):
+      return classify_reply(failure_reply(error, email))
+  if isinstance(error, smtplib.SMTPServerDisconnected):
+      return CONNECTION
+  if isinstance(error, smtplib.SMTPException):
+      return None
+  if isinstance(error, OSError):
+      # Refused or reset connections, timeouts and TLS errors
+      return CONNECTION
+  return None
+
+# ------------------------------------------------------------------------
+# Backoff
+# ------------------------------------------------------------------------
+
+def backoff_delay(attempt, base=RETRY_BACKOFF, cap=RETRY_BACKOFF_MAX):
+  """
+  Seconds to wait before attempt number `attempt + 1`: exponential backoff,
+  capped, with random jitter (between half and all of the delay) so sessions
+  that failed together do not all come back at the same moment.
+  """
+  delay = min(cap, base * 2 ** max(0, attempt - 1))
+  return delay * random.uniform(0.5, 1.0)
@@ -0,0 +1,127 @@
+# Import required modules
+import html  # For escaping HTML characters
+
+# ------------------------------------------------------------------------
+# Tag Mapping
+# ------------------------------------------------------------------------
+
+# Map font tags back to actual font names with spaces
+FONT_DISPLAY_NAMES = {
+  "Sans_Serif": "Sans Serif",
+  "Serif": "Serif",
+  "Fixed_Width": "Fixed Width",
+  "Wide": "Wide",
+  "Narrow": "Narrow",
+  "Comic_Sans_MS": "Comic Sans MS",
+  "Garamond": "Garamond",
+  "Georgia": "Georgia",
+  "Tahoma": "Tahoma",
+  "Trebuchet_MS": "Trebuchet MS",
+  "Verdana": "Verdana"
+}
+
+def get_html_opening_tag(tag):
+  """
+  Returns the appropriate HTML opening tag based on the tkinter tag.
+  """
+  if tag == "bold":
+      return "<b>"
+  elif tag == "italic":
+      return "<i>"
+  elif tag == "underline":
+      return "<u>"
+  elif tag.startswith("size_"):
+      size = tag.split("_")[1]
+      return f'<span style="font-size:{size}px">'
+  elif tag.startswith("font_"):
+      font_key = tag.split("_", 1)[1]
+      font_name = FONT_DISPLAY_NAMES.get(font_key, font_key)
+      return f'<span style="font-family:\'{font_name}\';">'
+  elif tag in ["left", "center", "right"]:
+      return f'<div style="text-align:{tag};">'
+  else:
+      return ""
+
+def get_html_closing_tag(tag):
+  """
+  Returns the appropriate HTML closing tag based on the tkinter tag.
+  """
+  if tag == "bold":
+      return "</b>"
+  elif tag == "italic":
+      return "</i>"
+  elif tag == "underline":
+      return "</u>"
+  elif tag.startswith("size_") or tag.startswith("font_"):
+      return "</span>"
+  elif tag in ["left", "center", "right"]:
+      return "</div>"
+  else:
+      return ""
+
+def escape_html(text):
+  """
+  Escape HTML special characters in text.
+  """
+  return html.escape(text)
+
+# ------------------------------------------------------------------------
+# Text Widget to HTML
+# ------------------------------------------------------------------------
+
+def dump_to_html(dump, tag_order):
+  """
+  Convert a Text widget dump into HTML.
+
+  `dump` is the list of (key, value, index) entries returned by
+  `text.dump("1.0", "end", text=True, tag=True)` and `tag_order` is `text.tag_names()`
+  (every tag, lowest priority first). Consecutive text with the same tags is merged
+  into one run, so the tag mapping is only consulted where the tags change.
+  The output is the same as walking the widget one character at a time:
+  tags that end are closed in reverse order, new tags are opened in priority
+  order and newlines become <br>.
+  """
+  rank = {tag: n for n, tag in enumerate(tag_order)}
+  parts = []
+  run = []
+  active = set()
+  prev_tags = []
+  changed = False
+
+  for key, value, index in dump:
+      if key == "text":
+          if changed:
+              current_tags = sorted(active, key=lambda tag: rank.get(tag, len(rank)))
+              if current_tags != prev_tags:
+                  if run:
+                      parts.append(escape_html("".join(run)).replace("\n", "<br>"))
+                      run = []
+                  # Close tags in reverse order to maintain proper nesting
+                  for tag in reversed([tag for tag in prev_tags if tag not in current_tags]):
+                      parts.append(get_html_closing_tag(tag))
+                  for tag in current_tags:
+                      if tag not in prev_tags:
+                          parts.append(get_html_opening_tag(tag))
+                  prev_tags = current_tags
+              changed = False
+          run.append(value)
+      elif key == "tagon":
+          active.add(value)
+          changed = True
+      elif key == "tagoff":
+          active.discard(value)
+          changed = True
+
+  if run:
+      parts.append(escape_html("".join(run)).replace("\n", "<br>"))
+  # Close any remaining open tags
+  for tag in reversed(prev_tags):
+      parts.append(get_html_closing_tag(tag))
+  return "".join(parts)
+
+def text_widget_to_html(text_widget):
+  """
+  Convert the content of a Text widget, along with its tags, into HTML
+  with two Tk calls whatever the length of the text.
+  """
+  return dump_to_html(text_widget.dump("1.0", "end", text=True, tag=True), text_widget.tag_names())
@@ -0,0 +1,302 @@
+# Import required modules
+import heapq
+import itertools
+import re
+import time
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+# Share of the delivery capacity a campaign gets, relative to the other
+# campaigns sending at the same time
+CAMPAIGN_WEIGHT = 1.0
+MAX_CAMPAIGN_WEIGHT = 1000.0
+
+# Formats accepted for a campaign's start time (local time)
+START_TIME_FORMATS = ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d")
+
+# One sending window: "HH:MM-HH:MM", local time; a window ending before it
+# starts runs past midnight
+SEND_WINDOW_PATTERN = re.compile(r"^(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})$")
+
+# ------------------------------------------------------------------------
+# Campaign Schedules
+# ------------------------------------------------------------------------
+
+def parse_start_time(text):
+  """
+  Read a start time such as '2026-10-18 09:00' (local time) into a Unix
+  timestamp. An empty value means as soon as possible (None).
+  Raises ValueError with a readable message if the value is invalid.
+  """
+  text = (text or "").strip()
+  if not text:
+      return None
+  for time_format in START_TIME_FORMATS:
+      try:
+          return time.mktime(time.strptime(text, time_format))
+      except ValueError:
+          continue
+  raise ValueError(f"Invalid start time {text!r}: expected YYYY-MM-DD HH:MM.")
+
+def parse_send_windows(text):
+  """
+  Read the sending windows of a campaign, e.g. '09:00-12:00, 14:00-17:30'
+  (local time, every day), into a list of (start, end) minutes since
+  midnight. An empty value means any time of day.
+  Raises ValueError with a readable message if a window is invalid.
+  """
+  windows = []
+  for part in (text or "").replace(";", ",").split(","):
+      part = part.strip()
+      if not part:
+          continue
+      match = SEND_WINDOW_PATTERN.match(part)
+      if not match:
+          raise ValueError(f"Invalid sending window {part!r}: expected HH:MM-HH:MM.")
+      start_hour, start_minute, end_hour, end_minute = (int(value) for value in match.groups())
+      if start_hour > 24 or end_hour > 24 or start_minute > 59 or end_minute > 59:
+          raise ValueError(f"Invalid sending window {part!r}: not a time of day.")
+      start, end = start_hour * 60 + start_minute, end_hour * 60 + end_minute
+      if start == end:
+          raise ValueError(f"Sending window {part!r} is empty.")
+      windows.append((start, end))
+  return windows
+
+def parse_campaign_weight(text):
+  """
+  Read a campaign weight; an empty value means CAMPAIGN_WEIGHT.
+  Raises ValueError with a readable message if the value is invalid.
+  """
+  text = str(text if text is not None else "").strip()
+  if not text:
+      return CAMPAIGN_WEIGHT
+  try:
+      weight = float(text)
+  except ValueError:
+      raise ValueError(f"The campaign weight must be a number, got {text!r}.")
+  if not 0 < weight <= MAX_CAMPAIGN_WEIGHT:
+      raise ValueError(f"The campaign weight must be above 0 and at most {MAX_CAMPAIGN_WEIGHT:g}.")
+  return weight
+
+def day_start(now):
+  """
+  Timestamp of the local midnight starting the day of `now`.
+  """
+  local = time.localtime(now)
+  return time.mktime((local.tm_year, local.tm_mon, local.tm_mday, 0, 0, 0, 0, 0, -1))
+
+class CampaignSchedule:
+  """
+  When a campaign may send: not before `start_at` (a timestamp, or None for
+  now), only within its daily sending `windows` (see parse_send_windows;
+  none means any time), with its `weight` of the capacity shared with the
+  other campaigns sending at the same time.
+  """
+
+  def __init__(self, start_at=None, windows=(), weight=CAMPAIGN_WEIGHT):
+      self.start_at = start_at
+      self.windows = list(windows)
+      self.weight = weight
+
+  @classmethod
+  def from_settings(cls, start_at="", send_windows="", weight=""):
+      """
+      Build a schedule from the text of the start time, sending windows and
+      weight options. Raises ValueError if one is invalid.
+      """
+      return cls(parse_start_time(start_at), parse_send_windows(send_windows), parse_campaign_weight(weight))
+
+  @classmethod
+  def from_dict(cls, data):
+      data = data or {}
+      return cls(data.get("start_at"), [tuple(window) for window in data.get("windows", ())],
+                 data.get("weight", CAMPAIGN_WEIGHT))
+
+  def to_dict(self):
+      return {"start_at": self.start_at, "windows": [list(window) for window in self.windows], "weight": self.weight}
+
+  def eligible_at(self, now):
+      """
+      Earliest time from `now` on at which the campaign may send.
+      """
+      now = max(now, self.start_at or now)
+      if not self.windows:
+          return now
+      midnight = day_start(now)
+      minute = (now - midnight) / 60
+      best = None
+      for start, end in self.windows:
+          if start < end:
+              if start <= minute < end:
+                  return now
+              opens = midnight + start * 60 if minute < start else day_start(midnight + 86400 + 3600) + start * 60
+          else:
+              # Runs past midnight: open from start to the end of the day and up to end the next day
+              if minute >= start or minute < end:
+                  return now
+              opens = midnight + start * 60
+          best = opens if best is None else min(best, opens)
+      return best
+
+  def is_open(self, now):
+      return self.eligible_at(now) <= now
+
+  def closes_at(self, now):
+      """
+      When the sending window open at `now` closes (infinity without windows).
+      """
+      if not self.windows:
+          return float("inf")
+      midnight = day_start(now)
+      minute = (now - midnight) / 60
+      closes = now
+      for start, end in self.windows:
+          if start < end and start <= minute < end:
+              closes = max(closes, midnight + end * 60)
+          elif start > end and minute >= start:
+              closes = max(closes, day_start(midnight + 86400 + 3600) + end * 60)
+          elif start > end and minute < end:
+              closes = max(closes, midnight + end * 60)
+      return closes
+
+# ------------------------------------------------------------------------
+# Scheduler
+# ------------------------------------------------------------------------
+
+class VirtualClock:
+  """
+  A clock that only moves when told to, for testing schedules: pass it as the
+  scheduler's clock and `advance` it instead of waiting.
+  """
+
+  def __init__(self, now=0.0):
+      self.now = now
+
+  def __call__(self):
+      return self.now
+
+  def advance(self, seconds):
+      self.now += seconds
+      return self.now
+
+class CampaignScheduler:
+  """
+  Decides which campaign the next message is taken from, when several are
+  queued. Campaigns wait in a priority queue ordered by the time they may
+  start sending (their start time, or the next opening of their sending
+  window); once due they share the delivery capacity by weighted fair
+  queuing, one message at a time.
+
+  Each active campaign has a virtual finish tag that grows by 1/weight per
+  message taken; the campaign whose next message would finish first goes
+  next. A campaign that becomes active starts from the scheduler's virtual
+  time (the tag of the last message taken), not from zero, so it does not
+  get a burst for the time it was waiting, and a small campaign queued
+  behind a large one is served at once, at its weight's share of the rate.
+
+  Not thread-safe. The clock (Unix time) can be swapped out for testing.
+  """
+
+  def __init__(self, clock=time.time):
+      self.clock = clock
+      self.schedules = {}  # campaign id -> CampaignSchedule
+      self.waiting = []  # heap of (eligible at, sequence, campaign id)
+      self.tags = {}  # campaign id -> virtual finish tag of the active campaigns
+      self.closes = {}  # campaign id -> when the sending window of an active campaign closes
+      self.order = {}  # campaign id -> sequence, which breaks ties between equal tags
+      self.sequence = itertools.count()
+      self.virtual_time = 0.0
+
+  def __contains__(self, campaign_id):
+      return campaign_id in self.schedules
+
+  def __len__(self):
+      return len(self.schedules)
+
+  def add(self, campaign_id, schedule=None):
+      """
+      Queue a campaign; it becomes active once its schedule allows it to send.
+      """
+      if campaign_id in self.schedules:
+          return
+      self.schedules[campaign_id] = schedule or CampaignSchedule()
+      self.order[campaign_id] = next(self.sequence)
+      self.wait(campaign_id, self.clock())
+
+  def remove(self, campaign_id):
+      """
+      Forget a campaign: it has nothing left to send. Removed lazily from the waiting queue.
+      """
+      self.schedules.pop(campaign_id, None)
+      self.tags.pop(campaign_id, None)
+      self.closes.pop(campaign_id, None)
+      self.order.pop(campaign_id, None)
+
+  def wait(self, campaign_id, now):
+      self.tags.pop(campaign_id, None)
+      self.closes.pop(campaign_id, None)
+      eligible_at = self.schedules[campaign_id].eligible_at(now)
+      heapq.heappush(self.waiting, (eligible_at, self.order[campaign_id], campaign_id))
+
+  def activate(self, now):
+      """
+      Move the campaigns that are due from the waiting queue to the active set.
+      """
+      while self.waiting and self.waiting[0][0] <= now:
+          eligible_at, sequence, campaign_id = heapq.heappop(self.waiting)
+          if self.order.get(campaign_id) != sequence or campaign_id in self.tags:
+              continue  # removed or re-added since
+          if not self.schedules[campaign_id].is_open(now):
+              self.wait(campaign_id, now)  # the window closed again (clock moved on)
+              continue
+          self.tags[campaign_id] = self.virtual_time
+          self.closes[campaign_id] = self.schedules[campaign_id].closes_at(now)
+
+  def active(self):
+      """
+      Ids of the campaigns that may send now.
+      """
+      now = self.clock()
+      self.activate(now)
+      for campaign_id, closes in list(self.closes.items()):
+          if now >= closes:
+              self.wait(campaign_id, now)  # its sending window closed
+      return set(self.tags)
+
+  def peek(self, among=None):
+      """
+      Id of the campaign the next message should come from, of those `among`
+      (all when None), without taking it; None if none may send now.
+      """
+      candidates = self.active()
+      if among is not None:
+          candidates &= set(among)
+      if not candidates:
+          return None
+      # Smallest finish tag once this message is counted, then the order campaigns were queued in
+      return min(candidates, key=lambda campaign_id: (self.tags[campaign_id] + 1 / self.schedules[campaign_id].weight,
+                                                      self.order[campaign_id]))
+
+  def next(self, among=None):
+      """
+      Take one message's turn: return the id of the campaign it comes from,
+      of those `among` (all when None), or None if none may send now.
+      """
+      campaign_id = self.peek(among)
+      if campaign_id is not None:
+          self.tags[campaign_id] += 1 / self.schedules[campaign_id].weight
+          self.virtual_time = self.tags[campaign_id]
+      return campaign_id
+
+  def next_start(self):
+      """
+      Earliest time a waiting campaign may start sending, or None if none is waiting.
+      """
+      while self.waiting:
+          eligible_at, sequence, campaign_id = self.waiting[0]
+          if self.order.get(campaign_id) == sequence and campaign_id not in self.tags:
+              return eligible_at
+          heapq.heappop(self.waiting)
+      return None
@@ -0,0 +1,247 @@
+# Import required modules
+import threading
+import time
+
+from fastmail_core.dkim import DKIMSigner
+from fastmail_core.domains import THROTTLE_COOLDOWN, THROTTLE_COOLDOWN_MAX
+from fastmail_core.ratelimit import RateScheduler, parse_rate_limits
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+# Fields of one sender account profile, with their defaults
+DEFAULT_SENDER = {
+  "sender_email": "",
+  "app_password": "",
+  "smtp_server": "smtp.gmail.com",
+  "smtp_connections": "1",
+  "rate_per_second": "1",
+  "rate_per_minute": "15",
+  "rate_per_hour": "500",
+  "rate_per_day": "2000",
+  "rate_jitter": "2",
+  "weight": "1",
+  "dkim_selector": "",
+  "dkim_key_file": ""
+}
+
+# SMTP submission port used when the server setting has none
+DEFAULT_SMTP_PORT = 587
+
+# ------------------------------------------------------------------------
+# Sender Profiles
+# ------------------------------------------------------------------------
+
+def split_server_address(smtp_server, default_port=DEFAULT_SMTP_PORT):
+  """
+  Split an SMTP server setting into (host, port): 'smtp.example.com' uses the
+  default port, 'smtp.example.com:2525' the given one.
+  """
+  host, sep, port = smtp_server.strip().rpartition(":")
+  if sep and port.isdigit():
+      return host, int(port)
+  return smtp_server.strip(), default_port
+
+def validate_sender(profile):
+  """
+  Check one sender profile.
+  Raises ValueError with a readable message if a value is missing or invalid.
+  """
+  name = profile.get("sender_email", "").strip() or "sender account"
+  if not profile.get("sender_email", "").strip():
+      raise ValueError("Sender email cannot be empty.")
+  if not profile.get("app_password", "").strip():
+      raise ValueError(f"{name}: app password cannot be empty.")
+  if not profile.get("smtp_server", "").strip():
+      raise ValueError(f"{name}: SMTP server cannot be empty.")
+  try:
+      if int(profile.get("smtp_connections", "1")) < 1:
+          raise ValueError
+  except ValueError:
+      raise ValueError(f"{name}: SMTP connections must be a whole number of at least 1.")
+  try:
+      if float(profile.get("weight") or "1") <= 0:
+          raise ValueError
+  except ValueError:
+      raise ValueError(f"{name}: weight must be a number above 0.")
+  try:
+      parse_rate_limits(profile)
+      DKIMSigner.from_profile(profile)
+  except ValueError as e:
+      raise ValueError(f"{name}: {e}")
+
+class SenderAccount:
+  """
+  One account a campaign can send from: its server, credentials, number of
+  SMTP sessions, rate limits (a RateScheduler) and weight, plus the state the
+  rotation keeps for it.
+  """
+
+  def __init__(self, sender_email, app_password, smtp_server, connections=1, scheduler=None, weight=1.0,
+               port=DEFAULT_SMTP_PORT, use_starttls=True):
+      self.sender_email = sender_email
+      self.app_password = app_password
+      self.smtp_server = smtp_server
+      self.port = port
+      self.use_starttls = use_starttls
+      self.connections = max(1, connections)
+      self.scheduler = scheduler
+      self.weight = weight
+      self.tls_context = None  # shared by the account's sessions, set by the delivery engine
+
+      self.waiting = 0  # sessions of this account waiting for a turn
+      self.sending = 0  # sessions of this account between their turn and the end of the send
+      self.pass_value = 0.0  # sends so far divided by weight (stride scheduling)
+      self.cooldown = 0
+      self.cooldown_until = 0.0
+      self.sent = 0
+
+  @classmethod
+  def from_profile(cls, profile, shares=1):
+      """
+      Build an account from a sender profile of the settings. With `shares` above 1
+      the account is one of that many delivery worker processes sending from the
+      profile, and gets an equal part of its rate limits.
+      """
+      profile = dict(DEFAULT_SENDER, **profile)
+      host, port = split_server_address(profile["smtp_server"])
+      return cls(profile["sender_email"], profile["app_password"], host,
+                 int(profile["smtp_connections"]), RateScheduler.from_settings(profile, shares),
+                 float(profile["weight"] or "1"), port)
+
+  def __repr__(self):
+      return f"SenderAccount({self.sender_email!r})"
+
+# ------------------------------------------------------------------------
+# Sender Rotation
+# ------------------------------------------------------------------------
+
+class SenderRotation:
+  """
+  Decides which account sends next. Among the accounts that are waiting for a
+  turn or sending, are not paused and have quota left right now, the one furthest
+  behind its weighted share goes first (stride scheduling), so an account out of
+  quota or paused never holds up the others. An account that gets a throttling reply
+  is paused, for longer on each new one. Thread-safe.
+  """
+
+  def __init__(self, accounts, clock=time.monotonic):
+      self.accounts = list(accounts)
+      self.clock = clock
+      self.closed = False
+      self.changes = 0  # counts the changes a waiting session waits for (see wait)
+      self.condition = threading.Condition()
+
+  def __len__(self):
+      return len(self.accounts)
+
+  def __iter__(self):
+      return iter(self.accounts)
+
+  def wait_time(self, account, now):
+      # Caller holds self.condition
+      wait = max(0.0, account.cooldown_until - now)
+      if account.scheduler is not None:
+          wait = max(wait, account.scheduler.wait_time())
+      return wait
+
+  def arrive(self, account):
+      """
+      Register a session of the account as waiting for a turn.
+      An account coming back from idle starts level with the busy ones
+      rather than catching up on the turns it missed.
+      """
+      with self.condition:
+          if not account.waiting and not account.sending:
+              others = [other.pass_value for other in self.accounts if other.waiting or other.sending]
+              if others:
+                  account.pass_value = max(account.pass_value, min(others))
+          account.waiting += 1
+
+  def leave(self, account):
+      """
+      Unregister a waiting session of the account.
+      """
+      with self.condition:
+          account.waiting -= 1
+          self.changed()
+
+  def turn(self, account):
+      """
+      Ask for the account's next send slot (the session must have arrived).
+      Returns (True, seconds): the slot is reserved; wait that long (the jitter) first,
+      and call finished() once the send is over.
+      Returns (False, seconds): the account is paused or out of quota for that long.
+      Returns (False, None): another account is behind on its share; wait for a change.
+      Each is followed by the change count to pass to wait().
+      """
+      with self.condition:
+          now = self.clock()
+          wait = self.wait_time(account, now)
+          if wait > 0:
+              return False, wait, self.changes
+          for other in self.accounts:
+              if (other is not account and (other.waiting or other.sending)
+                      and other.pass_value < account.pass_value and self.wait_time(other, now) <= 0):
+                  return False, None, self.changes
+          account.pass_value += 1 / account.weight
+          account.sending += 1
+          self.changed()
+          return True, account.scheduler.delay() if account.scheduler is not None else 0.0, self.changes
+
+  def finished(self, account):
+      """
+      Record the end of a send the account took a turn for.
+      """
+      with self.condition:
+          account.sending -= 1
+          self.changed()
+
+  def throttled(self, account):
+      """
+      Pause an account after a throttling (4xx) reply, doubling the pause on each new one.
+      """
+      with self.condition:
+          account.cooldown = min(THROTTLE_COOLDOWN_MAX, account.cooldown * 2 or THROTTLE_COOLDOWN)
+          account.cooldown_until = self.clock() + account.cooldown
+          self.changed()
+
+  def succeeded(self, account):
+      """
+      Record a delivered message: the account's throttling back-off starts over.
+      """
+      with self.condition:
+          account.cooldown = 0
+          account.sent += 1
+
+  def blames_account(self, sender_refused):
+      """
+      Whether a throttling reply pauses the sending account rather than the recipient's
+      domain group: always when MAIL FROM was refused, and for any throttling reply when
+      there are other accounts to carry on with (submission servers throttle per account).
+      """
+      return sender_refused or len(self.accounts) > 1
+
+  def changed(self):
+      # Caller holds self.condition
+      self.changes += 1
+      self.condition.notify_all()
+
+  def wait(self, timeout, changes=None):
+      """
+      Block until another account takes a turn or `timeout` seconds pass (None: no timeout).
+      Given the change count turn() returned, it returns at once if anything
+      changed since, so that wake-up is not missed.
+      """
+      with self.condition:
+          if not self.closed and (changes is None or changes == self.changes):
+              self.condition.wait(timeout)
+
+  def close(self):
+      """
+      Wake every waiting session.
+      """
+      with self.condition:
+          self.closed = True
+          self.changed()
@@ -0,0 +1,104 @@
+# Import required modules
+import os
+import xml.etree.ElementTree as ET
+
+from fastmail_core.domains import DEFAULT_DOMAIN_LIMITS
+from fastmail_core.senders import DEFAULT_SENDER
+
+# ------------------------------------------------------------------------
+# Constants and Configuration
+# ------------------------------------------------------------------------
+
+# Directory of the settings file, the send journal and the suppression list:
+# %APPDATA%/FastMails on Windows, ~/.config/FastMails elsewhere
+SETTINGS_DIR = os.path.join(os.getenv('APPDATA') or os.path.join(os.path.expanduser("~"), ".config"), "FastMails")
+
+# Constants for XML settings file
+SETTINGS_FILE = os.path.join(SETTINGS_DIR, "settings.xml")
+
+# Send journal used to resume interrupted campaigns
+JOURNAL_FILE = os.path.join(SETTINGS_DIR, "journal.sqlite3")
+
+# Addresses that must never be sent to (unsubscribes, bounces)
+SUPPRESSION_FILE = os.path.join(SETTINGS_DIR, "suppression.sqlite3")
+
+# JSON summaries of the delivery metrics, one per campaign run
+METRICS_DIR = os.path.join(SETTINGS_DIR, "metrics")
+
+# Encoded attachment parts kept between campaigns (see AttachmentCache)
+ATTACHMENT_CACHE_DIR = os.path.join(SETTINGS_DIR, "attachment_cache")
+
+# Available delivery engines: one thread per SMTP session, or all sessions on one asyncio event loop
+DELIVERY_ENGINES = ["threads", "asyncio"]
+
+# Most delivery worker processes sending from the outbox (see fastmail_core.outbox)
+MAX_DELIVERY_WORKERS = 32
+
+# Default settings. "senders" is a list of sender account profiles (see DEFAULT_SENDER).
+DEFAULT_SETTINGS = {
+  "senders": [],
+  "delivery_engine": "threads",
+  "domain_limits": DEFAULT_DOMAIN_LIMITS,
+  "metrics_port": "",
+  "delivery_workers": "2"
+}
+
+# ------------------------------------------------------------------------
+# Functions for Loading and Saving Settings
+# ------------------------------------------------------------------------
+
+def read_sender(element):
+  """
+  Read one sender profile element, on top of the default profile.
+  """
+  profile = DEFAULT_SENDER.copy()
+  for key in profile.keys():
+      child = element.find(key)
+      if child is not None:
+          profile[key] = child.text or ""
+  return profile
+
+def load_settings(path=SETTINGS_FILE):
+  """
+  Load settings from the XML settings file, on top of the default settings.
+  A missing file gives the default settings.
+  A file from before sender profiles existed gives one profile made of its
+  single-account fields.
+  Raises ValueError if the file is corrupted.
+  """
+  settings = DEFAULT_SETTINGS.copy()
+  settings["senders"] = []
+  if os.path.exists(path):
+      try:
+          root = ET.parse(path).getroot()
+      except ET.ParseError:
+          raise ValueError("Settings file is corrupted.")
+      for key in settings.keys():
+          element = root.find(key)
+          if element is None:
+              continue
+          if key == "senders":
+              settings[key] = [read_sender(sender) for sender in element.findall("sender")]
+          else:
+              settings[key] = element.text or ""
+      if root.find("senders") is None and root.find("sender_email") is not None:
+          settings["senders"] = [read_sender(root)]
+  return settings
+
+def save_settings(settings, path=SETTINGS_FILE):
+  """
+  Save settings to the XML settings file.
+  """
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  root = ET.Element("settings")
+  for key, value in settings.items():
+      elem = ET.SubElement(root, key)
+      if key == "senders":
+          for profile in value:
+              sender = ET.SubElement(elem, "sender")
+              for field, text in profile.items():
+                  ET.SubElement(sender, field).text = text
+      else:
+          elem.text = value
+  tree = ET.ElementTree(root)
+  tree.write(path)
@@ -0,0 +1,292 @@
+# Import required modules
+import array
+import bisect
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS suppressed (
+    email TEXT PRIMARY KEY,
+    reason TEXT,
+    added REAL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+CREATE TABLE IF NOT EXISTS bounces (
+    email TEXT PRIMARY KEY,
+    soft INTEGER NOT NULL,
+    hard INTEGER NOT NULL,
+    status TEXT,
+    detail TEXT,
+    last_bounce REAL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS bounce_messages (
+    digest BLOB PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+# Rows inserted per transaction when importing a list
+INSERT_CHUNK = 50000
+
+# Soft bounces (mailbox full, greylisting...) after which an address is suppressed
+SOFT_BOUNCE_LIMIT = 3
+
+# Kinds of bounce
+HARD_BOUNCE = "hard"  # the address does not exist or is disabled: suppressed at once
+SOFT_BOUNCE = "soft"  # a temporary or policy failure: suppressed after SOFT_BOUNCE_LIMIT
+
+# ------------------------------------------------------------------------
+# Suppression Store
+# ------------------------------------------------------------------------
+
+def suppression_key(email):
+  """
+  Key an address is stored and looked up under (compared case-insensitively).
+  """
+  return email.strip().lower()
+
+# Seed of the second CRC-32 in key_hash
+HASH_SEED = 0x5bd1e995
+
+def key_hash(key):
+  """
+  64-bit hash of a suppression key, used by the compact in-memory index.
+  Two CRC-32s with different seeds: cheap, and collisions only cost an exact lookup.
+  """
+  data = key.encode("utf-8")
+  return (zlib.crc32(data) << 32) | zlib.crc32(data, HASH_SEED)
+
+class SuppressionList:
+  """
+  A persistent list of addresses that must never be sent to (unsubscribes,
+  hard bounces, complaints).
+
+  The exact list lives in SQLite. Lookups go through a compact index: a sorted
+  array of 64-bit hashes (8 bytes per address) kept in a sidecar file next to
+  the database and rebuilt only when the list changes, with a small Bloom filter
+  (2 bytes per address) in front of it so most misses cost two bit tests.
+  A hash hit is confirmed against SQLite, so the index never causes a false positive.
+  """
+
+  def __init__(self, path):
+      self.path = path
+      self.index_path = path + ".idx"
+      self.lock = threading.Lock()
+      self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+      self.connection.execute("PRAGMA journal_mode=WAL")
+      self.connection.executescript(SCHEMA)
+      # Random id of this database, written in the sidecar index with the
+      # version: an index left by a deleted database is never taken for its own
+      self.connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('store_id', ?)",
+                              (int.from_bytes(os.urandom(8), "big") >> 1,))
+      self.index = None
+      self.bloom = None
+
+  # --------------------------------------------------------------------
+  # Updating
+  # --------------------------------------------------------------------
+
+  def version(self):
+      row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+      return row[0] if row else 0
+
+  def store_id(self):
+      return self.connection.execute("SELECT value FROM meta WHERE key = 'store_id'").fetchone()[0]
+
+  def add_many(self, emails, reason=""):
+      """
+      Add addresses to the list. Returns how many were new.
+      """
+      added = 0
+      now = time.time()
+      chunk = []
+      with self.lock:
+          for email in emails:
+              chunk.append((suppression_key(email), reason, now))
+              if len(chunk) >= INSERT_CHUNK:
+                  added += self.insert_chunk(chunk)
+                  chunk = []
+          added += self.insert_chunk(chunk)
+          if added:
+              self.connection.execute(
+                  "INSERT INTO meta (key, value) VALUES ('version', 1) "
+                  "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+              self.index = None
+              self.bloom = None
+      return added
+
+  def add(self, email, reason=""):
+      """
+      Add one address to the list.
+      """
+      return self.add_many([email], reason)
+
+  def insert_chunk(self, chunk):
+      # Caller holds self.lock
+      if not chunk:
+          return 0
+      before = self.connection.total_changes
+      self.connection.execute("BEGIN")
+      self.connection.executemany(
+          "INSERT OR IGNORE INTO suppressed (email, reason, added) VALUES (?, ?, ?)", chunk)
+      self.connection.execute("COMMIT")
+      return self.connection.total_changes - before
+
+  def add_bounces(self, messages, soft_limit=SOFT_BOUNCE_LIMIT):
+      """
+      Record the bounces of a batch of bounce messages, given as (digest,
+      bounces) pairs where `digest` identifies the message and `bounces` are
+      (email, kind, status, detail) tuples (kind HARD_BOUNCE or SOFT_BOUNCE). A message recorded before is
+      skipped, so a mailbox can be processed again without counting its
+      bounces twice. Addresses that bounced hard, or soft `soft_limit`
+      times, are added to the list. Returns the (digest, bounces) pairs
+      recorded (those not recorded before) and how many addresses were added.
+      """
+      recorded = []
+      suppress = []
+      now = time.time()
+      with self.lock:
+          self.connection.execute("BEGIN")
+          try:
+              for digest, bounces in messages:
+                  if not self.connection.execute("INSERT OR IGNORE INTO bounce_messages (digest) VALUES (?)",
+                                                 (digest,)).rowcount:
+                      continue
+                  recorded.append((digest, bounces))
+                  for email, kind, status, detail in bounces:
+                      key = suppression_key(email)
+                      hard = kind == HARD_BOUNCE
+                      self.connection.execute(
+                          "INSERT INTO bounces (email, soft, hard, status, detail, last_bounce) VALUES (?, ?, ?, ?, ?, ?) "
+                          "ON CONFLICT(email) DO UPDATE SET soft = soft + excluded.soft, hard = hard + excluded.hard, "
+                          "status = excluded.status, detail = excluded.detail, last_bounce = excluded.last_bounce",
+                          (key, int(not hard), int(hard), status, detail, now))
+                      if hard:
+                          suppress.append((key, f"hard bounce {status or ''}".strip(), now))
+                      elif self.connection.execute("SELECT soft FROM bounces WHERE email = ?",
+                                                   (key,)).fetchone()[0] >= soft_limit:
+                          suppress.append((key, f"{soft_limit} soft bounces", now))
+              self.connection.execute("COMMIT")
+          except BaseException:
+              self.connection.execute("ROLLBACK")
+              raise
+          added = self.insert_chunk(suppress)
+          if added:
+              self.connection.execute(
+                  "INSERT INTO meta (key, value) VALUES ('version', 1) "
+                  "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+              self.index = None
+              self.bloom = None
+      return recorded, added
+
+  def count(self):
+      """
+      Number of suppressed addresses.
+      """
+      return self.connection.execute("SELECT COUNT(*) FROM suppressed").fetchone()[0]
+
+  # --------------------------------------------------------------------
+  # Lookups
+  # --------------------------------------------------------------------
+
+  def load_index(self):
+      """
+      Load the sorted hash array from the sidecar file, rebuilding it if the
+      list changed since it was written or the file belongs to another database
+      (its header holds the store id and the version it was built from).
+      """
+      header = array.array("Q", [self.store_id(), self.version()])
+      if os.path.exists(self.index_path):
+          with open(self.index_path, "rb") as f:
+              written = array.array("Q")
+              try:
+                  written.fromfile(f, len(header))
+              except EOFError:
+                  pass  # truncated, or written before the header had the store id
+              if written == header:
+                  index = array.array("Q")
+                  index.frombytes(f.read())
+                  return index
+
+      index = array.array("Q", sorted(key_hash(email) for (email,) in
+                                      self.connection.execute("SELECT email FROM suppressed")))
+      tmp_path = self.index_path + ".tmp"
+      with open(tmp_path, "wb") as f:
+          header.tofile(f)
+          index.tofile(f)
+      os.replace(tmp_path, self.index_path)
+      return index
+
+  def build_bloom(self, index):
+      """
+      Build a Bloom filter over the index: 16 bits per address, two probes
+      (the two CRC-32 halves of each hash). Returns (bits, mask).
+      """
+      size = 1 << 16
+      while size < len(index) * 16:
+          size <<= 1
+      mask = size - 1
+      bits = bytearray(size >> 3)
+      for value in index:
+          for probe in (value >> 32, value & 0xffffffff):
+              probe &= mask
+              bits[probe >> 3] |= 1 << (probe & 7)
+      return bits, mask
+
+  def confirm(self, key):
+      """
+      Exact lookup of a key in the SQLite store.
+      """
+      return self.connection.execute(
+          "SELECT 1 FROM suppressed WHERE email = ?", (key,)).fetchone() is not None
+
+  def matcher(self):
+      """
+      Return a fast `is_suppressed(key)` function for bulk checks.
+      `key` must already be a suppression key (stripped and lowercased).
+      The function uses the index as it is now; call matcher() again after adding addresses.
+      """
+      with self.lock:
+          if self.index is None:
+              self.index = self.load_index()
+          if self.bloom is None:
+              self.bloom = self.build_bloom(self.index)
+          index = self.index
+          bits, mask = self.bloom
+      size = len(index)
+      crc32 = zlib.crc32
+      bisect_left = bisect.bisect_left
+      confirm = self.confirm
+
+      def is_suppressed(key):
+          data = key.encode("utf-8")
+          high = crc32(data)
+          probe = high & mask
+          if not bits[probe >> 3] & (1 << (probe & 7)):
+              return False
+          low = crc32(data, HASH_SEED)
+          probe = low & mask
+          if not bits[probe >> 3] & (1 << (probe & 7)):
+              return False
+          # Sorted array lookup: O(log n), 8 bytes per suppressed address
+          value = (high << 32) | low
+          position = bisect_left(index, value)
+          # Hash hit: confirm against the exact store
+          return position < size and index[position] == value and confirm(key)
+
+      return is_suppressed
+
+  def __contains__(self, email):
+      return self.matcher()(suppression_key(email))
+
+  def close(self):
+      self.connection.close()
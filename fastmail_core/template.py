@@ -0,0 +1,90 @@
+# Import required modules
+import html
+import re
+
+# ------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------
+
+# Merge fields: {{ name }}, or {{ name | default }} for recipients without a value
+FIELD_RE = re.compile(r"\{\{\s*([^{}|]+?)\s*(?:\|\s*([^{}]*?)\s*)?\}\}")
+
+# Field every recipient has: the address the message is sent to
+EMAIL_FIELD = "email"
+
+# ------------------------------------------------------------------------
+# Merge Templates
+# ------------------------------------------------------------------------
+
+def field_name(name):
+  """
+  Normalize a merge field or CSV column name: fields match columns whatever
+  their case and surrounding spaces.
+  """
+  return " ".join(name.split()).lower()
+
+def escape_value(value):
+  """
+  Escape a recipient's field value for an HTML body.
+  """
+  return html.escape(value, quote=True)
+
+class MergeTemplate:
+  """
+  A subject or body with merge fields, compiled once for a whole campaign into
+  its static text segments and the field slots between them: `segments` has one
+  more entry than `slots`, and each slot is a (field name, default) pair, the
+  default being None if the field has none.
+  """
+
+  def __init__(self, text):
+      self.segments = []
+      self.slots = []
+      position = 0
+      for match in FIELD_RE.finditer(text):
+          self.segments.append(text[position:match.start()])
+          self.slots.append((field_name(match.group(1)), match.group(2)))
+          position = match.end()
+      self.segments.append(text[position:])
+
+  @property
+  def fields(self):
+      """
+      Names of the fields the template uses, in order, without repeats.
+      """
+      return list(dict.fromkeys(name for name, default in self.slots))
+
+  def render(self, values, escape=None):
+      """
+      Fill in the fields from `values` (field name -> text). A field without a
+      value takes its default, or stays empty. `escape` is applied to the values,
+      not to the template's own text (its segments and defaults).
+      """
+      if not self.slots:
+          return self.segments[0]
+      parts = [self.segments[0]]
+      for (name, default), segment in zip(self.slots, self.segments[1:]):
+          value = values.get(name)
+          if value:
+              parts.append(escape(value) if escape is not None else value)
+          elif default:
+              parts.append(default)
+          parts.append(segment)
+      return "".join(parts)
+
+def check_fields(templates, available):
+  """
+  Make sure every field of the templates can be filled in: the recipient list
+  has a column for it (`available`, names as from field_name), it is the
+  recipient's email, or it has a default. Raises ValueError naming the others.
+  """
+  available = set(available) | {EMAIL_FIELD}
+  missing = []
+  for template in templates:
+      for name, default in template.slots:
+          if name not in available and default is None and name not in missing:
+              missing.append(name)
+  if missing:
+      names = ", ".join(f"{{{{{name}}}}}" for name in missing)
+      columns = ", ".join(sorted(available))
+      raise ValueError(f"The recipient list has no column for {names} (available fields: {columns}).")